@@ -0,0 +1,81 @@
+"""Benchmarks catalog.Catalog queries against the nested data_lib loops they replace.
+
+Run from the repository root:
+    python benchmarks/bench_catalog.py
+"""
+import os
+import random
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from lib.catalog import Catalog # pylint: disable=wrong-import-position
+
+REGIONS = ["oklahoma", "colorado", "michigan", "california"]
+CATEGORIES = ["Flower", "Edible", "Concentrate", "Vape Pens", "Pre Roll", "Topicals"]
+
+
+def synthetic_data_lib(subregions, listings=40, items=150, seed=1):
+    rng = random.Random(seed)
+    data_lib = {}
+    for index in range(subregions):
+        region = REGIONS[index % len(REGIONS)]
+        subregion = f"{region}-{index}"
+        shops = {}
+        for shop in range(listings):
+            slug = f"{subregion}-shop-{shop}"
+            menu = {f"{slug}-{n}": {"id": hash((slug, n)), "slug": f"{slug}-{n}",
+                "category": {"name": rng.choice(CATEGORIES)},
+                "price": {"price": round(rng.uniform(5, 120), 2), "unit": "g"}}
+                for n in range(items)}
+            shops[slug] = {"id": hash(slug), "slug": slug, "menu": menu}
+        data_lib.setdefault(region, {})[subregion] = {"slug": subregion, "region": region,
+            "listings": shops}
+    return data_lib
+
+
+def scan(data_lib, region, category, max_price):
+    found = []
+    for subregion in data_lib[region].values():
+        for listing in subregion["listings"].values():
+            for item in listing["menu"].values():
+                if item["category"]["name"] == category and item["price"]["price"] <= max_price:
+                    found.append((listing["slug"], item))
+    return found
+
+
+def timed(function, *args, repeat=1, **kwargs):
+    """Best time of repeat calls, and the result."""
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        result = function(*args, **kwargs)
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    print(f"{'items':>9} {'index':>8} {'refresh':>9} {'scan':>9} {'query':>9} "
+        f"{'narrow':>9} {'matches':>8}")
+    for subregions in (4, 16, 64):
+        data_lib = synthetic_data_lib(subregions)
+        catalog = Catalog()
+        indexing, counts = timed(catalog.index, data_lib)
+        # Re-ingesting one listing's menu, as the actors do after each download
+        listing = next(iter(data_lib["oklahoma"]["oklahoma-0"]["listings"].values()))
+        refresh, _ = timed(catalog.on_menu, "oklahoma", "oklahoma-0", listing["slug"],
+            list(listing["menu"].values()))
+        scanning, expected = timed(scan, data_lib, "oklahoma", "Flower", 30, repeat=5)
+        querying, found = timed(catalog.items, region="oklahoma", category="Flower",
+            max_price=30, repeat=5)
+        narrow, _ = timed(catalog.items, subregion="oklahoma-0", category="Flower",
+            max_price=10, repeat=5)
+        assert len(found) == len(expected)
+        print(f"{counts['items']:>9} {indexing:7.2f}s {refresh * 1e3:7.2f}ms "
+            f"{scanning * 1e3:7.1f}ms {querying * 1e3:7.1f}ms {narrow * 1e3:7.2f}ms "
+            f"{len(found):>8}")
+
+
+if __name__ == "__main__":
+    main()
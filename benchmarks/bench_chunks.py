@@ -0,0 +1,70 @@
+"""Compares the peak memory of exporting every menu of a sharded library as one frame against
+streaming it through util.iter_frames in bounded chunks.
+
+Run from the repository root:
+    python benchmarks/bench_chunks.py [items] [subregions] [chunk_rows]
+"""
+import os
+import sys
+import tempfile
+import tracemalloc
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import pandas as pd # pylint: disable=wrong-import-position
+from lib import export # pylint: disable=wrong-import-position
+from lib import shards # pylint: disable=wrong-import-position
+from lib import util # pylint: disable=wrong-import-position
+from bench_frames import synthetic_subregion # pylint: disable=wrong-import-position
+
+
+def whole(directory, path):
+    # In this process, so tracemalloc sees it; build_frames would use a process pool
+    data_lib = shards.load_shards(directory)
+    menus = pd.concat([util.menus_frame(data_lib[region][slug]) for region in data_lib
+        for slug in data_lib[region]], ignore_index=True)
+    menus.to_csv(path)
+    return len(menus)
+
+
+def streamed(directory, path, chunk_rows):
+    frames = util.iter_frames(shards.load_shards(directory), "menus", chunk_rows=chunk_rows)
+    return export.write_csv_chunks(frames, path)
+
+
+def measure(function, *args):
+    tracemalloc.start()
+    start = perf_counter()
+    rows = function(*args)
+    elapsed = perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return rows, elapsed, peak
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    subregions = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    chunk_rows = int(sys.argv[3]) if len(sys.argv) > 3 else util.default_chunk_rows // 10
+    with tempfile.TemporaryDirectory() as directory:
+        data_lib = {"oklahoma": {}}
+        for i in range(subregions):
+            subregion = synthetic_subregion(count // subregions)
+            subregion["slug"] = f"subregion-{i}"
+            data_lib["oklahoma"][subregion["slug"]] = subregion
+        shards.save_shards(data_lib, os.path.join(directory, "shards"))
+        del data_lib
+        shard_dir = os.path.join(directory, "shards")
+        rows, whole_time, whole_peak = measure(whole, shard_dir,
+            os.path.join(directory, "whole.csv"))
+        chunked, chunk_time, chunk_peak = measure(streamed, shard_dir,
+            os.path.join(directory, "chunked.csv"), chunk_rows)
+    assert rows == chunked
+    print(f"{rows} menu items in {subregions} shards, chunks of {chunk_rows} rows")
+    print(f"one frame: {whole_time:7.2f}s  peak {whole_peak / 2**20:8.1f} MiB")
+    print(f"streamed:  {chunk_time:7.2f}s  peak {chunk_peak / 2**20:8.1f} MiB")
+    print(f"{whole_peak / chunk_peak:.1f}x less memory")
+
+
+if __name__ == "__main__":
+    main()
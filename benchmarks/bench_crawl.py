@@ -0,0 +1,125 @@
+"""End to end crawl benchmarks against the local mockapi.MockWeedMaps server.
+
+Each scenario runs the steps of Snooper.main() - subregions, listings, menus, deals and the
+Dataframes - in a fresh process against a mock server, and reports requests/s, items/s,
+peak RSS and wall time. Results can be saved and later compared against as a baseline;
+the run fails if items/s drops by more than the tolerance.
+
+Run from the repository root:
+    python benchmarks/bench_crawl.py [--scale N] [--rate R] [--json out.json]
+        [--baseline old.json] [--tolerance 0.2] [scenario ...]
+"""
+import argparse
+import io
+import json
+import os
+import resource
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from lib import common # pylint: disable=wrong-import-position
+from lib import mockapi # pylint: disable=wrong-import-position
+from lib import util # pylint: disable=wrong-import-position
+from lib.ratelimit import RateLimiter # pylint: disable=wrong-import-position
+from snooper import Snooper # pylint: disable=wrong-import-position
+
+REGION = "oklahoma"
+
+# name: (MockWeedMaps options, concurrent menus)
+scenarios = {
+    "serial": ({}, False),
+    "concurrent": ({}, True),
+    "latency": ({"latency": 0.02}, True),
+    "faults": ({"latency": 0.005, "error_rate": 0.02, "throttle_rate": 0.02}, True),
+}
+
+
+def crawl(name, scale, rate):
+    options, concurrent = scenarios[name]
+    common.limiter = RateLimiter(rate, burst=int(rate), max_rate=rate)
+    common.retry_backoff = 0.05
+    with mockapi.MockWeedMaps([REGION], subregions=2 * scale, **options) as server:
+        common.transport = mockapi.MockTransport(server.url, common.pool_size)
+        start = perf_counter()
+        with redirect_stdout(io.StringIO()):
+            app = Snooper()
+            app.data_lib = {}
+            app.Regions.get_subregions(REGION)
+            app.Regions.get_listings()
+            app.Regions.get_menus(concurrent=concurrent)
+            app.Regions.get_deals()
+            rows = 0
+            for subregion in app.data_lib[REGION].values():
+                rows += sum(len(frame) for frame in util.subregion_frames(subregion).values())
+        wall = perf_counter() - start
+        expected = server.expected()
+        stats = dict(server.stats)
+    items = expected["listings"] + expected["menu_items"] + expected["deals"]
+    return {
+        "scenario": name,
+        "wall_time": wall,
+        "requests": stats["requests"],
+        "requests_per_second": stats["requests"] / wall,
+        "items": rows,
+        "items_per_second": rows / wall,
+        "complete": rows == items,
+        "errors": stats["errors"],
+        "throttled": stats["throttled"],
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def compare(results, baseline, tolerance):
+    previous = {result["scenario"]: result for result in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get(result["scenario"])
+        if old and result["items_per_second"] < old["items_per_second"] * (1 - tolerance):
+            regressions.append(f"{result['scenario']}: {old['items_per_second']:.0f} -> "
+                f"{result['items_per_second']:.0f} items/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("scenarios", nargs="*", default=list(scenarios))
+    parser.add_argument("--scale", type=int, default=1, help="two subregions per unit")
+    parser.add_argument("--rate", type=float, default=500.0, help="limiter requests/s")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'scenario':<12}{'wall s':>8}{'requests':>10}{'req/s':>9}{'items/s':>11}"
+        f"{'RSS MiB':>9}  notes")
+    for name in args.scenarios:
+        # A fresh process per scenario keeps peak RSS and module state separate
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            result = pool.submit(crawl, name, args.scale, args.rate).result()
+        results.append(result)
+        notes = "" if result["complete"] else "INCOMPLETE "
+        if result["errors"] or result["throttled"]:
+            notes += f"{result['errors']} errors, {result['throttled']} throttled"
+        print(f"{name:<12}{result['wall_time']:>8.2f}{result['requests']:>10}"
+            f"{result['requests_per_second']:>9.1f}{result['items_per_second']:>11.0f}"
+            f"{result['peak_rss_mib']:>9.1f}  {notes}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf8") as out_file:
+            json.dump(results, out_file, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf8") as in_file:
+            regressions = compare(results, json.load(in_file), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
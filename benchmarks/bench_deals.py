@@ -0,0 +1,73 @@
+"""Benchmarks WMRegions.merge_deals against the quadratic scan it replaced.
+
+Run from the repository root:
+    python benchmarks/bench_deals.py
+"""
+import io
+import os
+import sys
+from contextlib import redirect_stdout
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from lib import actors # pylint: disable=wrong-import-position
+
+SUBREGIONS = 50
+
+
+class Controller:
+    def __init__(self):
+        self.data_lib = {"oklahoma": {f"subregion-{i}": {"slug": f"subregion-{i}"}
+            for i in range(SUBREGIONS)}}
+
+    def notify(self, event, *args):
+        pass
+
+
+def synthetic_batches(total):
+    """Every subregion query returns its own deals plus a quarter of its neighbour's."""
+    per_subregion = total // SUBREGIONS
+    batches = []
+    for i in range(SUBREGIONS):
+        batch = []
+        for owner in (i, (i + 1) % SUBREGIONS):
+            count = per_subregion if owner == i else per_subregion // 4
+            for j in range(count):
+                deal_id = owner * per_subregion + j
+                batch.append({"id": deal_id, "slug": f"deal-{deal_id}",
+                    "listing": {"region": {"slug": f"subregion-{owner}"}}})
+        batches.append(batch)
+    return batches
+
+
+def quadratic_merge(controller, batches):
+    subregions = controller.data_lib["oklahoma"]
+    for subregion in subregions:
+        subregions[subregion]['deals'] = []
+    for deals in batches:
+        for deal in deals:
+            bucket = subregions[deal['listing']['region']['slug']]['deals']
+            if not any(d['id'] == deal['id'] for d in bucket):
+                bucket.append(deal)
+
+
+def timed(function, *args):
+    start = perf_counter()
+    function(*args)
+    return perf_counter() - start
+
+
+def main():
+    print(f"{'deals':>8} {'merge_deals':>12} {'per deal':>10} {'quadratic':>10}")
+    for total in (12_500, 25_000, 50_000, 100_000, 200_000):
+        batches = synthetic_batches(total)
+        regions = actors.WMRegions(Controller())
+        with redirect_stdout(io.StringIO()):
+            indexed = timed(regions.merge_deals, "oklahoma", batches)
+        quadratic = timed(quadratic_merge, Controller(), batches) if total <= 25_000 else None
+        quadratic = f"{quadratic:9.3f}s" if quadratic is not None else f"{'-':>10}"
+        print(f"{total:>8} {indexed:11.3f}s {indexed / total * 1e6:8.2f}us {quadratic}")
+
+
+if __name__ == "__main__":
+    main()
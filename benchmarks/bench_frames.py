@@ -0,0 +1,86 @@
+"""Compares SnooperToPandas.subregion_menus against the json_normalize approach it replaced,
+then building the frames of many subregions serially against util.build_frames.
+
+Run from the repository root:
+    python benchmarks/bench_frames.py [items] [subregions]
+"""
+import io
+import json
+import os
+import sys
+import tracemalloc
+from contextlib import redirect_stdout
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import pandas as pd # pylint: disable=wrong-import-position
+from lib import util # pylint: disable=wrong-import-position
+from bench_records import synthetic_payload # pylint: disable=wrong-import-position
+
+ITEMS_PER_LISTING = 500
+
+
+class Controller:
+    def __init__(self, subregion):
+        self.selected_subregion = subregion
+
+
+def synthetic_subregion(count):
+    items = json.loads(synthetic_payload(count))
+    listings = {}
+    for start in range(0, count, ITEMS_PER_LISTING):
+        slug = f"listing-{start // ITEMS_PER_LISTING}"
+        listings[slug] = {"slug": slug, "menu": {item["slug"]: item
+            for item in items[start:start + ITEMS_PER_LISTING]}}
+    return {"slug": "oklahoma-city", "region": "oklahoma", "listings": listings}
+
+
+def json_normalize_menus(subregion):
+    data = []
+    for listing in subregion["listings"].values():
+        for item in listing["menu"].values():
+            item["listing"] = listing["slug"]
+            data.append(item)
+    return pd.json_normalize(data)[util.SnooperToPandas.menu_columns]
+
+
+def measure(function, *args):
+    tracemalloc.start()
+    start = perf_counter()
+    with redirect_stdout(io.StringIO()):
+        frame = function(*args)
+    elapsed = perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return frame, elapsed, peak
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    subregion = synthetic_subregion(count)
+    pandas = util.SnooperToPandas(Controller(subregion))
+    new, new_time, new_peak = measure(pandas.subregion_menus)
+    old, old_time, old_peak = measure(json_normalize_menus, subregion)
+    pd.testing.assert_frame_equal(new, old)
+    print(f"{count} menu items, frames identical")
+    print(f"json_normalize: {old_time:7.2f}s  peak {old_peak / 2**20:8.1f} MiB")
+    print(f"build_frame:    {new_time:7.2f}s  peak {new_peak / 2**20:8.1f} MiB")
+    print(f"speedup {old_time / new_time:.1f}x, {old_peak / new_peak:.1f}x less memory")
+
+    subregions = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    data_lib = {"oklahoma": {f"subregion-{i}": synthetic_subregion(count // subregions)
+        for i in range(subregions)}}
+    start = perf_counter()
+    serial = [util.subregion_frames(subregion) for subregion in data_lib["oklahoma"].values()]
+    serial_time = perf_counter() - start
+    start = perf_counter()
+    batch = util.build_frames(data_lib)
+    batch_time = perf_counter() - start
+    assert len(batch["menus"]) == sum(len(frames["menus"]) for frames in serial)
+    print(f"{subregions} subregions on {os.cpu_count()} CPUs")
+    print(f"serial:       {serial_time:7.2f}s")
+    print(f"build_frames: {batch_time:7.2f}s  ({serial_time / batch_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
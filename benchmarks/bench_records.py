@@ -0,0 +1,75 @@
+"""Measures the memory held by raw menu payloads against compact records.Record projections.
+
+Run from the repository root:
+    python benchmarks/bench_records.py [items]
+"""
+import json
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from lib import records # pylint: disable=wrong-import-position
+
+CATEGORIES = ["Flower", "Edible", "Concentrate", "Vape", "Pre-Roll", "Topical", "Tincture"]
+
+
+def synthetic_payload(count):
+    """A JSON page of menu items shaped like the menu_items endpoint, nested fields included."""
+    rng = random.Random(0)
+    items = []
+    for i in range(count):
+        category = rng.choice(CATEGORIES)
+        items.append({
+            "id": i,
+            "slug": f"item-{i}",
+            "name": f"Item {i} {category}",
+            "description": f"A long product description for item {i}. " * 8,
+            "category": {"id": CATEGORIES.index(category), "name": category,
+                "slug": category.lower()},
+            "edge_category": {"id": 1, "name": category, "slug": category.lower(),
+                "ancestors": [{"id": 0, "name": "Cannabis", "slug": "cannabis"}]},
+            "price": {"price": round(rng.uniform(5, 80), 2), "unit": "g", "label": "1g",
+                "quantity": 1, "on_sale": False, "original_price": None},
+            "prices": {"gram": [{"price": 10, "units": "1", "label": "1g"}],
+                "ounce": [{"price": 200, "units": "1", "label": "1oz"}]},
+            "reviews_count": rng.randint(0, 500),
+            "rating": round(rng.uniform(0, 5), 1),
+            "is_endorsed": False,
+            "is_badged": rng.random() < 0.1,
+            "created_at": "2023-01-01T00:00:00.000Z",
+            "updated_at": "2023-06-01T00:00:00.000Z",
+            "avatar_image": {"original_url": f"https://images.test/{i}.jpg",
+                "small_url": f"https://images.test/{i}-s.jpg"},
+            "images": [{"url": f"https://images.test/{i}-{j}.jpg"} for j in range(3)],
+            "facets": {"categories": [{"id": 1, "name": category}]},
+            "genetics_tag": {"name": rng.choice(["Indica", "Sativa", "Hybrid"])},
+        })
+    return json.dumps(items)
+
+
+def measure(build):
+    tracemalloc.start()
+    held = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, held
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    payload = synthetic_payload(count)
+    raw_size, raw = measure(lambda: json.loads(payload))
+    del raw
+    compact_size, compact = measure(lambda: [records.project("menu", item)
+        for item in json.loads(payload)])
+    print(f"{count} menu items")
+    print(f"raw dicts:       {raw_size / 2**20:8.1f} MiB ({raw_size / count:6.0f} B/item)")
+    print(f"compact records: {compact_size / 2**20:8.1f} MiB ({compact_size / count:6.0f} B/item)")
+    print(f"reduction:       {raw_size / compact_size:8.1f}x")
+    assert len(compact) == count
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Cold start benchmarks of the snooper command line.
+
+Each case starts a fresh interpreter several times and reports the median and fastest wall
+time, and which of pandas, requests and pyarrow it loaded. The slowest imports of a case can
+be listed with -X importtime. Results can be saved and later compared against as a
+baseline; the run fails if a median grows by more than the tolerance.
+
+Run from the repository root:
+    python benchmarks/bench_startup.py [--runs N] [--imports N] [--json out.json]
+        [--baseline old.json] [--tolerance 0.25] [case ...]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from time import perf_counter
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+HEAVY = ("pandas", "requests", "pyarrow")
+REPORT = f"import sys; print(','.join(m for m in {HEAVY!r} if m in sys.modules))"
+
+# name: code run with python -c from src
+cases = {
+    "interpreter": "pass",
+    "import": "import snooper",
+    "help": "import snooper, contextlib, io\n"
+        "with contextlib.suppress(SystemExit), contextlib.redirect_stdout(io.StringIO()):\n"
+        "    snooper.cli(['--help'])",
+    "list-regions": "import snooper, contextlib, io\n"
+        "with contextlib.redirect_stdout(io.StringIO()):\n"
+        "    snooper.cli(['list', 'regions'])",
+    # Reference: what every command paid before pandas was imported lazily
+    "import-pandas": "import snooper\nfrom lib import util",
+}
+
+
+def run(code, importtime=False):
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + \
+        ["-c", code + "\n" + REPORT]
+    start = perf_counter()
+    result = subprocess.run(command, cwd=SRC, capture_output=True, text=True, check=True)
+    return perf_counter() - start, result
+
+
+def slowest_imports(code, count):
+    _, result = run(code, importtime=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line and "cumulative" not in line:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            # Only top level imports, their cumulative time includes what they import
+            if not name[1:].startswith(" "):
+                imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def measure(name, runs):
+    times = []
+    for _ in range(runs):
+        seconds, result = run(cases[name])
+        times.append(seconds)
+    loaded = result.stdout.strip().splitlines()[-1] if result.stdout.strip() else ""
+    return {
+        "case": name,
+        "median_ms": statistics.median(times) * 1000,
+        "min_ms": min(times) * 1000,
+        "loaded": [module for module in loaded.split(",") if module],
+    }
+
+
+def compare(results, baseline, tolerance):
+    previous = {result["case"]: result for result in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get(result["case"])
+        if old and result["median_ms"] > old["median_ms"] * (1 + tolerance):
+            regressions.append(f"{result['case']}: {old['median_ms']:.0f} -> "
+                f"{result['median_ms']:.0f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("cases", nargs="*", default=list(cases))
+    parser.add_argument("--runs", type=int, default=10, help="interpreters started per case")
+    parser.add_argument("--imports", type=int, default=0,
+        help="also list this many of the slowest imports of each case")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'case':<16}{'median ms':>11}{'min ms':>9}  loaded")
+    for name in args.cases:
+        result = measure(name, args.runs)
+        results.append(result)
+        print(f"{name:<16}{result['median_ms']:>11.1f}{result['min_ms']:>9.1f}  "
+            f"{', '.join(result['loaded']) or '-'}")
+        if args.imports:
+            for micros, module in slowest_imports(cases[name], args.imports):
+                print(f"{'':<16}{micros / 1000:>11.1f}  {module}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf8") as out_file:
+            json.dump(results, out_file, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf8") as in_file:
+            regressions = compare(results, json.load(in_file), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
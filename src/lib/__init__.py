@@ -2,4 +2,22 @@
     1. actors
     2. common
     3. util
+    4. ratelimit
+    5. transport
+    6. cache
+    7. stream
+    8. export
+    9. storage
+    10. shards
+    11. records
+    12. paging
+    13. mockapi
+    14. metrics
+    15. jobs
+    16. coordinator
+    17. history
+    18. catalog
+    19. scheduler
+    20. planner
+    21. manifest
 """
\ No newline at end of file
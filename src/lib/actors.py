@@ -4,6 +4,14 @@
         1. regions
             - A list of strings representing each region available in WeedMaps that is supported by
                 snooper.
+        2. delta_fields
+            - Listing fields compared by incremental crawls to decide whether a menu changed.
+
+    List of Functions
+        1. listing_fingerprint
+            - Returns the values of delta_fields for a listing.
+        2. compact
+            - Projects an API record into a compact record when common.compact_records is set.
 
     List of Classes
         1. WMRegions
@@ -12,9 +20,12 @@
         4. WMDeals
         5. WMMenus
 """
-from time import sleep
+import threading
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from lib import common
+from lib import paging
+from lib import records
 
 regions = ["alabama","alaska","arizona","arkansas","california","colorado","connecticut","delaware",
 "florida","georgia","hawaii","idaho","illinois","indiana","iowa","kansas","kentucky","louisiana",
@@ -24,6 +35,43 @@ regions = ["alabama","alaska","arizona","arkansas","california","colorado","conn
 "south-dakota","tennessee","texas","utah","vermont","virginia","washington","washington-dc",
 "west-virginia","wisconsin","wyoming"]
 
+delta_fields = ["menu_items_count", "verified_menu_items_count", "updated_at", "menu_updated_at"]
+
+def listing_fingerprint(listing):
+    """
+    Summarises the parts of a listing that change whenever its menu changes.
+
+    Parameters
+    ----------
+    listing : dict
+        A listing as returned by the dispensaries endpoint.
+
+    Returns
+    -------
+    fingerprint : list
+        The value of every field in delta_fields, None where a field is missing.
+    """
+    return [listing.get(field) for field in delta_fields]
+
+def compact(kind, data):
+    """
+    Projects an API record into its records.Record type when common.compact_records is set.
+
+    Parameters
+    ----------
+    kind : str
+        One of 'listing', 'menu' or 'deal'.
+    data : dict
+        The record returned by the API.
+
+    Returns
+    -------
+    record : dict or records.Record
+    """
+    if common.compact_records:
+        return records.project(kind, data, common.keep_raw_records)
+    return data
+
 class WMRegions:
     """
     A class used to represent the primary application of the snooper package.
@@ -50,13 +98,16 @@ class WMRegions:
             print(f"Region Count: {len(regions)}")
         return regions
 
-    def get_listings(self):
+    def get_listings(self, incremental=False):
         for region in regions:
             try:
                 for subregion in self.controller.data_lib[region]:
                     print(f"Downloading all listings for {subregion}")
                     subregion = self.controller.data_lib[region][subregion]
-                    self.SubRegions.get_listings(subregion)
+                    try:
+                        self.SubRegions.get_listings(subregion, incremental)
+                    except common.RequestError as error:
+                        print(f"Skipping listings for {subregion['slug']}: {error}")
             except KeyError:
                 print(f"{region} has not been initialized, skipping!")
 
@@ -70,36 +121,92 @@ class WMRegions:
 
         for region in self.controller.data_lib:
             print(f"Region: {region}")
-            subregions = self.controller.data_lib[region]
-            for subregion in subregions:
-                print(f"Resetting deals in {subregion}")
-                self.controller.data_lib[region][subregion]['deals']=[]
-
-            for subregion in subregions:
-                print(f"\nParsing deals downloaded from {subregion}")
-                sr_str = subregion
-                deals = self.SubRegions.get_deals(subregions[subregion])
-                for deal in deals:
-                    try:
-                        subregion_slug = deal['listing']['region']['slug']
-                        # if 'deals' not in self.controller.data_lib[region][subregion_slug].keys():
-                        #     self.controller.data_lib[region][subregion_slug]['deals']=[]
-
-                        if not any(d['id'] == deal['id'] for d in \
-                            self.controller.data_lib[region][subregion_slug]['deals']):
-                            self.controller.data_lib[region][subregion_slug]['deals'].append(deal)
-                            print(f"- Added deal from {sr_str} to {subregion_slug}") # DEBUG
-                    except KeyError:
-                        print("Uh Oh! It appears that there is a deal with corrupted json!\
-                            \nDon't worry, we just skipped it for you ;)")
-                        sleep(2)
-            for subregion in subregions:
-                print(f"Sorting deals for {subregion}")
-                new_deals = {}
-                for deal in self.controller.data_lib[region][subregion]['deals']:
-                    new_deals[deal['slug']] = deal
-                new_deals = OrderedDict(sorted(new_deals.items(), key=lambda t: t[0]))
-                self.controller.data_lib[region][subregion]['deals'] = new_deals
+            self.fetch_deals(region)
+
+    def fetch_deals(self, region):
+        """
+        Downloads the deals of every subregion of a region and merges them. When
+        common.deal_planner is set, the queries it expects to be redundant are skipped
+        and what the others return is reported back to it.
+
+        Parameters
+        ----------
+        region : str
+            Slug of a region whose subregions are in data_lib.
+
+        Returns
+        -------
+        merged : int
+            Number of unique deals stored.
+        """
+        subregions = self.controller.data_lib[region]
+        planner = common.deal_planner
+        queried = list(subregions) if planner is None else planner.plan(region, subregions)[0]
+        results = {}
+        failed = []
+        for subregion in queried:
+            print(f"\nDownloading deals from {subregion}")
+            try:
+                results[subregion] = self.SubRegions.get_deals(subregions[subregion])
+            except common.RequestError as error:
+                print(f"Skipping deals for {subregion}: {error}")
+                failed.append(subregion)
+        if planner is not None:
+            planner.observe(region, results)
+        return self.merge_deals(region, results.values(),
+            [subregion for subregion in subregions if subregion not in failed])
+
+    def merge_deals(self, region, batches, fetched=None):
+        """
+        Files every downloaded deal under the subregion of its listing in a single pass.
+
+        Deals are deduplicated by id across every subregion of the region and stored in
+        each subregion's 'deals' dict keyed by deal slug, in the order they were first seen.
+        Sorting is left to whatever outputs them.
+
+        Parameters
+        ----------
+        region : str
+            Slug of the region the deals were downloaded for.
+        batches : iterable
+            Lists of deals, one per subregion query.
+        fetched : iterable
+            Slugs of the subregions whose deals the batches hold completely, None for every
+            subregion. Only their deals are replaced and reported to the sinks; deals found
+            for any other subregion, such as one whose query failed, are added to what it
+            already holds.
+
+        Returns
+        -------
+        merged : int
+            Number of unique deals stored.
+        """
+        subregions = self.controller.data_lib[region]
+        fetched = list(subregions) if fetched is None else \
+            [subregion for subregion in fetched if subregion in subregions]
+        for subregion in fetched:
+            subregions[subregion]['deals'] = {}
+        seen = set()
+        corrupted = 0
+        for deals in batches:
+            for deal in deals:
+                try:
+                    if deal['id'] in seen:
+                        continue
+                    subregions[deal['listing']['region']['slug']].setdefault('deals', {})[
+                        deal['slug']] = compact('deal', deal)
+                    seen.add(deal['id'])
+                except (KeyError, TypeError):
+                    corrupted += 1
+        common.metrics.ingested('deals', len(seen))
+        if corrupted:
+            print(f"Uh Oh! It appears that {corrupted} deals had corrupted json!\
+                \nDon't worry, we just skipped them for you ;)")
+        for subregion in fetched:
+            print(f"- {subregion}: {len(subregions[subregion]['deals'])} deals") # DEBUG
+            self.controller.notify('deals', region, subregion,
+                subregions[subregion]['deals'].values())
+        return len(seen)
 
     def get_subregions(self, region):
         url = common.url_construct(common.url_library['subregions']['url'], region)
@@ -107,19 +214,39 @@ class WMRegions:
         if region not in self.controller.data_lib.keys():
             self.controller.data_lib[region] = {}
         subregions = common.get_request(url)['data']['subregions']
+        common.metrics.ingested('subregions', len(subregions))
         print(f"Downloading subregions for {region}...")
-        sleep(common.rest_call_delay)
         for subregion in subregions:
             subregion['region'] = region
-            self.controller.data_lib[region][subregion['slug']] = subregion
+            if subregion['slug'] in self.controller.data_lib[region]:
+                # Refresh in place so previously downloaded listings and deals are kept
+                self.controller.data_lib[region][subregion['slug']].update(subregion)
+            else:
+                self.controller.data_lib[region][subregion['slug']] = subregion
+        self.controller.notify('subregions', region, subregions)
 
-    def get_menus(self):
+    def get_menus(self, concurrent=False, incremental=False):
+        if concurrent:
+            # One pool for every subregion so the concurrency cap is global
+            listings = []
+            for region in regions:
+                try:
+                    for subregion in self.controller.data_lib[region]:
+                        subregion = self.controller.data_lib[region][subregion]
+                        try:
+                            listings.extend(subregion['listings'].values())
+                        except KeyError:
+                            print(f"Sorry, but no listings have been loaded for {subregion['slug']}")
+                except KeyError:
+                    print(f"{region} has no subregions loaded")
+            self.controller.SubRegions.Dispensaries.get_menus(listings, incremental=incremental)
+            return
         for region in regions:
             try:
 
                 for subregion in self.controller.data_lib[region]:
                     subregion = self.controller.data_lib[region][subregion]
-                    self.controller.SubRegions.get_menus(subregion)
+                    self.controller.SubRegions.get_menus(subregion, incremental=incremental)
             except KeyError:
                 print(f"{region} has no subregions loaded")
 
@@ -138,62 +265,71 @@ class WMSubRegions:
             sr_list = None
         return sr_list
 
-    def get_menus(self, subregion):
+    def get_menus(self, subregion, concurrent=False, incremental=False):
         try:
             listings = subregion['listings']
             print(f"Getting all menus for {subregion['slug']}")
+            if concurrent:
+                self.Dispensaries.get_menus(listings.values(), incremental=incremental)
+                return
             for listing in listings:
                 listing = subregion['listings'][listing]
-                self.Dispensaries.get_menu(listing)
+                try:
+                    self.Dispensaries.get_menu(listing, incremental)
+                except common.RequestError as error:
+                    print(f"Skipping menu for {listing['slug']}: {error}")
         except KeyError:
             print(f"Sorry, but no listings have been loaded for {subregion['slug']}")
 
     def get_deals(self, subregion):
-        self.controller.data_lib[subregion['region']][subregion['slug']]['deals']=[]
-        url = common.url_construct(common.url_library["deals"]['url'], subregion['id'])
-        rest_return = common.get_request(url)
-        sleep(common.rest_call_delay)
-        return rest_return['data']['deals']
+        # merge_deals replaces the stored deals, so a failed query leaves them alone
+        deals, _ = paging.fetch_pages(
+            lambda page: common.url_construct(common.url_library["deals"]['url'],
+                subregion['id'], page + 1),
+            lambda rest_return: rest_return['data']['deals'],
+            lambda rest_return: rest_return.get('meta', {}).get('total_deals'),
+            key='id', label=f"deals for {subregion['slug']}")
+        return deals
 
-    def get_listings(self, subregion):
+    def get_listings(self, subregion, incremental=False):
         region = subregion['region']
-        listings_processed = 0
-        total_listings = None
-        rest_return = None
+        previous = self.controller.data_lib[region][subregion['slug']].get('listings')
+        if not isinstance(previous, dict):
+            previous = {}
         self.controller.data_lib[region][subregion['slug']]['listings']=[]
         print(f"Downloading listings for {subregion['slug']}")
-        while True:
-            url = common.url_construct(common.url_library['dispensaries']['url'],
-                listings_processed, subregion['slug'])
-            if rest_return is None:
-                rest_return = common.get_request(url)
-                sleep(common.rest_call_delay)
-            if total_listings is None:
-                total_listings = rest_return['meta']['total_listings']
-            elif total_listings == 0 or listings_processed == total_listings:
-                for listing in self.controller.data_lib[region][subregion['slug']]['listings']:
-                    listing['region']=region
-                    listing['subregion']=subregion['slug']
-                break
-            elif total_listings > 0:
-                self.controller.data_lib[region][subregion['slug']]['listings'].extend(
-                    rest_return['data']['listings'])
-                listings_processed+=len(rest_return['data']['listings'])
-                if listings_processed != total_listings:
-                    rest_return = None
+        listings, _ = paging.fetch_pages(
+            lambda page: common.url_construct(common.url_library['dispensaries']['url'],
+                page * common.page_size, subregion['slug']),
+            lambda rest_return: rest_return['data']['listings'],
+            lambda rest_return: rest_return['meta']['total_listings'],
+            label=f"listings for {subregion['slug']}")
+        common.metrics.ingested('listings', len(listings))
+        for listing in listings:
+            listing['region']=region
+            listing['subregion']=subregion['slug']
+        self.controller.data_lib[region][subregion['slug']]['listings'] = listings
         new_listings = {}
         for listing in self.controller.data_lib[region][subregion['slug']]['listings']:
+            listing = compact('listing', listing)
             new_listings[listing['slug']] = listing
+            if incremental and 'menu' in previous.get(listing['slug'], {}):
+                # Keep the old menu; get_menu decides whether it is still current
+                listing['menu'] = previous[listing['slug']]['menu']
+                listing['menu_fingerprint'] = previous[listing['slug']].get('menu_fingerprint')
 
         # Sort the dictionary
         new_listings = OrderedDict(sorted(new_listings.items(), key=lambda t: t[0]))
         self.controller.data_lib[region][subregion['slug']]['listings'] = new_listings
+        self.controller.notify('listings', region, subregion['slug'], new_listings.values())
     def load_listings(self, subregion):
         return self.controller.data_lib[subregion['region']][subregion['slug']]['listings']
 
 class WMDispensaries:
     def __init__(self, controller):
         self.controller = controller
+        self.delta = {"checked": 0, "skipped": 0, "requests_avoided": 0}
+        self._delta_lock = threading.Lock()
     def list(self, subregion, menu_filter=False):
         total = 0
         for listing in subregion['listings']:
@@ -205,39 +341,108 @@ class WMDispensaries:
                 total+=1
         print(f"Total Listings: {total}")
 
-    def get_menu(self, listing):
-        print(listing)
-        print(f"Downloading menu for {listing['slug']}")
+    def get_menus(self, listings, workers=None, incremental=False):
+        """
+        Downloads the menus of many listings in parallel using a bounded pool of workers.
+
+        Parameters
+        ----------
+        listings : iterable
+            Listing dicts as stored in data_lib; each menu is written back the same way
+            get_menu does.
+        workers : int
+            Maximum number of menus fetched at once. Defaults to common.max_workers.
+        incremental : boolean
+            Skip listings whose menu has not changed since it was last downloaded.
+
+        Returns
+        -------
+        failed : list
+            Slugs of the listings whose menu could not be downloaded.
+        """
+        if workers is None:
+            workers = common.max_workers
+        failed = []
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(self.get_menu, listing, incremental): listing['slug']
+                for listing in listings}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except KeyError:
+                    print(f"Uh Oh! The menu for {futures[future]} came back corrupted, skipping!")
+                    failed.append(futures[future])
+                except common.RequestError as error:
+                    print(f"Skipping menu for {futures[future]}: {error}")
+                    failed.append(futures[future])
+        return failed
+
+    def is_current(self, listing):
+        """
+        Checks whether a listing's stored menu was downloaded for its current fingerprint.
+
+        Parameters
+        ----------
+        listing : dict
+            A listing as stored in data_lib.
+
+        Returns
+        -------
+        current : boolean
+        """
+        return 'menu' in listing and listing.get('menu_fingerprint') == listing_fingerprint(listing)
+
+    def report_delta(self):
+        """
+        Prints and returns how many menu downloads incremental crawls avoided.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        delta : dict
+        """
+        print(f"Incremental menus: {self.delta['skipped']} of {self.delta['checked']} unchanged, "
+            f"{self.delta['requests_avoided']} requests avoided")
+        return dict(self.delta)
+
+    def get_menu(self, listing, incremental=False):
         region = listing['region']
         subregion = listing['subregion']
-        items_processed = 0
-        total_menu_items = None
-        rest_return = None
-        page=1
-        self.controller.data_lib[region][subregion]['listings'][listing['slug']]['menu']=[]
-        while True:
-            url = common.url_construct(common.url_library['menu']['url'], listing['slug'], page)
-            if rest_return is None:
-                rest_return = common.get_request(url)
-                print(f"Current Page: {page}")
-                sleep(common.rest_call_delay)
-            if total_menu_items is None:
-                total_menu_items = rest_return['meta']['total_menu_items']
-            elif total_menu_items == 0 or items_processed == total_menu_items:
-                break
-            elif total_menu_items > 0:
-                self.controller.data_lib[region][subregion]['listings'][listing['slug']]\
-                    ['menu'].extend(rest_return['data']['menu_items'])
-                items_processed+=len(rest_return['data']['menu_items'])
-                if items_processed != total_menu_items:
-                    page+=1
-                    rest_return = None
+        if incremental:
+            current = self.is_current(listing)
+            with self._delta_lock:
+                self.delta['checked'] += 1
+                if current:
+                    self.delta['skipped'] += 1
+                    # One page per page_size items, and one page for an empty menu
+                    self.delta['requests_avoided'] += max(1,
+                        -(-(listing.get('menu_items_count') or 0) // common.page_size))
+            if current:
+                print(f"Menu unchanged for {listing['slug']}, skipping")
+                self.controller.notify('menu', region, subregion, listing['slug'],
+                    listing['menu'].values())
+                return
+        print(f"Downloading menu for {listing['slug']}")
+        items, _ = paging.fetch_pages(
+            lambda page: common.url_construct(common.url_library['menu']['url'],
+                listing['slug'], page + 1),
+            lambda rest_return: rest_return['data']['menu_items'],
+            lambda rest_return: rest_return['meta']['total_menu_items'],
+            label=f"menu of {listing['slug']}")
+        common.metrics.ingested('menu_items', len(items))
+        self.controller.data_lib[region][subregion]['listings'][listing['slug']]['menu'] = items
         new_menu = {}
         for item in self.controller.data_lib[region]\
             [subregion]['listings'][listing['slug']]['menu']:
-            new_menu[item['slug']] = item
+            new_menu[item['slug']] = compact('menu', item)
         new_menu = OrderedDict(sorted(new_menu.items(), key=lambda t: t[0]))
         self.controller.data_lib[region][subregion]['listings'][listing['slug']]['menu'] = new_menu
+        self.controller.data_lib[region][subregion]['listings'][listing['slug']]\
+            ['menu_fingerprint'] = listing_fingerprint(listing)
+        self.controller.notify('menu', region, subregion, listing['slug'], new_menu.values())
 
 class WMDeals:
     def __init__(self, controller):
@@ -0,0 +1,196 @@
+"""cache.py contains the on-disk response cache used by common.get_request.
+    1. Objects
+        None
+    2. Classes
+        1. ResponseCache
+            A content-addressed, size-bounded LRU cache of JSON responses keyed by URL.
+    3. Functions
+        1. url_key
+            Returns the cache key of a URL.
+"""
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from time import time
+
+
+def url_key(url):
+    """
+    Returns the key a URL is cached under.
+
+    Parameters
+    ----------
+    url : str
+        A url built by common.url_construct.
+
+    Returns
+    -------
+    key : str
+        The sha256 hex digest of the url.
+    """
+    return hashlib.sha256(url.encode("utf8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Stores decoded JSON responses on disk, one file per URL.
+
+    Entries are evicted least recently used first once the cache grows past max_bytes.
+    When offline is True entries never expire, and misses are left to the caller.
+
+    Attributes
+    ----------
+    directory : str
+        Folder the cache files are written to.
+
+    max_bytes : int
+        Size the cache is trimmed back to after every write.
+
+    offline : boolean
+        Serve every cached entry regardless of its age.
+
+    hits : int
+        Number of lookups answered from the cache.
+
+    misses : int
+        Number of lookups that were missing or expired.
+
+    Methods
+    -------
+    get(url, ttl=None)
+        Returns the cached response for url, or None.
+
+    put(url, body, endpoint=None)
+        Stores the response for url.
+
+    report()
+        Returns a dict of cache statistics.
+    """
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024, offline=False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # key -> [size, last used]; dicts keep insertion order, so the first key is the LRU
+        self._index = {}
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        entries = []
+        for path in Path(directory).glob("*/*.json"):
+            stat = path.stat()
+            entries.append((stat.st_mtime, path.stem, stat.st_size))
+        for used, key, size in sorted(entries):
+            self._index[key] = [size, used]
+        self.size = sum(entry[0] for entry in self._index.values())
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def get(self, url, ttl=None):
+        """
+        Looks up the cached response for a URL.
+
+        Parameters
+        ----------
+        url : str
+            The url that was requested.
+        ttl : float
+            Maximum age in seconds of a usable entry. None never expires.
+
+        Returns
+        -------
+        body : dict
+            The cached JSON response, or None on a miss.
+        """
+        key = url_key(url)
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf8") as in_file:
+                entry = json.load(in_file)
+        except (FileNotFoundError, ValueError):
+            entry = None
+        now = time()
+        expired = entry is not None and ttl is not None and now - entry["stored"] > ttl
+        if entry is None or (expired and not self.offline):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+            if key in self._index:
+                self._index[key] = self._index.pop(key)
+                self._index[key][1] = now
+        try:
+            os.utime(path, (now, now))
+        except FileNotFoundError:
+            pass
+        return entry["body"]
+
+    def put(self, url, body, endpoint=None):
+        """
+        Writes a response to the cache and evicts old entries if it grew too large.
+
+        Parameters
+        ----------
+        url : str
+            The url that was requested.
+        body : dict
+            The decoded JSON response.
+        endpoint : str
+            The url_library key the url was built from, kept for inspection.
+
+        Returns
+        -------
+        None
+        """
+        key = url_key(url)
+        path = self._path(key)
+        Path(path).parent.mkdir(exist_ok=True)
+        data = json.dumps({"url": url, "endpoint": endpoint, "stored": time(), "body": body})
+        data = data.encode("utf8")
+        temp = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp, "wb") as out_file:
+            out_file.write(data)
+        os.replace(temp, path)
+        with self._lock:
+            old = self._index.pop(key, None)
+            if old is not None:
+                self.size -= old[0]
+            self._index[key] = [len(data), time()]
+            self.size += len(data)
+            self._evict()
+
+    def _evict(self):
+        while self.size > self.max_bytes and len(self._index) > 1:
+            key = next(iter(self._index))
+            size, _ = self._index.pop(key)
+            self.size -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def report(self):
+        """
+        Describes how well the cache performed.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        report : dict
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._index),
+            "bytes": self.size
+        }
@@ -0,0 +1,410 @@
+"""catalog.py contains the indexed in-memory catalog of crawled listings, menu items and deals.
+
+    A Catalog is a Snooper sink. Each refresh the actors notify it of only touches the
+    index entries of that subregion or listing, so it stays current while a crawl runs and
+    never rescans data_lib. Queries such as "all flower under $30 in oklahoma" start from
+    the most selective index that applies, and the matching records can be turned into
+    SnooperToPandas frames with util.SnooperToPandas.catalog_menus and friends.
+
+    1. Objects
+        1. item_indexes
+            The secondary indexes kept on menu items: name to the dotted path indexed.
+    2. Classes
+        1. Catalog
+            Primary and secondary indexes over listings, menu items and deals.
+    3. Functions
+        None
+"""
+import bisect
+import threading
+from lib.records import lookup
+
+item_indexes = {"category": "category.name", "edge_category": "edge_category.name"}
+
+
+def _price(record):
+    price = lookup(record, "price.price")
+    if isinstance(price, bool) or not isinstance(price, (int, float)) or price != price:
+        return None
+    return float(price)
+
+
+def _remove(index, key, member):
+    members = index.get(key)
+    if members is not None:
+        members.discard(member)
+        if not members:
+            del index[key]
+
+
+class Catalog:
+    """
+    Indexes listings, menu items and deals for fast lookups and filtered queries.
+
+    Listings are keyed by slug and id, menu items by (listing slug, item slug) and id, and
+    deals by slug and id. Menu items are also indexed by region, subregion, listing,
+    category.name and edge_category.name, and kept in price sorted lists per region and
+    category for range queries. Deals are indexed by region, subregion and listing.
+
+    Attributes
+    ----------
+    counts : dict
+        Number of listings, menu items and deals indexed.
+
+    Methods
+    -------
+    on_subregions(region, subregions)
+    on_listings(region, subregion, listings)
+    on_menu(region, subregion, listing, items)
+    on_deals(region, subregion, deals)
+        Snooper sink hooks, each replacing the entries of the refreshed scope.
+
+    index(data_lib)
+        Indexes everything already in a data_lib.
+
+    listing(key)
+    item(key, slug=None)
+    deal(key)
+        Primary lookups by slug or id.
+
+    listings(region=None, subregion=None)
+    items(region=None, subregion=None, listing=None, category=None, edge_category=None,
+        min_price=None, max_price=None, order="slug", limit=None)
+    deals(region=None, subregion=None, listing=None)
+        Queries returning the matching records.
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        # Listings: slug -> (region, subregion, record), id -> slug
+        self._listings = {}
+        self._listing_ids = {}
+        self._listings_by_scope = {}
+        # Menu items: (listing, slug) -> (region, subregion, record, indexed values, price),
+        # id -> key
+        self._items = {}
+        self._item_ids = {}
+        self._items_by_scope = {}
+        self._items_by_listing = {}
+        self._items_by = {name: {} for name in item_indexes}
+        # (region, category.name) -> (price, key) pairs of the items with a numeric price,
+        # sorted when first read after new items were appended
+        self._prices = {}
+        self._unsorted = set()
+        # Deals: (region, subregion, slug) -> record, id -> key, slug -> key
+        self._deals = {}
+        self._deal_ids = {}
+        self._deal_slugs = {}
+        self._deals_by_scope = {}
+        self._deals_by_listing = {}
+
+    @property
+    def counts(self):
+        return {"listings": len(self._listings), "items": len(self._items),
+            "deals": len(self._deals)}
+
+    def on_subregions(self, region, subregions):
+        pass
+
+    def on_listings(self, region, subregion, listings):
+        with self._lock:
+            listings = list(listings)
+            current = {listing['slug'] for listing in listings}
+            for slug in list(self._listings_by_scope.get((region, subregion), ())):
+                if slug not in current:
+                    # A listing that is gone takes its menu with it
+                    self._drop_listing(slug)
+            for listing in listings:
+                if listing['slug'] in self._listings:
+                    self._drop_listing(listing['slug'], keep_menu=True)
+                self._listings[listing['slug']] = (region, subregion, listing)
+                self._listing_ids[listing.get('id')] = listing['slug']
+                self._listings_by_scope.setdefault(region, set()).add(listing['slug'])
+                self._listings_by_scope.setdefault((region, subregion), set()).add(
+                    listing['slug'])
+
+    def on_menu(self, region, subregion, listing, items):
+        with self._lock:
+            self._drop_menu(listing)
+            for item in items:
+                self._add_item(region, subregion, listing, item)
+
+    def on_deals(self, region, subregion, deals):
+        with self._lock:
+            for key in list(self._deals_by_scope.get((region, subregion), ())):
+                self._drop_deal(key)
+            for deal in deals:
+                key = (region, subregion, deal['slug'])
+                if key in self._deals:
+                    self._drop_deal(key)
+                self._deals[key] = deal
+                self._deal_ids[deal.get('id')] = key
+                self._deal_slugs[deal['slug']] = key
+                self._deals_by_scope.setdefault(region, set()).add(key)
+                self._deals_by_scope.setdefault((region, subregion), set()).add(key)
+                listing = lookup(deal, "listing.slug")
+                if listing is not None:
+                    self._deals_by_listing.setdefault(listing, set()).add(key)
+
+    def index(self, data_lib):
+        """
+        Indexes every listing, menu and deal of a data_lib, as if the actors had just
+        downloaded them.
+
+        Parameters
+        ----------
+        data_lib : dict
+            Snooper.data_lib or anything nested the same way.
+
+        Returns
+        -------
+        counts : dict
+            Number of listings, menu items and deals indexed.
+        """
+        for region, subregions in data_lib.items():
+            for slug, subregion in subregions.items():
+                listings = subregion.get('listings')
+                if isinstance(listings, dict):
+                    self.on_listings(region, slug, listings.values())
+                    for listing in listings.values():
+                        if 'menu' in listing:
+                            self.on_menu(region, slug, listing['slug'], listing['menu'].values())
+                if 'deals' in subregion:
+                    self.on_deals(region, slug, subregion['deals'].values())
+        with self._lock:
+            for bucket in list(self._unsorted):
+                self._sorted_prices(bucket)
+        return self.counts
+
+    def _add_item(self, region, subregion, listing, item):
+        key = (listing, item['slug'])
+        if key in self._items:
+            self._drop_item(key)
+        values = {name: lookup(item, path) for name, path in item_indexes.items()}
+        price = _price(item)
+        self._items[key] = (region, subregion, item, values, price)
+        self._item_ids[item.get('id')] = key
+        self._items_by_scope.setdefault(region, set()).add(key)
+        self._items_by_scope.setdefault((region, subregion), set()).add(key)
+        self._items_by_listing.setdefault(listing, set()).add(key)
+        for name, value in values.items():
+            self._items_by[name].setdefault(value, set()).add(key)
+        if price is not None:
+            bucket = (region, values["category"])
+            self._prices.setdefault(bucket, []).append((price, key))
+            self._unsorted.add(bucket)
+
+    def _drop_item(self, key):
+        region, subregion, item, values, price = self._items.pop(key)
+        if self._item_ids.get(item.get('id')) == key:
+            del self._item_ids[item.get('id')]
+        _remove(self._items_by_scope, region, key)
+        _remove(self._items_by_scope, (region, subregion), key)
+        _remove(self._items_by_listing, key[0], key)
+        for name, value in values.items():
+            _remove(self._items_by[name], value, key)
+        if price is not None:
+            bucket = (region, values["category"])
+            pairs = self._sorted_prices(bucket)
+            position = bisect.bisect_left(pairs, (price, key))
+            if position < len(pairs) and pairs[position] == (price, key):
+                del pairs[position]
+            if not pairs:
+                del self._prices[bucket]
+
+    def _sorted_prices(self, bucket):
+        pairs = self._prices[bucket]
+        if bucket in self._unsorted:
+            # Appended pairs form one short unsorted run, which timsort merges in linear time
+            pairs.sort()
+            self._unsorted.discard(bucket)
+        return pairs
+
+    def _drop_menu(self, listing):
+        for key in list(self._items_by_listing.get(listing, ())):
+            self._drop_item(key)
+
+    def _drop_listing(self, slug, keep_menu=False):
+        region, subregion, listing = self._listings.pop(slug)
+        if self._listing_ids.get(listing.get('id')) == slug:
+            del self._listing_ids[listing.get('id')]
+        _remove(self._listings_by_scope, region, slug)
+        _remove(self._listings_by_scope, (region, subregion), slug)
+        if not keep_menu:
+            self._drop_menu(slug)
+
+    def _drop_deal(self, key):
+        deal = self._deals.pop(key)
+        if self._deal_ids.get(deal.get('id')) == key:
+            del self._deal_ids[deal.get('id')]
+        if self._deal_slugs.get(key[2]) == key:
+            del self._deal_slugs[key[2]]
+        _remove(self._deals_by_scope, key[0], key)
+        _remove(self._deals_by_scope, key[:2], key)
+        _remove(self._deals_by_listing, lookup(deal, "listing.slug"), key)
+
+    def listing(self, key):
+        """Returns the listing with slug or id key, or None."""
+        with self._lock:
+            entry = self._listings.get(self._listing_ids.get(key, key))
+            return entry[2] if entry is not None else None
+
+    def item(self, key, slug=None):
+        """Returns the menu item with id key, or with slug in listing key, or None."""
+        with self._lock:
+            entry = self._items.get((key, slug) if slug is not None else self._item_ids.get(key))
+            return entry[2] if entry is not None else None
+
+    def deal(self, key):
+        """Returns the deal with id or slug key, or None."""
+        with self._lock:
+            key = self._deal_ids.get(key, self._deal_slugs.get(key))
+            return self._deals[key] if key is not None else None
+
+    def _scope(self, index, region, subregion):
+        if subregion is not None:
+            if region is None:
+                # Subregion slugs are unique across regions
+                members = set()
+                for scope, keys in index.items():
+                    if isinstance(scope, tuple) and scope[1] == subregion:
+                        members |= keys
+                return members
+            return index.get((region, subregion), set())
+        return index.get(region, set())
+
+    def listings(self, region=None, subregion=None):
+        """
+        Finds the listings of a region or subregion.
+
+        Parameters
+        ----------
+        region : str
+            Region slug, None for every region.
+        subregion : str
+            Subregion slug, None for every subregion.
+
+        Returns
+        -------
+        listings : list
+            The listing records, sorted by slug.
+        """
+        with self._lock:
+            if region is None and subregion is None:
+                slugs = self._listings
+            else:
+                slugs = self._scope(self._listings_by_scope, region, subregion)
+            return [self._listings[slug][2] for slug in sorted(slugs)]
+
+    def items(self, region=None, subregion=None, listing=None, category=None,
+        edge_category=None, min_price=None, max_price=None, order="slug", limit=None):
+        """
+        Finds menu items matching every given filter.
+
+        The index with the fewest candidates is walked and only its candidates are checked
+        against the other filters, so a selective filter is cheap whatever else is given.
+        Price bounds are answered from price lists sorted per region and category, so
+        "flower under $30 in oklahoma" only reads the matching items.
+
+        Parameters
+        ----------
+        region, subregion, listing : str
+            Slugs the items must belong to.
+        category, edge_category : str
+            category.name and edge_category.name the items must have.
+        min_price, max_price : float
+            Inclusive bounds of price.price. Items without a numeric price never match a
+            price bound.
+        order : str
+            'slug' sorts by (listing, item slug), 'price' by price then (listing, item slug).
+        limit : int
+            Return at most this many items.
+
+        Returns
+        -------
+        items : list
+            (listing slug, item record) pairs.
+        """
+        bounded = min_price is not None or max_price is not None
+        low = float("-inf") if min_price is None else min_price
+        high = float("inf") if max_price is None else max_price
+
+        def matches(key):
+            item_region, item_subregion, _, values, price = self._items[key]
+            if region is not None and item_region != region or subregion is not None and \
+                item_subregion != subregion or listing is not None and key[0] != listing:
+                return False
+            if category is not None and values["category"] != category or \
+                edge_category is not None and values["edge_category"] != edge_category:
+                return False
+            return not bounded or price is not None and low <= price <= high
+
+        with self._lock:
+            # Each plan is (number of candidates, function returning them, whether they all
+            # match); the plan with the fewest candidates is walked and, unless it is exact,
+            # every filter is checked on its candidates
+            plans = [(len(self._items), lambda: self._items, False)]
+            if bounded:
+                ranges = []
+                for bucket in list(self._prices):
+                    if region not in (None, bucket[0]) or category not in (None, bucket[1]):
+                        continue
+                    pairs = self._sorted_prices(bucket)
+                    start = bisect.bisect_left(pairs, low, key=lambda pair: pair[0])
+                    stop = bisect.bisect_right(pairs, high, key=lambda pair: pair[0])
+                    ranges.append((pairs, start, stop))
+                # The price lists are split by region and category, so only the subregion,
+                # listing and edge_category filters are left to check
+                plans.append((sum(stop - start for _, start, stop in ranges),
+                    lambda: [key for pairs, start, stop in ranges
+                        for _, key in pairs[start:stop]],
+                    subregion is None and listing is None and edge_category is None))
+            indexed = []
+            if listing is not None:
+                indexed.append(self._items_by_listing.get(listing, set()))
+            if region is not None or subregion is not None:
+                indexed.append(self._scope(self._items_by_scope, region, subregion))
+            for name, value in (("category", category), ("edge_category", edge_category)):
+                if value is not None:
+                    indexed.append(self._items_by[name].get(value, set()))
+            plans += [(len(members), lambda members=members: members, False)
+                for members in indexed]
+            _, candidates, exact = min(plans, key=lambda plan: plan[0])
+            keys = list(candidates()) if exact else [key for key in candidates() if matches(key)]
+            if order == "price":
+                keys.sort(key=lambda key: (self._items[key][4] is None,
+                    self._items[key][4] or 0.0, key))
+            else:
+                keys.sort()
+            if limit is not None:
+                keys = keys[:limit]
+            return [(key[0], self._items[key][2]) for key in keys]
+
+    def deals(self, region=None, subregion=None, listing=None):
+        """
+        Finds the deals of a region, subregion or listing.
+
+        Parameters
+        ----------
+        region, subregion : str
+            Slugs of the region and subregion the deals were filed under.
+        listing : str
+            Slug of the listing offering the deals.
+
+        Returns
+        -------
+        deals : list
+            The deal records, sorted by region, subregion and slug.
+        """
+        with self._lock:
+            candidates = []
+            if listing is not None:
+                candidates.append(self._deals_by_listing.get(listing, set()))
+            if region is not None or subregion is not None:
+                candidates.append(self._scope(self._deals_by_scope, region, subregion))
+            if not candidates:
+                keys = self._deals
+            else:
+                candidates.sort(key=len)
+                keys = [key for key in candidates[0]
+                    if all(key in members for members in candidates[1:])]
+            return [self._deals[key] for key in sorted(keys)]
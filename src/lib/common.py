@@ -6,22 +6,84 @@
             the primary save file for snooper to export to.
         3. export_file
             an optional test export file for snooper to export to.
+        4. max_workers
+            the global cap on concurrent workers used by concurrent crawls.
+        5. page_workers
+            the number of pages of a single paged endpoint fetched at once.
+        6. limiter
+            the shared ratelimit.RateLimiter every request made by get_request goes through.
+        7. transport
+            the transport.HTTPTransport used by get_request, created by the first request when
+            None. Replace it to redirect requests.
+        8. cache
+            an optional cache.ResponseCache consulted by get_request before any request.
+        9. compact_records
+            when True the actors store records.Record projections instead of raw API dicts.
+        10. metrics
+            the metrics.Metrics get_request records every request attempt in.
+        11. flights
+            the planner.SingleFlight get_request coalesces identical concurrent requests with.
+        12. deal_planner
+            an optional planner.DealPlanner the actors consult before querying deals.
+        13. in_flight
+            the semaphore capping requests in flight across every pool at max_workers.
     2. Classes
-        None
+        1. RequestError
+            Raised by get_request once every retry of a request has failed.
     3. Functions
         1. clear
-            Clears the screen. Used for logging in linux.
+            Clears the screen. Used for logging in linux. Not called on import.
         2. url_construct
             Constructs a URL used for REST calls against WeedMaps
-        3. get_request
+        3. endpoint_of
+            Returns the url_library key a URL was built from.
+        4. get_request
             Performs a GET request.
+        5. set_rate
+            Replaces the limiter with one starting at another rate and burst.
 """
 import os.path
-import requests
+import threading
+from time import perf_counter, sleep
+from lib.metrics import Metrics
+from lib.planner import SingleFlight
+from lib.ratelimit import RateLimiter
+from lib.transport import HTTPTransport, TransportError, backoff_delay
 clear = lambda: os.system('clear')
-clear()
-rest_call_delay = 5
 page_size = 100
+max_workers = 8
+# Pages of one listing or menu fetched at once, still within the limiter's budget
+page_workers = 4
+# Request budget: steady requests per second, allowed burst and the adaptive bounds. The
+# default starts at the original pace of one request every 5 seconds; while nothing is
+# throttled the limiter speeds up to rate_headroom times its starting rate, and it slows
+# down again on 429 / 5xx. Raise it with set_rate (snooper --rate) where the API allows
+requests_per_second = 0.2
+request_burst = 1
+rate_headroom = 5
+max_requests_per_second = requests_per_second * rate_headroom
+limiter = RateLimiter(requests_per_second, request_burst, max_rate=max_requests_per_second)
+# Requests in flight at once, however the pools of menus and pages nest, so they never
+# outnumber the transport's connections
+in_flight = threading.BoundedSemaphore(max_workers)
+# Transport: kept-alive connections per host, (connect, read) timeouts and GET retries
+pool_size = max_workers
+request_timeout = (5, 30)
+request_retries = 4
+retry_backoff = 0.5
+# Created by the first request so that importing common never loads requests
+transport = None
+# Response cache, disabled until Snooper (or a test) installs a cache.ResponseCache
+cache = None
+# Per-endpoint request metrics and items ingested by the actors or job units
+metrics = Metrics()
+# Identical requests in flight at the same time are made once
+flights = SingleFlight()
+# Deal query planner, disabled until Snooper (or a test) installs a planner.DealPlanner
+deal_planner = None
+# Ingest-time projection into compact records, optionally keeping the raw payloads too
+compact_records = False
+keep_raw_records = False
 api__headers = {
     'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_6) \
         AppleWebKit/537.36 (KHTML, like Gecko) Chrome/56.0.2924.87 Safari/537.36',
@@ -29,25 +91,51 @@ api__headers = {
 url_library = {
     "deals": {
         "url": "https://api-g.weedmaps.com/discovery/v1/deals?filter%5Bregion_id%5D={}&filter%5B\
-            types%5D=organic&filter%5Bcategory%5D=all&page=1&page_size=100",
-        "needs": "subregion_id" # Received from subregion; is contained in dict
+            types%5D=organic&filter%5Bcategory%5D=all&page={}&page_size=100",
+        "needs": "subregion_id", # Received from subregion; is contained in dict
+        "ttl": 60 * 60
     },
     "menu": {
         "url": "https://api-g.weedmaps.com/discovery/v1/listings/dispensaries/{}/menu_items?\
             include%5B%5D=facets.categories&page_size=100&page={}",
-        "needs": "dispensary_slug"
+        "needs": "dispensary_slug",
+        "ttl": 6 * 60 * 60
     },
     "subregions": {
         "url": "https://api-g.weedmaps.com/wm/v1/regions/{}/subregions",
-        "needs": "subregion_name" # Received from region; is contained in a list of dicts
+        "needs": "subregion_name", # Received from region; is contained in a list of dicts
+        "ttl": 7 * 24 * 60 * 60
     },
     "dispensaries": {
         "url": "https://api-g.weedmaps.com/discovery/v1/listings?offset={}&page_size=100&size=100\
             &filter[any_retailer_services][]=storefront&filter[region_slug[dispensaries]]={}",
-        "needs": "subregion_name" # Received from region; is contained in a list of dicts
+        "needs": "subregion_name", # Received from region; is contained in a list of dicts
+        "ttl": 24 * 60 * 60
     }
 }
 
+def endpoint_of(url):
+    """
+    Finds the url_library entry a URL was constructed from.
+
+    Parameters
+    ----------
+    url : string
+        A url built by url_construct
+
+    Returns
+    -------
+    endpoint : string
+        The matching url_library key, or None if the url was not built from url_library
+    """
+    for endpoint, entry in url_library.items():
+        if url.startswith(entry['url'].split('{')[0]):
+            return endpoint
+    return None
+
+class RequestError(Exception):
+    """Raised when a GET request still fails after every retry."""
+
 def url_construct(url_dict, *args):
     """
     Constructs a URL taken from url_library and returns a formatted string using *args
@@ -64,9 +152,34 @@ def url_construct(url_dict, *args):
     """
     return url_dict.format(*args)
 
+def set_rate(rate=None, burst=None):
+    """
+    Replaces the shared limiter, keeping rate_headroom for it to adapt within.
+
+    Parameters
+    ----------
+    rate : float
+        Requests per second to start at, defaults to requests_per_second.
+    burst : int
+        Requests allowed at once after an idle spell, defaults to request_burst.
+
+    Returns
+    -------
+    limiter : ratelimit.RateLimiter
+    """
+    global limiter # pylint: disable=global-statement
+    rate = rate or requests_per_second
+    limiter = RateLimiter(rate, burst or request_burst, max_rate=rate * rate_headroom)
+    return limiter
+
 def get_request(url):
     """
-    A simple wrapper function for performing GET REST calls via the requests module
+    A simple wrapper function for performing GET REST calls via the shared transport.
+    When a cache is installed it is consulted first, using the ttl of the url_library
+    endpoint the url was built from. Callers asking for a url that is already being fetched
+    wait for that request and share its body. Every attempt waits on the shared limiter.
+    Throttled responses, network errors and undecodable bodies are retried with jittered
+    exponential backoff. Any other 4xx response fails at once.
 
     Parameters
     ----------
@@ -77,5 +190,72 @@ def get_request(url):
     -------
     request.response : dict / JSON
         The response object from the GET request, formatted in JSON for easy save in data_lib
+
+    Raises
+    ------
+    RequestError
+        If no attempt returned a JSON body, the response was a 4xx other than 429, or the
+        url is not cached while offline.
     """
-    return requests.get(url, headers=api__headers).json()
+    endpoint = endpoint_of(url)
+    if cache is not None:
+        ttl = url_library[endpoint]['ttl'] if endpoint else None
+        body = cache.get(url, ttl)
+        if body is not None:
+            metrics.cached(endpoint)
+            return body
+        if cache.offline:
+            raise RequestError(f"GET {url} is not cached and the cache is offline")
+    body, coalesced = flights.do(url, lambda: _fetch_and_cache(url, endpoint))
+    if coalesced:
+        metrics.coalesced(endpoint)
+    return body
+
+def _fetch_and_cache(url, endpoint):
+    body = _fetch(url, endpoint)
+    if cache is not None:
+        cache.put(url, body, endpoint)
+    return body
+
+_transport_lock = threading.Lock()
+
+def _transport():
+    global transport # pylint: disable=global-statement
+    if transport is None:
+        # Concurrent first requests must share one session and its connection pool
+        with _transport_lock:
+            if transport is None:
+                transport = HTTPTransport(pool_size, request_timeout)
+    return transport
+
+def _fetch(url, endpoint=None):
+    failure = None
+    for attempt in range(request_retries + 1):
+        if attempt:
+            metrics.retried(endpoint)
+            sleep(backoff_delay(attempt - 1, retry_backoff))
+        limiter.acquire()
+        start = perf_counter()
+        try:
+            with in_flight:
+                response = _transport().get(url, headers=api__headers)
+        except TransportError as error:
+            metrics.observe(endpoint, perf_counter() - start)
+            failure = error
+            continue
+        metrics.observe(endpoint, perf_counter() - start, response.status_code,
+            len(response.content))
+        if limiter.feedback(response.status_code, response.headers.get('Retry-After')):
+            failure = f"throttled with status {response.status_code}"
+            print(f"Throttled ({response.status_code}), slowing down to {limiter.current_rate:.2f}/s")
+            continue
+        if 400 <= response.status_code < 500:
+            # The request itself is wrong, so asking again cannot help
+            metrics.failed(endpoint)
+            raise RequestError(f"GET {url} failed with status {response.status_code}")
+        try:
+            return response.json()
+        except ValueError as error:
+            failure = error
+    metrics.failed(endpoint)
+    raise RequestError(f"GET {url} failed after {request_retries + 1} attempts: {failure}")
@@ -0,0 +1,340 @@
+"""coordinator.py contains the coordinator / worker mode of distributed crawls.
+
+    A coordinator owns a jobs.JobQueue and hands its units out to workers as leases. Each
+    worker runs in its own process, possibly on another host with its own request budget,
+    leases a few units at a time, fetches them and reports the results back. While it
+    works, a heartbeat thread keeps renewing the units it still holds. A lease that is not
+    completed or renewed in time expires and its units go to another worker, so a worker
+    that dies only delays its units. Results are merged into the coordinator's
+    queue, from which jobs.Crawler.assemble builds data_lib.
+
+    Workers talk to the coordinator with JSON over HTTP:
+        POST /lease     {"worker": ..., "limit": ...}                -> {"units": [...]}
+        POST /complete  {"worker": ..., "unit": ..., "result": ..., "children": [...]}
+        POST /fail      {"worker": ..., "unit": ..., "error": ...}
+        POST /renew     {"worker": ..., "ids": [...]}
+        POST /status    {}                                           -> unit counts
+    A Coordinator object has the same methods, so it doubles as the local stand-in for
+    the HTTP client when workers run in the coordinator's own process.
+
+    1. Objects
+        None
+    2. Classes
+        1. Coordinator
+            Leases the units of a job queue to workers and optionally serves them over HTTP.
+        2. CoordinatorClient
+            The HTTP client workers use to reach a remote coordinator.
+        3. Worker
+            Leases, executes and reports units until the crawl is finished.
+    3. Functions
+        1. run_worker
+            Runs a worker against a coordinator url, the entry point of worker processes.
+        2. spawn_workers
+            Starts local worker processes.
+"""
+import json
+import multiprocessing
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from lib import common
+from lib import jobs
+
+
+class Coordinator:
+    """
+    Hands the units of a job queue out to workers as expiring leases.
+
+    Attributes
+    ----------
+    queue : jobs.JobQueue
+        The queue every result is merged into.
+
+    lease_seconds : float
+        How long a worker holds its units without renewing them.
+
+    retries : int
+        Failed attempts allowed per unit before it is left as failed.
+
+    url : str
+        Base url of the HTTP endpoint once serve() was called.
+
+    Methods
+    -------
+    plan(regions)
+        Queues a subregions unit for each region, with its deal queries planned.
+
+    lease(worker, limit=1)
+    complete(worker, unit, result, children)
+    fail(worker, unit, error)
+    renew(worker, ids)
+    status()
+        The worker protocol.
+
+    serve(host="127.0.0.1", port=0)
+        Serves the worker protocol over HTTP on a background thread.
+
+    stop()
+        Stops serving.
+    """
+    def __init__(self, queue, lease_seconds=60, retries=3):
+        self.queue = queue
+        self.lease_seconds = lease_seconds
+        self.retries = retries
+        self.url = None
+        self._server = None
+
+    def plan(self, regions):
+        return self.queue.add(jobs.region_unit(region) for region in regions)
+
+    def lease(self, worker, limit=1):
+        return self.queue.lease(worker, self.lease_seconds, limit)
+
+    def complete(self, worker, unit, result, children):
+        # A worker whose lease expired was replaced; its late result is dropped
+        return self.queue.complete(unit, result, children, owner=worker)
+
+    def fail(self, worker, unit, error):
+        return self.queue.fail(unit, error, self.retries, owner=worker)
+
+    def renew(self, worker, ids):
+        return self.queue.renew(worker, ids, self.lease_seconds)
+
+    def status(self):
+        counts = self.queue.counts()
+        counts['finished'] = not counts['pending'] and not counts['running']
+        return counts
+
+    def serve(self, host="127.0.0.1", port=0):
+        """
+        Serves the worker protocol over HTTP.
+
+        Parameters
+        ----------
+        host : str
+            Interface to listen on; use 0.0.0.0 for workers on other hosts.
+        port : int
+            Port to listen on, 0 for any free port.
+
+        Returns
+        -------
+        url : str
+        """
+        coordinator = self
+        methods = {"lease": self.lease, "complete": self.complete, "fail": self.fail,
+            "renew": self.renew, "status": self.status}
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                method = methods.get(self.path.strip("/"))
+                length = int(self.headers.get("Content-Length", 0))
+                try:
+                    arguments = json.loads(self.rfile.read(length) or b"{}")
+                    if method is None:
+                        status, body = 404, {"error": f"no method {self.path}"}
+                    else:
+                        status, body = 200, {"result": method(**arguments)}
+                except (TypeError, ValueError, KeyError) as error:
+                    status, body = 400, {"error": repr(error)}
+                except Exception as error: # pylint: disable=broad-except
+                    # Always answer, so a worker never waits on a request that died here
+                    status, body = 500, {"error": repr(error)}
+                payload = json.dumps(body, default=dict).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.url = f"http://{host}:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True).start()
+        print(f"Coordinator serving {coordinator.queue.path} at {self.url}")
+        return self.url
+
+    def stop(self):
+        """Stops serving."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class CoordinatorClient:
+    """
+    Calls a coordinator's HTTP endpoint. Has the same methods as Coordinator.
+
+    Attributes
+    ----------
+    url : str
+        Base url of the coordinator.
+    """
+    def __init__(self, url, timeout=30):
+        self.url = url.rstrip("/")
+        import requests
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def _call(self, method, **arguments):
+        response = self.session.post(f"{self.url}/{method}", json=arguments,
+            timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()["result"]
+
+    def lease(self, worker, limit=1):
+        return self._call("lease", worker=worker, limit=limit)
+
+    def complete(self, worker, unit, result, children):
+        return self._call("complete", worker=worker, unit=unit, result=result,
+            children=children)
+
+    def fail(self, worker, unit, error):
+        return self._call("fail", worker=worker, unit=unit, error=error)
+
+    def renew(self, worker, ids):
+        return self._call("renew", worker=worker, ids=ids)
+
+    def status(self):
+        return self._call("status")
+
+
+class Worker:
+    """
+    Leases units from a coordinator, fetches them and reports the results.
+
+    Attributes
+    ----------
+    coordinator : Coordinator or CoordinatorClient
+        Where units are leased from.
+
+    name : str
+        Unique name of the worker, which owns its leases.
+
+    batch : int
+        Units leased at once.
+
+    heartbeat : float
+        Seconds between renewals of the units still held, well below the coordinator's
+        lease_seconds so a unit slowed by the limiter and retries keeps its lease.
+
+    Methods
+    -------
+    run()
+        Works until the coordinator has nothing pending or running.
+    """
+    def __init__(self, coordinator, name, batch=4, heartbeat=10.0):
+        self.coordinator = coordinator
+        self.name = name
+        self.batch = batch
+        self.heartbeat = heartbeat
+        self.done = 0
+
+    def _renew(self, held, lock, stop):
+        while not stop.wait(self.heartbeat):
+            with lock:
+                ids = list(held)
+            if not ids:
+                continue
+            try:
+                self.coordinator.renew(self.name, ids)
+            except Exception as error: # pylint: disable=broad-except
+                # The next beat tries again; the lease only lapses if every beat fails
+                print(f"Worker {self.name} could not renew its lease: {error!r}")
+
+    def run(self):
+        """
+        Works until the crawl is finished.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        done : int
+            Number of units this worker completed.
+        """
+        while True:
+            units = self.coordinator.lease(self.name, self.batch)
+            if not units:
+                if self.coordinator.status()['finished']:
+                    return self.done
+                time.sleep(0.1)
+                continue
+            held = [unit['id'] for unit in units]
+            lock = threading.Lock()
+            stop = threading.Event()
+            beat = threading.Thread(target=self._renew, args=(held, lock, stop), daemon=True)
+            beat.start()
+            try:
+                for unit in units:
+                    try:
+                        found, children = jobs.execute(unit)
+                    except (common.RequestError, KeyError, TypeError) as error:
+                        self.coordinator.fail(self.name, unit, repr(error))
+                    else:
+                        if self.coordinator.complete(self.name, unit, found, children):
+                            self.done += 1
+                    with lock:
+                        held.remove(unit['id'])
+            finally:
+                stop.set()
+                beat.join()
+
+
+def run_worker(url, name, batch=4, heartbeat=10.0):
+    """
+    Runs a worker against the coordinator serving at url.
+
+    Parameters
+    ----------
+    url : str
+        Base url of the coordinator.
+    name : str
+        Unique name of the worker.
+    batch : int
+        Units leased at once.
+    heartbeat : float
+        Seconds between lease renewals.
+
+    Returns
+    -------
+    done : int
+    """
+    done = Worker(CoordinatorClient(url), name, batch, heartbeat).run()
+    print(f"Worker {name} finished {done} units")
+    return done
+
+
+def spawn_workers(url, count, target=run_worker, prefix="worker"):
+    """
+    Starts local worker processes.
+
+    Parameters
+    ----------
+    url : str
+        Base url of the coordinator.
+    count : int
+        Number of processes.
+    target : function
+        Called as target(url, name) in each process.
+    prefix : str
+        Worker names are prefix-0, prefix-1, ...
+
+    Returns
+    -------
+    processes : list
+        The started multiprocessing.Process objects.
+    """
+    processes = [multiprocessing.Process(target=target, args=(url, f"{prefix}-{index}"),
+        daemon=True) for index in range(count)]
+    for process in processes:
+        process.start()
+    return processes
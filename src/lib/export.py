@@ -0,0 +1,318 @@
+"""export.py contains the columnar (Parquet) export of the Dataframes built by SnooperToPandas.
+
+    Tables are written as a hive partitioned dataset:
+        <root>/<table>/region=<slug>/subregion=<slug>/crawl_date=<YYYY-MM-DD>/part-0.parquet
+    Writing a partition only ever replaces that partition, so new crawls are appended
+    without rewriting older ones. Partitions are written to a hidden file and renamed into
+    place, so a reader never sees a partially written one.
+
+    Tables too large to build at once, such as every menu in the country, are written from
+    the bounded chunks of util.iter_frames into a single CSV or Parquet file, one chunk at a
+    time.
+
+    1. Objects
+        1. table_types
+            The explicit Arrow type of every column of the listings, menus and deals tables.
+        2. partition_keys
+            The columns a table is partitioned by.
+    2. Classes
+        None
+    3. Functions
+        1. coerce
+            Converts a Dataframe to the explicit types of a table.
+        2. partition_file
+            The file a region / subregion / crawl date partition of a table is written to.
+        3. write_partition
+            Writes one region / subregion / crawl date partition of a table.
+        4. write_partitions
+            Splits a Dataframe by a subregion column and writes each partition.
+        5. read_table
+            Reads a table back with column and partition / predicate pushdown.
+        6. write_csv_chunks
+            Writes a stream of Dataframes as one CSV.
+        7. write_parquet_chunks
+            Writes a stream of Dataframes as one Parquet file, a row group per chunk.
+"""
+import os
+from datetime import date
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from lib.manifest import replacing
+
+partition_keys = ["region", "subregion", "crawl_date"]
+
+table_types = {
+    "listings": {
+        "id": pa.int64(),
+        "name": pa.string(),
+        "slug": pa.string(),
+        "city": pa.string(),
+        "type": pa.string(),
+        "web_url": pa.string(),
+        "ranking": pa.float64(),
+        "rating": pa.float64(),
+        "reviews_count": pa.int64(),
+        "has_sale_items": pa.bool_(),
+        "address": pa.string(),
+        "zip_code": pa.string(),
+        "timezone": pa.string(),
+        "open_now": pa.bool_(),
+        "closes_in": pa.float64(),
+        "todays_hours_str": pa.string(),
+        "menu_items_count": pa.int64(),
+        "verified_menu_items_count": pa.int64(),
+        "is_published": pa.bool_(),
+        "email": pa.string(),
+        "phone_number": pa.string(),
+    },
+    "menus": {
+        "id": pa.int64(),
+        "name": pa.string(),
+        "slug": pa.string(),
+        "category.name": pa.string(),
+        "edge_category.name": pa.string(),
+        "price.price": pa.float64(),
+        "price.unit": pa.string(),
+        "price.label": pa.string(),
+        "price.quantity": pa.float64(),
+        "reviews_count": pa.int64(),
+        "rating": pa.float64(),
+        "is_endorsed": pa.bool_(),
+        "is_badged": pa.bool_(),
+        "created_at": pa.timestamp("us", tz="UTC"),
+        "listing": pa.string(),
+    },
+    "deals": {
+        "id": pa.int64(),
+        "listing.slug": pa.string(),
+        "listing.region.slug": pa.string(),
+        "listing.web_url": pa.string(),
+        "title": pa.string(),
+        "body": pa.string(),
+    },
+}
+
+
+def coerce(frame, table, keys=()):
+    """
+    Converts a Dataframe to the explicit types of a table, dropping partition columns.
+
+    Parameters
+    ----------
+    frame : Pandas.Dataframe
+        A frame built by SnooperToPandas.
+    table : str
+        One of the keys of table_types.
+    keys : iterable
+        Partition columns to keep, as strings after the table's columns.
+
+    Returns
+    -------
+    table : pyarrow.Table
+    """
+    fields = []
+    columns = []
+    types = dict(table_types[table], **{key: pa.string() for key in keys})
+    for column, kind in types.items():
+        values = frame[column] if column in frame else pd.Series([None] * len(frame))
+        if pa.types.is_integer(kind) or pa.types.is_floating(kind):
+            values = pd.to_numeric(values, errors="coerce")
+            if pa.types.is_integer(kind):
+                values = values.astype("Int64")
+        elif pa.types.is_boolean(kind):
+            values = values.astype("boolean")
+        elif pa.types.is_timestamp(kind):
+            values = pd.to_datetime(values, errors="coerce", utc=True)
+        else:
+            values = values.astype("string")
+        fields.append(pa.field(column, kind))
+        columns.append(pa.Array.from_pandas(values, type=kind))
+    return pa.Table.from_arrays(columns, schema=pa.schema(fields))
+
+
+def partition_file(root, table, region, subregion, crawl_date=None):
+    """
+    Returns the file a partition of a table is written to.
+
+    Parameters
+    ----------
+    root : str
+        Directory holding every table.
+    table : str
+        One of the keys of table_types.
+    region : str
+        Region slug of the partition.
+    subregion : str
+        Subregion slug of the partition.
+    crawl_date : str
+        ISO date of the crawl, defaults to today.
+
+    Returns
+    -------
+    path : str
+    """
+    if crawl_date is None:
+        crawl_date = date.today().isoformat()
+    return os.path.join(root, table, f"region={region}", f"subregion={subregion}",
+        f"crawl_date={crawl_date}", "part-0.parquet")
+
+
+def write_partition(frame, root, table, region, subregion, crawl_date=None):
+    """
+    Writes a Dataframe as one partition of a table, replacing only that partition.
+
+    Parameters
+    ----------
+    frame : Pandas.Dataframe
+        A frame built by SnooperToPandas.
+    root : str
+        Directory holding every table.
+    table : str
+        One of the keys of table_types.
+    region : str
+        Region slug of the partition.
+    subregion : str
+        Subregion slug of the partition.
+    crawl_date : str
+        ISO date of the crawl, defaults to today.
+
+    Returns
+    -------
+    path : str
+        The file written.
+    """
+    path = partition_file(root, table, region, subregion, crawl_date)
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    with replacing(path) as temp:
+        pq.write_table(coerce(frame, table), temp, compression="zstd")
+    # Files of the partition written some other way would be read along with this one
+    for name in os.listdir(directory):
+        if name != "part-0.parquet" and not name.startswith("."):
+            os.remove(os.path.join(directory, name))
+    return path
+
+
+def write_partitions(frame, root, table, region, subregion_column, crawl_date=None):
+    """
+    Splits a region wide Dataframe by subregion and writes one partition per subregion.
+
+    Parameters
+    ----------
+    frame : Pandas.Dataframe
+        A frame built by SnooperToPandas.
+    root : str
+        Directory holding every table.
+    table : str
+        One of the keys of table_types.
+    region : str
+        Region slug of the partitions.
+    subregion_column : str
+        Column of frame holding each row's subregion slug.
+    crawl_date : str
+        ISO date of the crawl, defaults to today.
+
+    Returns
+    -------
+    paths : list
+        The files written.
+    """
+    return [write_partition(group, root, table, region, subregion, crawl_date)
+        for subregion, group in frame.groupby(subregion_column)]
+
+
+def read_table(root, table, columns=None, filters=None):
+    """
+    Reads a table, only touching the partitions and columns that are asked for.
+
+    Parameters
+    ----------
+    root : str
+        Directory holding every table.
+    table : str
+        One of the keys of table_types.
+    columns : list
+        Columns to read, partition keys included. None reads every column.
+    filters : list
+        Predicates such as [("region", "=", "oklahoma"), ("price.price", "<", 30)].
+        Predicates on partition keys skip whole partitions; the rest use row group
+        statistics.
+
+    Returns
+    -------
+    frame : Pandas.Dataframe
+    """
+    schema = pa.schema(list(pa.schema(
+        [pa.field(column, kind) for column, kind in table_types[table].items()])) +
+        [pa.field(key, pa.string()) for key in partition_keys])
+    return pq.read_table(os.path.join(root, table), columns=columns, filters=filters,
+        schema=schema, partitioning="hive").to_pandas()
+
+
+def write_csv_chunks(frames, path):
+    """
+    Writes Dataframes one after another as a single CSV, holding only one of them in
+    memory. The index counts rows across every chunk, as if the chunks were concatenated.
+    The file is replaced atomically.
+
+    Parameters
+    ----------
+    frames : iterable
+        Dataframes with the same columns, such as the chunks of util.iter_frames.
+    path : str
+        The CSV to write.
+
+    Returns
+    -------
+    rows : int
+        Number of rows written.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    rows = 0
+    with replacing(path) as temp:
+        with open(temp, "w", encoding="utf8", newline="") as out_file:
+            for chunk, frame in enumerate(frames):
+                frame.index = pd.RangeIndex(rows, rows + len(frame))
+                frame.to_csv(out_file, header=chunk == 0)
+                rows += len(frame)
+    return rows
+
+
+def write_parquet_chunks(frames, path, table, keys=("region", "subregion")):
+    """
+    Writes Dataframes one after another as a single Parquet file of a table, each chunk
+    as its own row group, holding only one of them in memory. The file is replaced
+    atomically.
+
+    Parameters
+    ----------
+    frames : iterable
+        Dataframes of the table, such as the chunks of util.iter_frames.
+    path : str
+        The Parquet file to write.
+    table : str
+        One of the keys of table_types.
+    keys : iterable
+        Partition columns kept as string columns after the table's columns.
+
+    Returns
+    -------
+    rows : int
+        Number of rows written.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    rows = 0
+    with replacing(path) as temp:
+        writer = None
+        try:
+            for frame in frames:
+                arrow_table = coerce(frame, table, keys)
+                if writer is None:
+                    writer = pq.ParquetWriter(temp, arrow_table.schema, compression="zstd")
+                writer.write_table(arrow_table)
+                rows += len(frame)
+        finally:
+            if writer is not None:
+                writer.close()
+    return rows
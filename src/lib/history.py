@@ -0,0 +1,339 @@
+"""history.py contains the append-only snapshot history of crawled listings, menus and deals.
+
+    Every record is content hashed. A crawl only writes a version for a record whose hash
+    changed since the previous crawl, or a tombstone for a record that disappeared, so the
+    store grows with churn rather than with the size of the catalog. Record bodies are
+    stored once per distinct hash, compressed. Any past state can be rebuilt, and price
+    histories read back as Dataframes.
+
+    1. Objects
+        1. volatile_fields
+            Fields left out of stored records because they change on every crawl.
+    2. Classes
+        1. HistoryStore
+            A Snooper sink recording versions of every record into SQLite.
+    3. Functions
+        1. content_hash
+            Hashes the stable content of a record.
+        2. timestamp
+            Normalizes a crawl time to an ISO 8601 UTC string.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import zlib
+from datetime import datetime, timezone
+
+volatile_fields = {
+    "listing": ("open_now", "closes_in", "todays_hours_str", "menu", "menu_fingerprint"),
+    "menu": (),
+    "deal": (),
+}
+
+
+def _canonical(kind, record):
+    return json.dumps({key: value for key, value in dict(record).items()
+        if key not in volatile_fields[kind]}, sort_keys=True, default=dict)
+
+
+def content_hash(kind, record):
+    """
+    Hashes the stable content of a record.
+
+    Parameters
+    ----------
+    kind : str
+        One of 'listing', 'menu' or 'deal'.
+    record : dict or records.Record
+
+    Returns
+    -------
+    hash : str
+        Hex sha256 of the record's canonical JSON, volatile fields excluded.
+    """
+    return hashlib.sha256(_canonical(kind, record).encode()).hexdigest()
+
+
+def timestamp(when=None):
+    """
+    Normalizes a crawl time so that timestamps compare correctly as strings.
+
+    Parameters
+    ----------
+    when : datetime or str
+        A datetime (naive ones are taken as local time), an ISO 8601 string, or None for
+        now.
+
+    Returns
+    -------
+    timestamp : str
+        e.g. '2024-01-02T03:04:05.000000Z'. Microseconds are kept, so crawls begun within
+        the same second get versions of their own.
+    """
+    if when is None:
+        when = datetime.now(timezone.utc)
+    elif isinstance(when, str):
+        when = datetime.fromisoformat(when)
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=timezone.utc)
+    return when.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+class HistoryStore:
+    """
+    Records a version of each listing, menu item and deal whenever its content changes.
+
+    The store is a Snooper sink: each refresh of a subregion's listings or deals, or of a
+    listing's menu, is compared with the latest versions in the same scope. Changed and new
+    records get a version at crawled_at, and records missing from the refresh get a
+    tombstone.
+
+    Attributes
+    ----------
+    path : str
+        The SQLite database file.
+
+    crawled_at : str
+        Timestamp the next versions are recorded at.
+
+    Methods
+    -------
+    begin(when=None)
+        Starts recording a new crawl at when.
+
+    on_subregions(region, subregions)
+    on_listings(region, subregion, listings)
+    on_menu(region, subregion, listing, items)
+    on_deals(region, subregion, deals)
+        Snooper sink hooks.
+
+    record(data_lib, when=None)
+        Records a whole data_lib as one crawl.
+
+    state_at(when=None)
+        Rebuilds the data_lib that was current at a time.
+
+    price_history(listing, item=None)
+        Returns the price versions of a listing's menu items as a Dataframe.
+
+    report()
+        Number of versions, distinct bodies and bytes stored.
+
+    close()
+        Closes the database.
+    """
+    def __init__(self, path, crawled_at=None):
+        self.path = path
+        self.crawled_at = timestamp(crawled_at)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS bodies (
+                hash TEXT PRIMARY KEY,
+                data BLOB NOT NULL)""")
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS versions (
+                kind TEXT NOT NULL,
+                region TEXT NOT NULL,
+                subregion TEXT NOT NULL,
+                listing TEXT NOT NULL,
+                slug TEXT NOT NULL,
+                crawled_at TEXT NOT NULL,
+                hash TEXT,
+                PRIMARY KEY (kind, region, subregion, listing, slug, crawled_at))""")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS versions_listing "
+                "ON versions (listing, kind, slug, crawled_at)")
+            # The hash each record has now, so a crawl is compared without scanning history
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS latest (
+                kind TEXT NOT NULL,
+                region TEXT NOT NULL,
+                subregion TEXT NOT NULL,
+                listing TEXT NOT NULL,
+                slug TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                PRIMARY KEY (kind, region, subregion, listing, slug))""")
+
+    def begin(self, when=None):
+        """Starts recording a new crawl, at when or now."""
+        self.crawled_at = timestamp(when)
+
+    def _record(self, kind, region, subregion, listing, records):
+        versions = {}
+        bodies = {}
+        for record in records:
+            body = _canonical(kind, record)
+            versions[record['slug']] = hashlib.sha256(body.encode()).hexdigest()
+            bodies[versions[record['slug']]] = body
+        scope = (kind, region, subregion, listing)
+        with self._lock, self.connection:
+            latest = dict(self.connection.execute("SELECT slug, hash FROM latest WHERE "
+                "kind = ? AND region = ? AND subregion = ? AND listing = ?", scope))
+            changed = [(slug, digest) for slug, digest in versions.items()
+                if latest.get(slug) != digest]
+            removed = [slug for slug in latest if slug not in versions]
+            self.connection.executemany("INSERT OR IGNORE INTO bodies (hash, data) "
+                "VALUES (?, ?)", [(digest, zlib.compress(bodies[digest].encode()))
+                for _, digest in changed])
+            self.connection.executemany("INSERT OR REPLACE INTO versions VALUES "
+                "(?, ?, ?, ?, ?, ?, ?)", [scope + (slug, self.crawled_at, digest)
+                for slug, digest in changed] + [scope + (slug, self.crawled_at, None)
+                for slug in removed])
+            self.connection.executemany("INSERT OR REPLACE INTO latest VALUES "
+                "(?, ?, ?, ?, ?, ?)", [scope + (slug, digest) for slug, digest in changed])
+            self.connection.executemany("DELETE FROM latest WHERE kind = ? AND region = ? "
+                "AND subregion = ? AND listing = ? AND slug = ?",
+                [scope + (slug,) for slug in removed])
+        return {"written": len(changed), "unchanged": len(versions) - len(changed),
+            "removed": len(removed)}, removed
+
+    def on_subregions(self, region, subregions):
+        pass
+
+    def on_listings(self, region, subregion, listings):
+        counts, removed = self._record("listing", region, subregion, "", listings)
+        for listing in removed:
+            # A listing that is gone takes its menu with it
+            self._record("menu", region, subregion, listing, [])
+        return counts
+
+    def on_menu(self, region, subregion, listing, items):
+        return self._record("menu", region, subregion, listing, items)[0]
+
+    def on_deals(self, region, subregion, deals):
+        return self._record("deal", region, subregion, "", deals)[0]
+
+    def record(self, data_lib, when=None):
+        """
+        Records every listing, menu and deal of data_lib as one crawl.
+
+        Parameters
+        ----------
+        data_lib : dict
+            The crawled data.
+        when : datetime or str
+            Time of the crawl, defaults to now.
+
+        Returns
+        -------
+        counts : dict
+            Number of versions written, records unchanged and records removed.
+        """
+        self.begin(when)
+        counts = {"written": 0, "unchanged": 0, "removed": 0}
+        def add(result):
+            for key in counts:
+                counts[key] += result[key]
+        for region, subregions in data_lib.items():
+            for slug, subregion in subregions.items():
+                if 'listings' in subregion:
+                    listings = subregion['listings']
+                    add(self.on_listings(region, slug, listings.values()))
+                    for listing in listings.values():
+                        if 'menu' in listing:
+                            add(self.on_menu(region, slug, listing['slug'],
+                                listing['menu'].values()))
+                if 'deals' in subregion:
+                    add(self.on_deals(region, slug, subregion['deals'].values()))
+        return counts
+
+    def _versions_at(self, when, where="", params=()):
+        with self._lock:
+            return self.connection.execute("SELECT v.kind, v.region, v.subregion, v.listing, "
+                "v.slug, b.data FROM versions v JOIN (SELECT kind, region, subregion, listing, "
+                "slug, MAX(crawled_at) AS crawled_at FROM versions WHERE crawled_at <= ? "
+                f"{where} GROUP BY kind, region, subregion, listing, slug) current USING "
+                "(kind, region, subregion, listing, slug, crawled_at) JOIN bodies b "
+                "ON b.hash = v.hash ORDER BY v.kind, v.region, v.subregion, v.listing, v.slug",
+                (timestamp(when),) + tuple(params)).fetchall()
+
+    def state_at(self, when=None):
+        """
+        Rebuilds the data that was current at a time.
+
+        Parameters
+        ----------
+        when : datetime or str
+            The time to rebuild, defaults to now.
+
+        Returns
+        -------
+        data_lib : dict
+            Nested like Snooper.data_lib, with listings, menus and deals keyed by slug.
+        """
+        data_lib = {}
+        menus = []
+        for kind, region, subregion, listing, slug, data in self._versions_at(when):
+            record = json.loads(zlib.decompress(data))
+            scope = data_lib.setdefault(region, {}).setdefault(subregion,
+                {"slug": subregion, "region": region})
+            if kind == "listing":
+                scope.setdefault('listings', {})[slug] = record
+            elif kind == "deal":
+                scope.setdefault('deals', {})[slug] = record
+            else:
+                menus.append((scope, listing, slug, record))
+        for scope, listing, slug, record in menus:
+            listing = scope.setdefault('listings', {}).setdefault(listing, {"slug": listing})
+            listing.setdefault('menu', {})[slug] = record
+        return data_lib
+
+    def price_history(self, listing, item=None):
+        """
+        Reads every recorded version of a listing's menu items as a Dataframe.
+
+        Parameters
+        ----------
+        listing : str
+            Slug of the listing.
+        item : str
+            Slug of one menu item, None for the whole menu.
+
+        Returns
+        -------
+        history : Pandas.Dataframe
+            One row per version, with crawled_at, listing, slug, name, price.price,
+            price.unit, price.label and price.quantity. Removed items have a row with only
+            crawled_at, listing and slug set.
+        """
+        from lib.util import build_frame
+        sql = ("SELECT v.slug, v.crawled_at, b.data FROM versions v LEFT JOIN bodies b "
+            "ON b.hash = v.hash WHERE v.listing = ? AND v.kind = 'menu'")
+        params = [listing]
+        if item is not None:
+            sql += " AND v.slug = ?"
+            params.append(item)
+        with self._lock:
+            rows = self.connection.execute(sql + " ORDER BY v.slug, v.crawled_at",
+                params).fetchall()
+        records = [json.loads(zlib.decompress(data)) if data is not None else {}
+            for _, _, data in rows]
+        columns = ["crawled_at", "listing", "slug", "name", "price.price", "price.unit",
+            "price.label", "price.quantity"]
+        return build_frame(records, columns, {"crawled_at": [row[1] for row in rows],
+            "listing": [listing] * len(rows), "slug": [row[0] for row in rows]})
+
+    def report(self):
+        """
+        Describes what the store holds.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        report : dict
+            Number of versions, tombstones, distinct bodies and compressed body bytes.
+        """
+        with self._lock:
+            versions, tombstones = self.connection.execute("SELECT COUNT(*), "
+                "COUNT(*) - COUNT(hash) FROM versions").fetchone()
+            bodies, size = self.connection.execute("SELECT COUNT(*), "
+                "COALESCE(SUM(LENGTH(data)), 0) FROM bodies").fetchone()
+        return {"versions": versions, "tombstones": tombstones, "bodies": bodies,
+            "bytes": size}
+
+    def close(self):
+        """Closes the database."""
+        self.connection.close()
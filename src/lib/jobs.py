@@ -0,0 +1,534 @@
+"""jobs.py contains the crash safe, resumable crawl job queue.
+
+    A crawl is modeled as units of work stored in SQLite:
+        subregions  region               -> listings and deals units for every subregion
+        listings    subregion, page      -> the other listing pages, a menu unit per listing
+        menu        listing, page        -> the other menu pages
+        deals       subregion, page      -> the other deal pages
+    A unit's result and the units it discovered are committed in one transaction, so a
+    killed crawl resumes from the last finished unit without fetching any finished unit
+    again. Units that fail (a RequestError, or a KeyError from malformed JSON) are retried
+    a few times and then left as failed rather than aborting the crawl.
+
+    1. Objects
+        1. unit_kinds
+            The kinds of unit, each named after the url_library endpoint it fetches.
+        2. item_kinds
+            The kind each unit kind's items are counted under in common.metrics.
+    2. Classes
+        1. JobQueue
+            The SQLite table of units and their state.
+        2. Crawler
+            Runs the units of a JobQueue and assembles their results into data_lib.
+    3. Functions
+        1. unit
+            Builds a unit dict.
+        2. region_unit
+            Builds the subregions unit of a region, planning its deal queries.
+        3. execute
+            Fetches one unit and returns its result and the units it discovered.
+"""
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from lib import actors
+from lib import common
+
+unit_kinds = ("subregions", "listings", "menu", "deals")
+# Named as the actors name them, so a report reads the same however the crawl ran. Deals
+# are left out, WMRegions.merge_deals counts them once duplicates are dropped
+item_kinds = {"subregions": "subregions", "listings": "listings", "menu": "menu_items"}
+
+_columns = ("id", "kind", "region", "subregion", "listing", "page", "params", "state",
+    "attempts", "error", "owner", "lease_expires")
+
+
+def unit(kind, region, subregion="", listing="", page=0, params=None):
+    """
+    Builds a unit of work.
+
+    Parameters
+    ----------
+    kind : str
+        One of unit_kinds.
+    region : str
+    subregion : str
+    listing : str
+    page : int
+        0-based page of the endpoint.
+    params : dict
+        Anything else the unit needs, such as the subregion id deals are queried by.
+
+    Returns
+    -------
+    unit : dict
+    """
+    return {"kind": kind, "region": region, "subregion": subregion, "listing": listing,
+        "page": page, "params": params or {}}
+
+
+def region_unit(region):
+    """
+    Builds the subregions unit of a region. When common.deal_planner is set, the deal
+    queries it skips are planned now and kept in the unit's params, so retrying or resuming
+    the unit never plans them again.
+
+    Parameters
+    ----------
+    region : str
+
+    Returns
+    -------
+    unit : dict
+    """
+    planner = common.deal_planner
+    skipped = [] if planner is None else planner.plan(region, planner.known(region))[1]
+    return unit("subregions", region, params={"skip_deals": skipped})
+
+
+def _pages(found, page, total):
+    # Page 0 plans every other page when the total is known, otherwise pages continue
+    # one at a time until a short page
+    if total is not None:
+        return range(1, -(-total // common.page_size)) if page == 0 else range(0)
+    return range(page + 1, page + 2) if len(found) >= common.page_size else range(0)
+
+
+def execute(work):
+    """
+    Fetches one unit of work.
+
+    Parameters
+    ----------
+    work : dict
+        A unit as returned by JobQueue.claim or JobQueue.lease.
+
+    Returns
+    -------
+    found : list
+        The subregions, listings, menu items or deals on the unit's page.
+    children : list
+        The units it discovered.
+
+    Raises
+    ------
+    common.RequestError, KeyError, TypeError
+        If the page could not be fetched or was malformed.
+    """
+    region, subregion, page = work['region'], work['subregion'], work['page']
+    children = []
+    if work['kind'] == "subregions":
+        url = common.url_construct(common.url_library['subregions']['url'], region)
+        found = common.get_request(url)['data']['subregions']
+        skipped = work['params'].get('skip_deals', ())
+        for item in found:
+            children.append(unit("listings", region, item['slug']))
+            if item['slug'] not in skipped:
+                children.append(unit("deals", region, item['slug'], params={"id": item['id']}))
+    elif work['kind'] == "listings":
+        url = common.url_construct(common.url_library['dispensaries']['url'],
+            page * common.page_size, subregion)
+        rest_return = common.get_request(url)
+        found = rest_return['data']['listings']
+        children.extend(unit("menu", region, subregion, item['slug']) for item in found)
+        children.extend(unit("listings", region, subregion, page=more) for more in
+            _pages(found, page, rest_return['meta']['total_listings']))
+    elif work['kind'] == "menu":
+        url = common.url_construct(common.url_library['menu']['url'], work['listing'],
+            page + 1)
+        rest_return = common.get_request(url)
+        found = rest_return['data']['menu_items']
+        children.extend(unit("menu", region, subregion, work['listing'], more) for more in
+            _pages(found, page, rest_return['meta']['total_menu_items']))
+    elif work['kind'] == "deals":
+        url = common.url_construct(common.url_library['deals']['url'],
+            work['params']['id'], page + 1)
+        rest_return = common.get_request(url)
+        found = rest_return['data']['deals']
+        total = rest_return.get('meta', {}).get('total_deals')
+        children.extend(unit("deals", region, subregion, page=more, params=work['params'])
+            for more in _pages(found, page, total))
+    else:
+        raise ValueError(f"Unknown unit kind {work['kind']!r}")
+    return found, children
+
+
+class JobQueue:
+    """
+    Persists crawl units, their state and their results in SQLite.
+
+    Every unit is identified by (kind, region, subregion, listing, page); adding a unit
+    that already exists does nothing, so discovering the same work twice is harmless.
+
+    Attributes
+    ----------
+    path : str
+        The SQLite database file.
+
+    Methods
+    -------
+    add(units)
+        Queues units that are not queued yet.
+
+    claim()
+        Marks the oldest pending unit running and returns it, None if nothing is pending.
+
+    lease(owner, seconds, limit=1)
+        Claims up to limit units for owner until the lease expires, first requeueing units
+        whose lease has expired.
+
+    renew(owner, ids, seconds)
+        Extends owner's leases on some units.
+
+    complete(unit, result, children=(), owner=None)
+        Stores a unit's result and queues the units it discovered, atomically, and counts
+        its items in common.metrics. Returns False if the unit is no longer running, or no
+        longer leased to owner.
+
+    fail(unit, error, retries, owner=None)
+        Records a failed attempt, requeueing the unit while it has retries left.
+
+    recover()
+        Requeues units left running by a crawl that was killed.
+
+    retry_failed()
+        Requeues every failed unit.
+
+    counts()
+        Number of units in each state.
+
+    incomplete(kind, by_listing=False)
+        The (region, subregion) pairs, or (region, subregion, listing) triples, that have a
+        unit of a kind left unfinished.
+
+    results(kind)
+        Yields (unit, result) for every finished unit of a kind, in page order.
+
+    close()
+        Closes the database.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS units (
+                id INTEGER PRIMARY KEY,
+                kind TEXT NOT NULL,
+                region TEXT NOT NULL,
+                subregion TEXT NOT NULL,
+                listing TEXT NOT NULL,
+                page INTEGER NOT NULL,
+                params TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                owner TEXT,
+                lease_expires REAL,
+                result TEXT,
+                UNIQUE (kind, region, subregion, listing, page))""")
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS units_state ON units (state, id)")
+
+    def _insert(self, units):
+        cursor = self.connection.executemany("INSERT OR IGNORE INTO units (kind, region, "
+            "subregion, listing, page, params) VALUES (?, ?, ?, ?, ?, ?)",
+            [(item['kind'], item['region'], item['subregion'], item['listing'], item['page'],
+                json.dumps(item['params'])) for item in units])
+        return cursor.rowcount
+
+    def add(self, units):
+        """
+        Queues units that are not queued yet.
+
+        Parameters
+        ----------
+        units : iterable
+            Unit dicts as built by unit().
+
+        Returns
+        -------
+        added : int
+        """
+        with self._lock, self.connection:
+            return self._insert(list(units))
+
+    def claim(self):
+        leased = self.lease(None, None)
+        return leased[0] if leased else None
+
+    def lease(self, owner, seconds, limit=1):
+        """
+        Claims pending units for a worker.
+
+        Parameters
+        ----------
+        owner : str
+            Name of the worker, None for a local crawl.
+        seconds : float
+            How long the lease lasts before the units are handed to someone else. None
+            never expires; recover() requeues such units after a crash.
+        limit : int
+            Most units claimed at once.
+
+        Returns
+        -------
+        units : list
+        """
+        now = time.time()
+        expires = now + seconds if seconds is not None else None
+        with self._lock, self.connection:
+            expired = self.connection.execute("UPDATE units SET state = 'pending', "
+                "owner = NULL, lease_expires = NULL WHERE state = 'running' AND "
+                "lease_expires < ?", (now,)).rowcount
+            if expired:
+                print(f"Requeued {expired} units whose lease expired")
+            rows = self.connection.execute(f"SELECT {', '.join(_columns)} FROM units "
+                "WHERE state = 'pending' ORDER BY id LIMIT ?", (limit,)).fetchall()
+            self.connection.executemany("UPDATE units SET state = 'running', attempts = "
+                "attempts + 1, owner = ?, lease_expires = ? WHERE id = ?",
+                [(owner, expires, row[0]) for row in rows])
+        leased = []
+        for row in rows:
+            claimed = dict(zip(_columns, row))
+            claimed.update(params=json.loads(claimed['params']), owner=owner,
+                lease_expires=expires, attempts=claimed['attempts'] + 1)
+            leased.append(claimed)
+        return leased
+
+    def renew(self, owner, ids, seconds):
+        with self._lock, self.connection:
+            return self.connection.executemany("UPDATE units SET lease_expires = ? WHERE "
+                "id = ? AND owner = ? AND state = 'running'",
+                [(time.time() + seconds, unit_id, owner) for unit_id in ids]).rowcount
+
+    def _held(self, owner):
+        # Only the current holder of a running unit may finish it
+        return ("id = ? AND state = 'running'" +
+            (" AND owner = ?" if owner is not None else ""))
+
+    def complete(self, unit, result, children=(), owner=None):
+        held = (unit['id'],) + ((owner,) if owner is not None else ())
+        with self._lock, self.connection:
+            updated = self.connection.execute("UPDATE units SET state = 'done', result = ?, "
+                f"error = NULL, lease_expires = NULL WHERE {self._held(owner)}",
+                (json.dumps(result, default=dict),) + held).rowcount
+            if updated:
+                self._insert(list(children))
+        if updated and unit['kind'] in item_kinds:
+            common.metrics.ingested(item_kinds[unit['kind']], len(result))
+        return bool(updated)
+
+    def fail(self, unit, error, retries, owner=None):
+        state = "pending" if unit['attempts'] <= retries else "failed"
+        held = (unit['id'],) + ((owner,) if owner is not None else ())
+        with self._lock, self.connection:
+            updated = self.connection.execute("UPDATE units SET state = ?, error = ?, "
+                f"owner = NULL, lease_expires = NULL WHERE {self._held(owner)}",
+                (state, str(error)) + held).rowcount
+        return state if updated else None
+
+    def recover(self):
+        with self._lock, self.connection:
+            return self.connection.execute(
+                "UPDATE units SET state = 'pending', owner = NULL, lease_expires = NULL "
+                "WHERE state = 'running'").rowcount
+
+    def retry_failed(self):
+        with self._lock, self.connection:
+            return self.connection.execute("UPDATE units SET state = 'pending', attempts = 0 "
+                "WHERE state = 'failed'").rowcount
+
+    def counts(self):
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT state, COUNT(*) FROM units GROUP BY state").fetchall()
+        counts = {"pending": 0, "running": 0, "done": 0, "failed": 0}
+        counts.update(dict(rows))
+        return counts
+
+    def incomplete(self, kind, by_listing=False):
+        """
+        The (region, subregion) pairs, or (region, subregion, listing) triples when
+        by_listing, with a unit of kind that did not finish.
+        """
+        columns = "region, subregion, listing" if by_listing else "region, subregion"
+        with self._lock:
+            return set(self.connection.execute(f"SELECT DISTINCT {columns} FROM units "
+                "WHERE kind = ? AND state != 'done'", (kind,)).fetchall())
+
+    def results(self, kind):
+        with self._lock:
+            rows = self.connection.execute(f"SELECT {', '.join(_columns)}, result FROM units "
+                "WHERE kind = ? AND state = 'done' ORDER BY region, subregion, listing, page",
+                (kind,)).fetchall()
+        for row in rows:
+            finished = dict(zip(_columns, row))
+            finished['params'] = json.loads(finished['params'])
+            yield finished, json.loads(row[-1])
+
+    def close(self):
+        """Closes the database."""
+        self.connection.close()
+
+
+class Crawler:
+    """
+    Runs queued crawl units and rebuilds data_lib from their results.
+
+    Attributes
+    ----------
+    queue : JobQueue
+        The queue being worked through.
+
+    retries : int
+        Failed attempts allowed per unit before it is left as failed.
+
+    Methods
+    -------
+    plan(regions)
+        Queues a subregions unit for each region, with its deal queries planned.
+
+    run(workers=1)
+        Works through the queue until nothing is pending, recovering units a killed crawl
+        left running first. Calling it again on the same queue resumes.
+
+    execute(unit)
+        Fetches one unit and returns its result and the units it discovered.
+
+    assemble()
+        Rebuilds controller.data_lib from every finished unit and notifies the sinks.
+    """
+    def __init__(self, controller, queue, retries=3):
+        self.controller = controller
+        self.queue = queue
+        self.retries = retries
+
+    def plan(self, regions):
+        return self.queue.add(region_unit(region) for region in regions)
+
+    def execute(self, work):
+        return execute(work)
+
+    def _work(self, stop):
+        while not stop.is_set():
+            work = self.queue.claim()
+            if work is None:
+                counts = self.queue.counts()
+                # A running unit may still discover more work
+                if not counts['pending'] and not counts['running']:
+                    return
+                time.sleep(0.05)
+                continue
+            try:
+                found, children = self.execute(work)
+            except (common.RequestError, KeyError, TypeError) as error:
+                state = self.queue.fail(work, repr(error), self.retries)
+                print(f"Unit {work['kind']} {work['subregion'] or work['region']} "
+                    f"{work['listing']} page {work['page']} failed ({state}): {error!r}")
+                continue
+            self.queue.complete(work, found, children)
+
+    def run(self, workers=1):
+        """
+        Works through the queue until no unit is pending or running.
+
+        Parameters
+        ----------
+        workers : int
+            Number of units executed at once.
+
+        Returns
+        -------
+        counts : dict
+            Number of units in each state once the run is over.
+        """
+        recovered = self.queue.recover()
+        if recovered:
+            print(f"Resuming: {recovered} interrupted units requeued")
+        stop = threading.Event()
+
+        def work():
+            try:
+                self._work(stop)
+            except BaseException:
+                # Anything unexpected stops every worker; its unit stays running until resumed
+                stop.set()
+                raise
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for future in [pool.submit(work) for _ in range(workers)]:
+                future.result()
+        counts = self.queue.counts()
+        print(f"Crawl units: {counts}")
+        return counts
+
+    def assemble(self):
+        """
+        Rebuilds controller.data_lib from every finished unit, the way the actors store
+        what they download, and notifies the controller's sinks.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        data_lib : dict
+        """
+        data_lib = self.controller.data_lib
+        for work, found in self.queue.results("subregions"):
+            for item in found:
+                item['region'] = work['region']
+                data_lib.setdefault(work['region'], {}).setdefault(item['slug'], {}).update(item)
+            self.controller.notify('subregions', work['region'], found)
+
+        # A scope with a page that did not finish keeps the data it had, rather than being
+        # replaced by its other pages as if they were all of it
+        listings = {}
+        incomplete = self.queue.incomplete("listings")
+        for work, found in self.queue.results("listings"):
+            if (work['region'], work['subregion']) in incomplete:
+                continue
+            scope = listings.setdefault((work['region'], work['subregion']), {})
+            for item in found:
+                item['region'] = work['region']
+                item['subregion'] = work['subregion']
+                scope[item['slug']] = actors.compact('listing', item)
+        for (region, subregion), found in listings.items():
+            found = OrderedDict(sorted(found.items()))
+            data_lib[region][subregion]['listings'] = found
+            self.controller.notify('listings', region, subregion, found.values())
+
+        menus = {}
+        incomplete = self.queue.incomplete("menu", by_listing=True)
+        for work, found in self.queue.results("menu"):
+            if (work['region'], work['subregion'], work['listing']) in incomplete:
+                continue
+            menu = menus.setdefault((work['region'], work['subregion'], work['listing']), {})
+            menu.update((item['slug'], actors.compact('menu', item)) for item in found)
+        for (region, subregion, slug), menu in menus.items():
+            listing = data_lib[region][subregion].get('listings', {}).get(slug)
+            if listing is None:
+                continue
+            listing['menu'] = OrderedDict(sorted(menu.items()))
+            listing['menu_fingerprint'] = actors.listing_fingerprint(listing)
+            self.controller.notify('menu', region, subregion, slug, listing['menu'].values())
+
+        batches = {}
+        for work, found in self.queue.results("deals"):
+            batches.setdefault(work['region'], {}).setdefault(work['subregion'], []).extend(found)
+        # Subregions with a deals page that failed are neither learned from nor recorded
+        incomplete = self.queue.incomplete("deals")
+        for region, found in batches.items():
+            if common.deal_planner is not None:
+                common.deal_planner.observe(region, {subregion: deals for subregion, deals
+                    in found.items() if (region, subregion) not in incomplete})
+            self.controller.Regions.merge_deals(region, found.values(),
+                [subregion for subregion in data_lib[region]
+                if (region, subregion) not in incomplete])
+        return data_lib
@@ -0,0 +1,173 @@
+"""manifest.py contains the export manifest that lets exports skip unchanged outputs.
+
+    Every output an export writes (a CSV, a Parquet partition, export.json) is recorded with
+    a digest of the source data it was generated from. The next export compares the digest
+    of its source data with the recorded one and leaves the file alone when they match and
+    the file is still there, without building its Dataframe at all. Outputs are written to a
+    hidden temporary file next to them and renamed over them, so readers only ever see a
+    complete file.
+
+    1. Objects
+        None
+    2. Classes
+        1. ExportManifest
+            The recorded digest and size of every output under a directory.
+    3. Functions
+        1. digest
+            Hashes JSON serializable source data.
+        2. replacing
+            Context manager writing a file atomically.
+        3. is_current
+            Compares a manifest entry with the digest of the current source data.
+"""
+import hashlib
+import json
+import os
+from contextlib import contextmanager
+
+
+def digest(data):
+    """
+    Hashes source data, independently of the order of dict keys.
+
+    Parameters
+    ----------
+    data : object
+        JSON serializable data. records.Record and shards.ShardedRegion mappings are
+        serialized as dicts.
+
+    Returns
+    -------
+    digest : str
+    """
+    text = json.dumps(data, sort_keys=True, separators=(",", ":"), default=dict)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+@contextmanager
+def replacing(path):
+    """
+    Yields a temporary path to write instead of path, and renames it over path once the
+    block finishes. The temporary file is hidden, so dataset readers skip it, and removed
+    if the block fails.
+
+    Parameters
+    ----------
+    path : str
+        The file to replace.
+
+    Yields
+    ------
+    temp : str
+    """
+    directory, name = os.path.split(path)
+    temp = os.path.join(directory, f".{name}.tmp")
+    try:
+        yield temp
+        os.replace(temp, path)
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+
+
+def is_current(entry, source, path):
+    """True if path exists and was generated from source data with digest source."""
+    return entry is not None and entry['digest'] == source and os.path.exists(path)
+
+
+class ExportManifest:
+    """
+    Records the digest of the source data and the size of every output under a directory.
+
+    Attributes
+    ----------
+    path : str
+        JSON file the manifest is kept in. Outputs are recorded relative to its directory.
+
+    stats : dict
+        Outputs written and skipped, and the bytes written and not rewritten.
+
+    Methods
+    -------
+    entry(path)
+        The recorded digest and size of an output, or None.
+
+    current(path, source)
+        True if the output exists and was generated from the same source data.
+
+    record(path, source, written=True)
+        Records an output as written from source, or as skipped.
+
+    write(path, source, write)
+        Writes an output atomically with write(temp) unless it is current.
+
+    save()
+        Writes the manifest atomically.
+
+    report()
+        Returns the stats.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.root = os.path.dirname(os.path.abspath(path))
+        self.stats = {"written": 0, "skipped": 0, "bytes_written": 0, "bytes_saved": 0}
+        try:
+            with open(path, encoding="utf8") as in_file:
+                self.outputs = json.load(in_file)['outputs']
+        except (FileNotFoundError, ValueError, KeyError):
+            self.outputs = {}
+
+    def _key(self, path):
+        return os.path.relpath(os.path.abspath(path), self.root)
+
+    def entry(self, path):
+        return self.outputs.get(self._key(path))
+
+    def current(self, path, source):
+        return is_current(self.entry(path), source, path)
+
+    def record(self, path, source, written=True):
+        size = os.path.getsize(path)
+        if written:
+            self.outputs[self._key(path)] = {"digest": source, "bytes": size}
+            self.stats['written'] += 1
+            self.stats['bytes_written'] += size
+        else:
+            self.stats['skipped'] += 1
+            self.stats['bytes_saved'] += size
+
+    def write(self, path, source, write):
+        """
+        Writes an output unless it is current.
+
+        Parameters
+        ----------
+        path : str
+            The output file.
+        source : str
+            digest of the data the output is generated from.
+        write : function
+            Called with the temporary path to write the output to.
+
+        Returns
+        -------
+        written : boolean
+        """
+        if self.current(path, source):
+            self.record(path, source, written=False)
+            return False
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with replacing(path) as temp:
+            write(temp)
+        self.record(path, source)
+        return True
+
+    def save(self):
+        """Writes the manifest atomically."""
+        os.makedirs(self.root, exist_ok=True)
+        with replacing(self.path) as temp:
+            with open(temp, "w", encoding="utf8") as out_file:
+                json.dump({"outputs": self.outputs}, out_file, indent=1, sort_keys=True)
+
+    def report(self):
+        return dict(self.stats)
@@ -0,0 +1,228 @@
+"""metrics.py contains the request and ingest metrics collected while Snooper crawls.
+
+    common.get_request records every attempt it makes against the url_library endpoint the
+    url was built from, and the actors record how many items they ingest. The collected
+    metrics can be read in process with Metrics.report() or written at the end of a run as
+    a Prometheus textfile (for the node_exporter textfile collector) or a JSON summary.
+
+    1. Objects
+        1. latency_buckets
+            Upper bounds, in seconds, of the request latency histogram buckets.
+    2. Classes
+        1. Metrics
+            Thread safe per-endpoint request metrics and per-kind item counters.
+    3. Functions
+        None
+"""
+import bisect
+import json
+import os
+import threading
+
+latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _labels(**labels):
+    return ",".join(f'{key}="{value}"' for key, value in labels.items())
+
+
+def _write_atomic(path, text):
+    temp = path + ".tmp"
+    with open(temp, "w", encoding="utf8") as out_file:
+        out_file.write(text)
+    os.replace(temp, path)
+
+
+class Metrics:
+    """
+    Collects request metrics per url_library endpoint and items ingested per kind.
+
+    Requests to urls that were not built from url_library are recorded under 'other'.
+
+    Attributes
+    ----------
+    prefix : str
+        Prefix of every Prometheus metric name.
+
+    Methods
+    -------
+    observe(endpoint, seconds, status=None, size=0)
+        Records one request attempt. status is None when no response was received.
+
+    retried(endpoint)
+    failed(endpoint)
+    cached(endpoint)
+    coalesced(endpoint)
+        Count a retry, a request that failed for good, a response served from cache, and a
+        request that shared the response of an identical request in flight.
+
+    ingested(kind, count)
+        Counts items ingested by the actors or by finished job units.
+
+    report()
+        Returns a JSON serializable summary.
+
+    prometheus()
+        Returns the metrics in the Prometheus text exposition format.
+
+    write_textfile(path)
+    write_json(path)
+        Atomically write the Prometheus text or the JSON summary to a file.
+
+    reset()
+        Forgets everything recorded so far.
+    """
+    def __init__(self, prefix="snooper"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+            self._items = {}
+
+    def _endpoint(self, endpoint):
+        endpoint = endpoint or "other"
+        if endpoint not in self._endpoints:
+            self._endpoints[endpoint] = {"requests": 0, "retries": 0, "failures": 0,
+                "cache_hits": 0, "coalesced": 0, "bytes": 0, "statuses": {},
+                "latency_sum": 0.0, "latency_max": 0.0,
+                "buckets": [0] * (len(latency_buckets) + 1)}
+        return self._endpoints[endpoint]
+
+    def observe(self, endpoint, seconds, status=None, size=0):
+        status = "error" if status is None else str(status)
+        with self._lock:
+            stats = self._endpoint(endpoint)
+            stats["requests"] += 1
+            stats["bytes"] += size
+            stats["statuses"][status] = stats["statuses"].get(status, 0) + 1
+            stats["latency_sum"] += seconds
+            stats["latency_max"] = max(stats["latency_max"], seconds)
+            stats["buckets"][bisect.bisect_left(latency_buckets, seconds)] += 1
+
+    def retried(self, endpoint):
+        with self._lock:
+            self._endpoint(endpoint)["retries"] += 1
+
+    def failed(self, endpoint):
+        with self._lock:
+            self._endpoint(endpoint)["failures"] += 1
+
+    def cached(self, endpoint):
+        with self._lock:
+            self._endpoint(endpoint)["cache_hits"] += 1
+
+    def coalesced(self, endpoint):
+        with self._lock:
+            self._endpoint(endpoint)["coalesced"] += 1
+
+    def ingested(self, kind, count):
+        with self._lock:
+            self._items[kind] = self._items.get(kind, 0) + count
+
+    def _quantile(self, stats, quantile):
+        # Upper bound of the bucket holding the quantile, the largest latency past the last
+        rank = quantile * stats["requests"]
+        seen = 0
+        for bound, count in zip(latency_buckets, stats["buckets"]):
+            seen += count
+            if seen >= rank:
+                return min(bound, stats["latency_max"])
+        return stats["latency_max"]
+
+    def report(self):
+        """
+        Summarizes the metrics.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        report : dict
+            'endpoints' maps each endpoint to its request, retry, failure, cache hit,
+            coalesced, byte and status counts and latency summary; 'items' maps each kind
+            to its count.
+        """
+        with self._lock:
+            endpoints = {}
+            for endpoint, stats in sorted(self._endpoints.items()):
+                requests = stats["requests"]
+                endpoints[endpoint] = {
+                    "requests": requests,
+                    "retries": stats["retries"],
+                    "failures": stats["failures"],
+                    "cache_hits": stats["cache_hits"],
+                    "coalesced": stats["coalesced"],
+                    "bytes": stats["bytes"],
+                    "statuses": dict(sorted(stats["statuses"].items())),
+                    "latency": {
+                        "total": round(stats["latency_sum"], 6),
+                        "mean": round(stats["latency_sum"] / requests, 6) if requests else 0.0,
+                        "p50": self._quantile(stats, 0.5) if requests else 0.0,
+                        "p95": self._quantile(stats, 0.95) if requests else 0.0,
+                        "max": round(stats["latency_max"], 6),
+                    },
+                }
+            return {"endpoints": endpoints, "items": dict(sorted(self._items.items()))}
+
+    def prometheus(self):
+        """
+        Renders the metrics in the Prometheus text exposition format.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        text : str
+        """
+        name = self.prefix
+        lines = []
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+            items = sorted(self._items.items())
+            lines += [f"# HELP {name}_request_duration_seconds Latency of each request attempt.",
+                f"# TYPE {name}_request_duration_seconds histogram"]
+            for endpoint, stats in endpoints:
+                total = 0
+                for bound, count in zip(latency_buckets + ("+Inf",), stats["buckets"]):
+                    total += count
+                    lines.append(f"{name}_request_duration_seconds_bucket"
+                        f"{{{_labels(endpoint=endpoint, le=bound)}}} {total}")
+                lines.append(f"{name}_request_duration_seconds_sum{{{_labels(endpoint=endpoint)}}}"
+                    f" {stats['latency_sum']:.6f}")
+                lines.append(f"{name}_request_duration_seconds_count"
+                    f"{{{_labels(endpoint=endpoint)}}} {stats['requests']}")
+            lines += [f"# HELP {name}_responses_total Request attempts by HTTP status.",
+                f"# TYPE {name}_responses_total counter"]
+            for endpoint, stats in endpoints:
+                for status, count in sorted(stats["statuses"].items()):
+                    lines.append(f"{name}_responses_total"
+                        f"{{{_labels(endpoint=endpoint, status=status)}}} {count}")
+            for metric, key, help_text in (
+                ("response_bytes_total", "bytes", "Bytes of response bodies received."),
+                ("retries_total", "retries", "Request attempts that were retried."),
+                ("request_failures_total", "failures", "Requests that failed every attempt."),
+                ("cache_hits_total", "cache_hits", "Requests served from the response cache."),
+                ("coalesced_total", "coalesced", "Requests that shared an identical request.")):
+                lines += [f"# HELP {name}_{metric} {help_text}", f"# TYPE {name}_{metric} counter"]
+                lines += [f"{name}_{metric}{{{_labels(endpoint=endpoint)}}} {stats[key]}"
+                    for endpoint, stats in endpoints]
+            lines += [f"# HELP {name}_items_total Items ingested by the crawl.",
+                f"# TYPE {name}_items_total counter"]
+            lines += [f"{name}_items_total{{{_labels(kind=kind)}}} {count}"
+                for kind, count in items]
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path):
+        """Atomically writes the Prometheus text to path."""
+        _write_atomic(path, self.prometheus())
+
+    def write_json(self, path):
+        """Atomically writes the JSON summary to path."""
+        _write_atomic(path, json.dumps(self.report(), indent=2))
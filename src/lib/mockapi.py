@@ -0,0 +1,294 @@
+"""mockapi.py contains a local stand-in for the WeedMaps endpoints in common.url_library.
+
+    The server generates deterministic synthetic regions on the fly, so any size of crawl
+    can be replayed without touching WeedMaps:
+        /wm/v1/regions/<region>/subregions
+        /discovery/v1/listings?offset=...&filter[region_slug[dispensaries]]=<subregion>
+        /discovery/v1/listings/dispensaries/<listing>/menu_items?page=...
+        /discovery/v1/deals?filter[region_id]=<subregion id>&page=...
+    Latency, server errors and 429 throttling can be injected to exercise the retry and
+    rate limiting paths.
+
+    1. Objects
+        1. api_host
+            The scheme and host every url_library url starts with.
+    2. Classes
+        1. MockWeedMaps
+            A threaded HTTP server serving the synthetic API.
+        2. MockTransport
+            An HTTPTransport that sends url_library requests to a MockWeedMaps server.
+    3. Functions
+        None
+"""
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from lib.transport import HTTPTransport
+
+api_host = "https://api-g.weedmaps.com"
+
+_categories = ["Flower", "Edible", "Concentrate", "Pre-Roll", "Vape", "Topical"]
+_edge_categories = ["Indica", "Sativa", "Hybrid", None]
+_units = ["g", "oz", "each", "mg"]
+
+
+class MockWeedMaps:
+    """
+    Serves synthetic WeedMaps responses on a local port.
+
+    Every region has the same number of subregions, every subregion the same number of
+    listings and deals, and every listing the same number of menu items, so the size of a
+    crawl is known in advance.
+
+    Attributes
+    ----------
+    url : str
+        Base url of the running server, e.g. http://127.0.0.1:54321.
+
+    stats : dict
+        Requests served, errors and 429s injected, and items returned.
+
+    Methods
+    -------
+    start()
+        Starts serving on a background thread.
+
+    stop()
+        Shuts the server down.
+
+    expected(regions=None)
+        Number of subregions, listings, menu items and deals a full crawl should find.
+    """
+    def __init__(self, regions=None, subregions=4, listings=20, items=150, deals=30,
+        page_size=100, latency=0.0, error_rate=0.0, throttle_rate=0.0, retry_after="0", seed=0):
+        self.regions = list(regions or ["oklahoma"])
+        self.subregions = subregions
+        self.listings = listings
+        self.items = items
+        self.deals = deals
+        self.page_size = page_size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.seed = seed
+        self.url = None
+        self.stats = {"requests": 0, "errors": 0, "throttled": 0, "items": 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        """Starts the server on a free local port."""
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are separate writes; don't let Nagle hold the body back
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                status, body, headers = mock.respond(self.path)
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,),
+            daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the server."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def expected(self, regions=None):
+        """
+        Counts what a full crawl of some regions should download.
+
+        Parameters
+        ----------
+        regions : iterable
+            Regions crawled, defaults to every region served.
+
+        Returns
+        -------
+        counts : dict
+            Number of subregions, listings, menu_items and deals.
+        """
+        subregions = len(list(regions or self.regions)) * self.subregions
+        return {"subregions": subregions, "listings": subregions * self.listings,
+            "menu_items": subregions * self.listings * self.items,
+            "deals": subregions * self.deals}
+
+    def respond(self, path):
+        """
+        Builds the response to a request path.
+
+        Parameters
+        ----------
+        path : str
+            Path and query string of the request.
+
+        Returns
+        -------
+        status : int
+        body : dict
+        headers : dict
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.stats["requests"] += 1
+            roll = self._random.random()
+        if roll < self.throttle_rate:
+            with self._lock:
+                self.stats["throttled"] += 1
+            return 429, {"errors": [{"title": "Too Many Requests"}]}, \
+                {"Retry-After": self.retry_after}
+        if roll < self.throttle_rate + self.error_rate:
+            with self._lock:
+                self.stats["errors"] += 1
+            return 500, {"errors": [{"title": "Internal Server Error"}]}, {}
+        parts = urlsplit(path)
+        # url_library urls carry indentation from their line continuations; drop it
+        query = {key.replace(" ", ""): values[0].strip()
+            for key, values in parse_qs(parts.query).items()}
+        routes = [
+            (r"/wm/v1/regions/([^/]+)/subregions", self._subregions),
+            (r"/discovery/v1/listings/dispensaries/([^/]+)/menu_items", self._menu_items),
+            (r"/discovery/v1/listings", self._listings),
+            (r"/discovery/v1/deals", self._deals),
+        ]
+        for pattern, route in routes:
+            match = re.fullmatch(pattern, parts.path)
+            if match:
+                body, items = route(query, *match.groups())
+                with self._lock:
+                    self.stats["items"] += items
+                return 200, body, {}
+        return 404, {"errors": [{"title": "Not Found"}]}, {}
+
+    def _subregion_slug(self, region, index):
+        return f"{region}-{index:03d}"
+
+    def _subregion_id(self, region, index):
+        return self.regions.index(region) * 10000 + index + 1
+
+    def _page(self, total, start):
+        return range(start, min(start + self.page_size, total))
+
+    def _subregions(self, query, region):
+        if region not in self.regions:
+            return {"data": {"subregions": []}}, 0
+        subregions = [{"id": self._subregion_id(region, i),
+            "slug": self._subregion_slug(region, i), "name": f"{region.title()} {i}"}
+            for i in range(self.subregions)]
+        return {"data": {"subregions": subregions}}, len(subregions)
+
+    def _listings(self, query, *_):
+        subregion = query.get("filter[region_slug[dispensaries]]", "")
+        offset = int(query.get("offset", 0))
+        listings = [self._listing(subregion, i) for i in self._page(self.listings, offset)]
+        return {"meta": {"total_listings": self.listings},
+            "data": {"listings": listings}}, len(listings)
+
+    def _listing(self, subregion, index):
+        rng = random.Random(f"{self.seed}:{subregion}:{index}")
+        slug = f"{subregion}-shop-{index:03d}"
+        return {
+            "id": zlib.crc32(slug.encode()), "name": f"Shop {index}", "slug": slug,
+            "city": subregion.split("-")[0].title(), "type": "dispensary",
+            "web_url": f"https://weedmaps.com/dispensaries/{slug}",
+            "ranking": index + 1, "rating": round(rng.uniform(3, 5), 1),
+            "reviews_count": rng.randint(0, 500), "has_sale_items": rng.random() < 0.5,
+            "address": f"{index} Main St", "zip_code": f"{73000 + index}",
+            "timezone": "America/Chicago", "open_now": rng.random() < 0.7,
+            "closes_in": rng.randint(0, 720), "todays_hours_str": "9:00am - 9:00pm",
+            "menu_items_count": self.items, "verified_menu_items_count": self.items // 2,
+            "is_published": True, "email": f"{slug}@example.com", "phone_number": "5550100",
+            "updated_at": "2024-01-01T00:00:00Z", "menu_updated_at": "2024-01-01T00:00:00Z",
+            "avatar_image": {"original_url": f"https://images.example/{slug}.png"},
+        }
+
+    def _menu_items(self, query, listing):
+        start = (int(query.get("page", 1)) - 1) * self.page_size
+        items = [self._menu_item(listing, i) for i in self._page(self.items, start)]
+        return {"meta": {"total_menu_items": self.items},
+            "data": {"menu_items": items}}, len(items)
+
+    def _menu_item(self, listing, index):
+        rng = random.Random(f"{self.seed}:{listing}:{index}")
+        edge = rng.choice(_edge_categories)
+        return {
+            "id": index, "name": f"Item {index}", "slug": f"{listing}-item-{index:04d}",
+            "category": {"name": rng.choice(_categories), "id": index % 6},
+            "edge_category": {"name": edge} if edge else None,
+            "price": {"price": round(rng.uniform(5, 80), 2), "unit": rng.choice(_units),
+                "label": None, "quantity": rng.choice([1, 3.5, 7, 28])},
+            "reviews_count": rng.randint(0, 50), "rating": round(rng.uniform(0, 5), 1),
+            "is_endorsed": rng.random() < 0.2, "is_badged": rng.random() < 0.1,
+            "created_at": "2024-01-01T00:00:00Z",
+            "description": "Synthetic menu item " * 4,
+            "images": [{"url": f"https://images.example/{listing}/{index}.png"}],
+        }
+
+    def _deals(self, query, *_):
+        subregion_id = int(query.get("filter[region_id]", 0))
+        region = self.regions[(subregion_id - 1) // 10000] if subregion_id else None
+        start = (int(query.get("page", 1)) - 1) * self.page_size
+        deals = []
+        if region is not None:
+            subregion = self._subregion_slug(region, (subregion_id - 1) % 10000)
+            deals = [{"id": subregion_id * 100000 + i, "slug": f"{subregion}-deal-{i:04d}",
+                "title": f"Deal {i}", "body": "Synthetic deal",
+                "listing": {"slug": f"{subregion}-shop-{i % max(self.listings, 1):03d}",
+                    "region": {"slug": subregion},
+                    "web_url": f"https://weedmaps.com/dispensaries/{subregion}-shop"}}
+                for i in self._page(self.deals, start)]
+        return {"meta": {"total_deals": self.deals}, "data": {"deals": deals}}, len(deals)
+
+
+class MockTransport(HTTPTransport):
+    """
+    An HTTPTransport sending requests for api_host to a MockWeedMaps server instead.
+
+    Attributes
+    ----------
+    base_url : str
+        Base url of the server replacing api_host.
+    """
+    def __init__(self, base_url, pool_size=10, timeout=(5, 30)):
+        super().__init__(pool_size, timeout)
+        self.base_url = base_url
+
+    def get(self, url, headers=None):
+        if url.startswith(api_host):
+            url = self.base_url + url[len(api_host):]
+        return super().get(url, headers)
@@ -0,0 +1,99 @@
+"""paging.py contains the pagination engine shared by the actors for paged endpoints.
+    1. Objects
+        None
+    2. Classes
+        None
+    3. Functions
+        1. fetch_pages
+            Fetches every page of a paged endpoint, concurrently once the total is known.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from lib import common
+
+
+def _fetch_sequential(url_for, items_of, first, page_size):
+    pages = [first]
+    while len(pages[-1]) >= page_size:
+        pages.append(items_of(common.get_request(url_for(len(pages)))))
+    return pages
+
+
+def fetch_pages(url_for, items_of, total_of, key="slug", page_size=None, workers=None,
+    label="pages"):
+    """
+    Fetches every page of a paged endpoint and reassembles the items in page order.
+
+    Page 0 is fetched first to learn the total. The remaining pages are then planned and
+    fetched concurrently on a pool of workers; every request still goes through the shared
+    rate limiter and common.in_flight, so pages fetched inside another pool, such as the
+    menus of get_menus, never exceed the global cap on requests in flight. When the
+    endpoint does not report a total, pages are fetched one at a time until a short page
+    comes back. Short pages before the last one are retried once, items repeated across
+    pages are dropped, and anything inconsistent is reported.
+
+    Parameters
+    ----------
+    url_for : function
+        Returns the url of a 0-based page index.
+    items_of : function
+        Returns the list of items in a response.
+    total_of : function
+        Returns the total number of items from the first response, or None if unknown.
+    key : str
+        Field identifying an item, used to find duplicates.
+    page_size : int
+        Items per page, defaults to common.page_size.
+    workers : int
+        Pages fetched at once, defaults to common.page_workers.
+    label : str
+        Name of what is being fetched, used in messages.
+
+    Returns
+    -------
+    items : list
+        Every item, in page order, without duplicates.
+    report : dict
+        Number of pages fetched, short pages, duplicated items and items missing from the
+        reported total.
+    """
+    page_size = page_size or common.page_size
+    workers = workers or common.page_workers
+    first = common.get_request(url_for(0))
+    total = total_of(first)
+    pages = [items_of(first)]
+    retried = 0
+    if total is None:
+        pages = _fetch_sequential(url_for, items_of, pages[0], page_size)
+    elif total > page_size:
+        count = -(-total // page_size)
+        fetch = lambda index: items_of(common.get_request(url_for(index)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pages.extend(pool.map(fetch, range(1, count)))
+            short = [index for index in range(count - 1) if len(pages[index]) < page_size]
+            for index, page in zip(short, pool.map(fetch, short)):
+                pages[index] = page
+                retried += 1
+
+    items = []
+    seen = set()
+    report = {"pages": len(pages) + retried, "short": 0, "duplicates": 0, "missing": 0}
+    for index, page in enumerate(pages):
+        if index < len(pages) - 1 and len(page) < page_size:
+            report["short"] += 1
+        for item in page:
+            try:
+                identity = item[key]
+            except (KeyError, TypeError):
+                # Malformed items are passed through for the caller to deal with
+                items.append(item)
+                continue
+            if identity in seen:
+                report["duplicates"] += 1
+                continue
+            seen.add(identity)
+            items.append(item)
+    if total is not None:
+        report["missing"] = max(total - len(items), 0)
+    if report["short"] or report["duplicates"] or report["missing"]:
+        print(f"Warning: inconsistent {label}: {report}")
+    return items, report
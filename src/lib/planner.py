@@ -0,0 +1,270 @@
+"""planner.py contains the request planning that keeps Snooper from asking twice.
+
+    Deals are queried per subregion by region_id, but a query also returns deals filed under
+    neighbouring subregions, which merge_deals re-buckets by the deal's own subregion and
+    dedupes. Many queries therefore return nothing the other queries of the region did not.
+    DealPlanner remembers, per region, which queries were needed to cover every deal that
+    was found (a greedy set cover of the deal ids each query returned) and skips queries
+    that were redundant several runs in a row. Every few runs all queries are made again,
+    so a subregion that gains deals of its own is noticed.
+
+    SingleFlight coalesces identical requests that are in flight at the same time: callers
+    asking for a url that is already being fetched wait for that fetch and share its body.
+
+    1. Objects
+        None
+    2. Classes
+        1. SingleFlight
+            Runs concurrent calls with the same key once.
+        2. DealPlanner
+            Learns which subregion deal queries are redundant and skips them.
+    3. Functions
+        None
+"""
+import copy
+import json
+import os
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """
+    Runs a function once per key among the callers that ask for that key at the same time.
+
+    The caller that starts a call is its leader; callers arriving while it runs wait for
+    it and get the same result, or the same exception. When a call was shared, the leader
+    and every follower each get their own deep copy of the result, so callers are free to
+    modify what they are given.
+
+    Attributes
+    ----------
+    stats : dict
+        Number of calls made, and how many of them were coalesced into another call.
+
+    Methods
+    -------
+    do(key, function)
+        Returns function(), or the result of the call already running for key.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.stats = {"calls": 0, "coalesced": 0}
+
+    def do(self, key, function):
+        """
+        Calls function unless a call for key is already running, then waits for that one.
+
+        Parameters
+        ----------
+        key : hashable
+            Identifies identical calls, such as a url.
+        function : function
+            Called without arguments by the leader.
+
+        Returns
+        -------
+        result : object
+            What function returned.
+        coalesced : boolean
+            Whether the result came from a call another caller started.
+
+        Raises
+        ------
+        Exception
+            Whatever function raised.
+        """
+        with self._lock:
+            self.stats["calls"] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.followers += 1
+                self.stats["coalesced"] += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result), True
+        try:
+            call.result = function()
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            # Nobody can join once the call is removed, so followers is final
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        if call.followers:
+            return copy.deepcopy(call.result), False
+        return call.result, False
+
+
+def _cover(found):
+    # Greedy set cover: the queries that together return every id, in the order picked
+    uncovered = set().union(*found.values()) if found else set()
+    cover = []
+    while uncovered:
+        best = max(found, key=lambda slug: len(found[slug] & uncovered))
+        cover.append(best)
+        uncovered -= found[best]
+    return cover
+
+
+class DealPlanner:
+    """
+    Plans which subregions of a region to query for deals.
+
+    Attributes
+    ----------
+    path : str
+        JSON file the learned state is kept in, None to keep it in memory only.
+
+    confirm : int
+        Runs in a row a query has to be redundant before it is skipped.
+
+    verify_every : int
+        Every this many runs of a region, every query is made again.
+
+    page_size : int
+        Deals per page, used to estimate the requests a skipped query saves.
+
+    stats : dict
+        Queries planned and skipped, and the requests the skipped queries would have made.
+
+    Methods
+    -------
+    plan(region, subregions)
+        Splits the subregions into those to query and those to skip.
+
+    observe(region, results)
+        Learns from the deals each query returned.
+
+    known(region)
+        The subregions of a region the planner has learned about.
+
+    report()
+        The stats and, per region, the subregions currently skipped.
+    """
+    def __init__(self, path=None, confirm=3, verify_every=10, page_size=100):
+        self.path = path
+        self.confirm = confirm
+        self.verify_every = verify_every
+        self.page_size = page_size
+        self.stats = {"planned": 0, "skipped": 0, "requests_saved": 0}
+        self._lock = threading.Lock()
+        self._regions = {}
+        if path is not None and os.path.exists(path):
+            with open(path, encoding="utf8") as in_file:
+                self._regions = json.load(in_file)
+
+    def _skippable(self, state, slug):
+        query = state['queries'].get(slug)
+        return query is not None and query['redundant'] >= self.confirm and \
+            state['runs'] % self.verify_every != 0
+
+    def plan(self, region, subregions):
+        """
+        Decides which subregions' deal queries to make.
+
+        Parameters
+        ----------
+        region : str
+            Region slug.
+        subregions : iterable
+            Slugs of the region's subregions.
+
+        Returns
+        -------
+        queried : list
+            Subregion slugs to query, in the order given.
+        skipped : list
+            Subregion slugs whose deals the other queries are expected to return.
+        """
+        subregions = list(subregions)
+        with self._lock:
+            state = self._regions.setdefault(region, {"runs": 0, "queries": {}})
+            # Forget subregions that are gone
+            state['queries'] = {slug: query for slug, query in state['queries'].items()
+                if slug in subregions}
+            skipped = [slug for slug in subregions if self._skippable(state, slug)]
+            queried = [slug for slug in subregions if slug not in skipped]
+            self.stats['planned'] += len(queried)
+            self.stats['skipped'] += len(skipped)
+            self.stats['requests_saved'] += sum(state['queries'][slug]['requests']
+                for slug in skipped)
+        if skipped:
+            print(f"Skipping {len(skipped)} of {len(subregions)} deal queries for {region}, "
+                "their deals are returned by the others")
+        return queried, skipped
+
+    def observe(self, region, results):
+        """
+        Learns which of the queries made were needed to find every deal.
+
+        Parameters
+        ----------
+        region : str
+            Region slug.
+        results : dict
+            Maps the slug of each subregion queried to the deals its query returned.
+            Queries that failed should be left out.
+
+        Returns
+        -------
+        redundant : list
+            Slugs of the queries whose deals were all returned by other queries.
+        """
+        found = {slug: {deal['id'] for deal in deals if isinstance(deal, dict) and 'id' in deal}
+            for slug, deals in results.items()}
+        cover = set(_cover(found))
+        with self._lock:
+            state = self._regions.setdefault(region, {"runs": 0, "queries": {}})
+            state['runs'] += 1
+            for slug, deals in results.items():
+                query = state['queries'].setdefault(slug, {"redundant": 0, "requests": 1})
+                query['requests'] = max(1, -(-len(deals) // self.page_size))
+                query['redundant'] = 0 if slug in cover else query['redundant'] + 1
+            text = json.dumps(self._regions)
+        if self.path is not None:
+            temp = self.path + ".tmp"
+            with open(temp, "w", encoding="utf8") as out_file:
+                out_file.write(text)
+            os.replace(temp, self.path)
+        return [slug for slug in results if slug not in cover]
+
+    def known(self, region):
+        """Slugs of the subregions of a region whose deal queries were observed."""
+        with self._lock:
+            return list(self._regions.get(region, {}).get('queries', {}))
+
+    def report(self):
+        """
+        Summarizes what was planned.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        report : dict
+            The stats, and 'skipping' mapping each region to the subregions its next run
+            would skip.
+        """
+        with self._lock:
+            skipping = {region: sorted(slug for slug in state['queries']
+                if self._skippable(state, slug)) for region, state in self._regions.items()}
+            return dict(self.stats, skipping={region: slugs for region, slugs in
+                skipping.items() if slugs})
@@ -0,0 +1,182 @@
+"""ratelimit.py contains the request pacing used for every REST call made by Snooper.
+    1. Objects
+        None
+    2. Classes
+        1. RateLimiter
+            Adaptive token bucket shared by every thread performing requests.
+    3. Functions
+        1. parse_retry_after
+            Converts a Retry-After header into a number of seconds.
+"""
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from time import monotonic, sleep
+
+
+def parse_retry_after(value):
+    """
+    Converts the value of a Retry-After header into seconds.
+
+    Parameters
+    ----------
+    value : str
+        Either a number of seconds or an HTTP date.
+
+    Returns
+    -------
+    seconds : float
+        Seconds to wait, or None if the header is missing or malformed.
+    """
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class RateLimiter:
+    """
+    A token bucket that adapts its rate to how the API is responding.
+
+    Healthy responses raise the rate additively up to max_rate, while throttling (429) and
+    server errors (5xx) halve it down to min_rate. A Retry-After header pauses every caller
+    for the requested time.
+
+    Attributes
+    ----------
+    rate : float
+        Current number of requests per second allowed.
+
+    burst : int
+        Number of requests that may be made back to back after an idle period.
+
+    min_rate : float
+        Lowest rate the limiter will slow down to.
+
+    max_rate : float
+        Highest rate the limiter will speed up to.
+
+    increase : float
+        Requests per second added after every healthy response.
+
+    decrease : float
+        Factor the rate is multiplied by after a throttled response.
+
+    Methods
+    -------
+    acquire()
+        Blocks until a request may be made.
+
+    feedback(status, retry_after=None)
+        Adjusts the rate using the status code and Retry-After header of a response.
+
+    report()
+        Returns a dict describing the limiter's current state.
+    """
+    slowdown_codes = (429, 500, 502, 503, 504)
+
+    def __init__(self, rate=1.0, burst=5, min_rate=0.05, max_rate=5.0, increase=0.05,
+        decrease=0.5):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.requests = 0
+        self.throttled = 0
+        self._tokens = float(burst)
+        self._updated = monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def current_rate(self):
+        """The number of requests per second currently allowed."""
+        return self.rate
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """
+        Blocks the calling thread until the bucket holds a token, then takes it.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        while True:
+            with self._lock:
+                now = monotonic()
+                self._refill(now)
+                wait = self._blocked_until - now
+                if wait <= 0:
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        self.requests += 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            sleep(wait)
+
+    def feedback(self, status, retry_after=None):
+        """
+        Speeds up after healthy responses and slows down after throttled ones.
+
+        Parameters
+        ----------
+        status : int
+            HTTP status code of the response.
+        retry_after : str
+            Value of the Retry-After header, if any.
+
+        Returns
+        -------
+        throttled : boolean
+            True if the response asked us to slow down.
+        """
+        with self._lock:
+            if status in self.slowdown_codes:
+                self.throttled += 1
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self._tokens = 0.0
+                pause = parse_retry_after(retry_after)
+                if pause is None:
+                    pause = 1 / self.rate
+                self._blocked_until = max(self._blocked_until, monotonic() + pause)
+                return True
+            if status < 400:
+                self.rate = min(self.max_rate, self.rate + self.increase)
+            return False
+
+    def report(self):
+        """
+        Describes the limiter's current state.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        report : dict
+        """
+        return {
+            "rate": round(self.rate, 3),
+            "requests": self.requests,
+            "throttled": self.throttled
+        }
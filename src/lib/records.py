@@ -0,0 +1,230 @@
+"""records.py contains compact record types for listings, menu items and deals.
+
+    A record keeps only the fields Snooper exports, in __slots__, instead of the full API
+    payload with its nested facets, images and descriptions. Strings that repeat across
+    records (category names, units, region slugs, ...) are interned so every record shares
+    one copy. Records are read-only mappings over the original shape of the data, so
+    record['slug'], record['price']['price'] and dict(record) keep working, and a few
+    bookkeeping keys such as a listing's menu can be assigned.
+
+    1. Objects
+        1. record_types
+            Maps 'listing', 'menu' and 'deal' to their record class.
+    2. Classes
+        1. Record
+            Base class of every compact record.
+        2. Listing
+        3. MenuItem
+        4. Deal
+    3. Functions
+        1. project
+            Projects an API dict into the record type of its kind.
+        2. lookup
+            Reads a dotted path out of a dict or record.
+"""
+import sys
+from collections.abc import Mapping
+
+
+def lookup(data, path):
+    """
+    Reads a dotted path such as 'price.price' out of a dict or record.
+
+    Parameters
+    ----------
+    data : dict or Record
+    path : str
+
+    Returns
+    -------
+    value
+        The value found, or None if any key along the path is missing.
+    """
+    if isinstance(data, Record):
+        return data.lookup(path)
+    for key in path.split("."):
+        if not isinstance(data, Mapping):
+            return None
+        data = data.get(key)
+    return data
+
+
+class Record(Mapping):
+    """
+    A compact, slotted projection of an API record.
+
+    Subclasses declare fields as (slot, dotted path, intern) tuples, and extras as the
+    names of assignable keys that are not read from the API record.
+
+    Attributes
+    ----------
+    raw : dict
+        The full API record when it was asked to be kept, otherwise None.
+
+    Methods
+    -------
+    lookup(path)
+        Returns the value of a projected dotted path, None if it is unset.
+    """
+    __slots__ = ("raw",)
+    fields = ()
+    extras = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._paths = {path: slot for slot, path, _ in cls.fields}
+        cls._paths.update({extra: extra for extra in cls.extras})
+        cls._nested = {}
+        for slot, path, _ in cls.fields:
+            if "." in path:
+                top, rest = path.split(".", 1)
+                cls._nested.setdefault(top, []).append((rest.split("."), slot))
+
+    def __init__(self, data, keep_raw=False):
+        for slot, path, interned in self.fields:
+            value = lookup(data, path)
+            if interned and isinstance(value, str):
+                value = sys.intern(value)
+            setattr(self, slot, value)
+        self.raw = data if keep_raw else None
+
+    def lookup(self, path):
+        slot = self._paths.get(path)
+        if slot is None:
+            return lookup(self.raw, path) if self.raw is not None else None
+        return getattr(self, slot, None)
+
+    def __getitem__(self, key):
+        slot = self._paths.get(key)
+        if slot is not None:
+            try:
+                return getattr(self, slot)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self.raw is not None:
+            return self.raw[key]
+        nested = self._nested.get(key)
+        if nested is None:
+            raise KeyError(key)
+        value = {}
+        for keys, slot in nested:
+            parent = value
+            for part in keys[:-1]:
+                parent = parent.setdefault(part, {})
+            parent[keys[-1]] = getattr(self, slot)
+        return value
+
+    def __setitem__(self, key, value):
+        slot = self._paths.get(key)
+        if slot is not None:
+            setattr(self, slot, value)
+        elif self.raw is not None:
+            self.raw[key] = value
+        else:
+            raise KeyError(f"{type(self).__name__} has no field {key!r}")
+
+    def __iter__(self):
+        keys = list(self.raw) if self.raw is not None else []
+        for path, slot in self._paths.items():
+            top = path.split(".", 1)[0]
+            if top not in keys and ("." in path or hasattr(self, slot)):
+                keys.append(top)
+        return iter(keys)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self)!r})"
+
+
+class Listing(Record):
+    """A dispensary listing, with room for its menu and incremental crawl fingerprint."""
+    fields = (
+        ("id", "id", False),
+        ("name", "name", False),
+        ("slug", "slug", False),
+        ("city", "city", True),
+        ("type", "type", True),
+        ("web_url", "web_url", False),
+        ("ranking", "ranking", False),
+        ("rating", "rating", False),
+        ("reviews_count", "reviews_count", False),
+        ("has_sale_items", "has_sale_items", False),
+        ("address", "address", False),
+        ("zip_code", "zip_code", True),
+        ("timezone", "timezone", True),
+        ("open_now", "open_now", False),
+        ("closes_in", "closes_in", False),
+        ("todays_hours_str", "todays_hours_str", True),
+        ("menu_items_count", "menu_items_count", False),
+        ("verified_menu_items_count", "verified_menu_items_count", False),
+        ("is_published", "is_published", False),
+        ("email", "email", False),
+        ("phone_number", "phone_number", False),
+        ("region", "region", True),
+        ("subregion", "subregion", True),
+        ("updated_at", "updated_at", False),
+        ("menu_updated_at", "menu_updated_at", False),
+    )
+    extras = ("menu", "menu_fingerprint")
+    __slots__ = tuple(slot for slot, _, _ in fields) + extras
+
+
+class MenuItem(Record):
+    """A menu item, with room for the slug of the listing it belongs to."""
+    fields = (
+        ("id", "id", False),
+        ("name", "name", False),
+        ("slug", "slug", False),
+        ("category_name", "category.name", True),
+        ("edge_category_name", "edge_category.name", True),
+        ("price_price", "price.price", False),
+        ("price_unit", "price.unit", True),
+        ("price_label", "price.label", True),
+        ("price_quantity", "price.quantity", False),
+        ("reviews_count", "reviews_count", False),
+        ("rating", "rating", False),
+        ("is_endorsed", "is_endorsed", False),
+        ("is_badged", "is_badged", False),
+        ("created_at", "created_at", False),
+    )
+    extras = ("listing",)
+    __slots__ = tuple(slot for slot, _, _ in fields) + extras
+
+
+class Deal(Record):
+    """A deal, keeping the slug, region and url of the listing it belongs to."""
+    fields = (
+        ("id", "id", False),
+        ("slug", "slug", False),
+        ("listing_slug", "listing.slug", True),
+        ("listing_region_slug", "listing.region.slug", True),
+        ("listing_web_url", "listing.web_url", False),
+        ("title", "title", False),
+        ("body", "body", False),
+    )
+    __slots__ = tuple(slot for slot, _, _ in fields)
+
+
+record_types = {"listing": Listing, "menu": MenuItem, "deal": Deal}
+
+
+def project(kind, data, keep_raw=False):
+    """
+    Projects an API record into its compact record type.
+
+    Parameters
+    ----------
+    kind : str
+        One of 'listing', 'menu' or 'deal'.
+    data : dict
+        The record returned by the API.
+    keep_raw : boolean
+        Keep the full API record on the compact record as well.
+
+    Returns
+    -------
+    record : Record
+    """
+    return record_types[kind](data, keep_raw)
@@ -0,0 +1,455 @@
+"""scheduler.py contains the staleness aware crawl scheduler.
+
+    Instead of crawling everything, the scheduler keeps a target for each region's
+    subregions, each subregion's listings, each listing's menu and each region's deals, and
+    remembers when every target was last fetched and how often its content changed. Given a
+    request budget per hour or day, it repeatedly fetches the target most likely to have
+    changed per request it will cost:
+        priority = (1 - exp(-change_rate * age)) / cost
+    change_rate starts at one change per url_library ttl of the target's endpoint and is then
+    learned from how often fetches actually found changes, so deals are refreshed more often
+    than subregions and busy listings more often than quiet ones. Targets are fetched with
+    the actors, so data_lib and the controller's sinks see the same updates as a full crawl.
+    The state lives in SQLite, so a scheduler picks up where the last one stopped.
+
+    1. Objects
+        1. endpoints
+            Per endpoint settings: the url_library entry its prior change rate comes from,
+            the shortest interval between two fetches, and its rank among unfetched targets.
+    2. Classes
+        1. Scheduler
+            Spends a request budget on the stalest, most volatile targets.
+    3. Functions
+        1. fingerprint
+            Hashes the stable content of a target.
+"""
+import hashlib
+import json
+import math
+import sqlite3
+import threading
+import time
+from lib import common
+from lib.history import content_hash
+
+endpoints = {
+    "subregions": {"url": "subregions", "min_interval": 24 * 60 * 60, "rank": 0},
+    "listings": {"url": "dispensaries", "min_interval": 60 * 60, "rank": 1},
+    "deals": {"url": "deals", "min_interval": 10 * 60, "rank": 2},
+    "menu": {"url": "menu", "min_interval": 30 * 60, "rank": 3},
+}
+
+_target_columns = ("endpoint", "region", "subregion", "listing", "first_fetched",
+    "last_fetched", "fetches", "changes", "failures", "fingerprint", "cost")
+
+
+def fingerprint(kind, records):
+    """
+    Hashes the stable content of a target, ignoring record order.
+
+    Parameters
+    ----------
+    kind : str
+        'listing', 'menu' or 'deal', as used by history.content_hash, or 'subregion'.
+    records : iterable
+        The records the target holds.
+
+    Returns
+    -------
+    fingerprint : str
+    """
+    if kind == "subregion":
+        hashes = [json.dumps([record.get('slug'), record.get('id'), record.get('name')])
+            for record in records]
+    else:
+        hashes = [content_hash(kind, record) for record in records]
+    return hashlib.sha256("\n".join(sorted(hashes)).encode()).hexdigest()
+
+
+def _requests():
+    return sum(stats['requests'] for stats in common.metrics.report()['endpoints'].values())
+
+
+class Scheduler:
+    """
+    Fetches the targets most likely to be stale within a request budget.
+
+    Attributes
+    ----------
+    controller : Object/Snooper
+        The app whose data_lib and actors targets are fetched with.
+
+    path : str
+        SQLite file holding the targets and the requests spent.
+
+    budget : int
+        Requests that may be made per period.
+
+    period : float
+        Length in seconds of the sliding window the budget applies to, e.g. 3600 or 86400.
+
+    Methods
+    -------
+    add(regions)
+        Starts tracking the subregions and deals of regions.
+
+    remaining(now=None)
+        Requests left in the current window.
+
+    plan(now=None, limit=None)
+        The targets that are due, best first, without fetching anything.
+
+    step(now=None)
+        Fetches the best affordable target.
+
+    run(duration=None, targets=None)
+        Keeps fetching until duration seconds passed or targets were fetched.
+
+    report()
+        Counts of tracked targets, fetches, changes and requests spent.
+
+    close()
+        Closes the database.
+    """
+    def __init__(self, controller, path, budget=1000, period=60 * 60, clock=time.time,
+        sleep=time.sleep):
+        self.controller = controller
+        self.path = path
+        self.budget = budget
+        self.period = period
+        self.clock = clock
+        self.sleep = sleep
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        # Targets fetched by this scheduler, so missing data is only refetched once
+        self._attempted = set()
+        with self._lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS targets (
+                endpoint TEXT NOT NULL,
+                region TEXT NOT NULL,
+                subregion TEXT NOT NULL DEFAULT '',
+                listing TEXT NOT NULL DEFAULT '',
+                first_fetched REAL,
+                last_fetched REAL,
+                fetches INTEGER NOT NULL DEFAULT 0,
+                changes INTEGER NOT NULL DEFAULT 0,
+                failures INTEGER NOT NULL DEFAULT 0,
+                fingerprint TEXT,
+                cost REAL,
+                PRIMARY KEY (endpoint, region, subregion, listing))""")
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS spent (
+                at REAL NOT NULL,
+                requests INTEGER NOT NULL)""")
+
+    def _add(self, targets):
+        with self._lock, self.connection:
+            self.connection.executemany("INSERT OR IGNORE INTO targets (endpoint, region, "
+                "subregion, listing) VALUES (?, ?, ?, ?)", targets)
+
+    def _forget(self, endpoint, region, subregion, keep):
+        # Targets whose subregion or listing disappeared from the API
+        column = "listing" if endpoint == "menu" else "subregion"
+        where = "endpoint = ? AND region = ?" + (" AND subregion = ?" if subregion else "")
+        params = (endpoint, region) + ((subregion,) if subregion else ())
+        with self._lock, self.connection:
+            stale = [row[0] for row in self.connection.execute(
+                f"SELECT {column} FROM targets WHERE {where}", params) if row[0] not in keep]
+            self.connection.executemany(f"DELETE FROM targets WHERE {where} AND {column} = ?",
+                [params + (name,) for name in stale])
+
+    def add(self, regions):
+        """
+        Starts tracking regions. Their listings and menus are tracked as they are found.
+
+        Parameters
+        ----------
+        regions : iterable
+            Region slugs.
+
+        Returns
+        -------
+        None
+        """
+        self._add([("subregions", region, "", "") for region in regions])
+
+    def remaining(self, now=None):
+        """
+        Requests that can still be made in the window ending now.
+
+        Parameters
+        ----------
+        now : float
+            Epoch seconds, defaults to the clock.
+
+        Returns
+        -------
+        remaining : int
+        """
+        now = self.clock() if now is None else now
+        with self._lock:
+            spent = self.connection.execute("SELECT COALESCE(SUM(requests), 0) FROM spent "
+                "WHERE at > ?", (now - self.period,)).fetchone()[0]
+        return self.budget - spent
+
+    def _freed_at(self, needed, now):
+        # When enough of the window's spending expires for needed more requests
+        with self._lock:
+            rows = self.connection.execute("SELECT at, requests FROM spent WHERE at > ? "
+                "ORDER BY at", (now - self.period,)).fetchall()
+        left = self.budget - sum(requests for _, requests in rows)
+        if left >= needed:
+            return now
+        for at, requests in rows:
+            left += requests
+            if left >= needed:
+                return at + self.period
+        return None
+
+    def _data(self, target):
+        # (ready, present): whether the data the target is fetched from is in data_lib, and
+        # whether the data it fetches is
+        endpoint, region, subregion, listing = target
+        data_lib = self.controller.data_lib
+        if endpoint == "subregions":
+            return True, region in data_lib
+        subregions = data_lib.get(region, {})
+        if endpoint == "deals":
+            return bool(subregions), bool(subregions) and all('deals' in subregions[slug]
+                for slug in subregions)
+        scope = subregions.get(subregion)
+        if endpoint == "listings":
+            return scope is not None, scope is not None and 'listings' in scope
+        found = (scope or {}).get('listings', {})
+        entry = found.get(listing) if isinstance(found, dict) else None
+        return entry is not None, entry is not None and 'menu' in entry
+
+    def _estimate(self, target, cost):
+        # Requests a fetch is expected to cost: what it cost last time, otherwise its pages
+        if cost:
+            return max(1, math.ceil(cost))
+        endpoint, region, subregion, listing = target
+        subregions = self.controller.data_lib.get(region, {})
+        if endpoint == "deals":
+            return max(1, len(subregions))
+        if endpoint == "menu":
+            entry = subregions[subregion]['listings'][listing]
+            return max(1, -(-(entry.get('menu_items_count') or 0) // common.page_size))
+        return 1
+
+    def plan(self, now=None, limit=None):
+        """
+        Ranks the targets that are due.
+
+        Targets never fetched, or whose data is not in data_lib (such as after a restart),
+        come first, parents before children. The others are due once their endpoint's
+        min_interval passed, and are ranked by the chance they changed since they were last
+        fetched per request.
+
+        Parameters
+        ----------
+        now : float
+            Epoch seconds, defaults to the clock.
+        limit : int
+            Return at most this many targets.
+
+        Returns
+        -------
+        plan : list
+            Dicts of the target's endpoint, region, subregion and listing, its estimated
+            cost, change_rate (changes per hour) and priority, best first.
+        """
+        now = self.clock() if now is None else now
+        with self._lock:
+            rows = self.connection.execute(
+                f"SELECT {', '.join(_target_columns)} FROM targets").fetchall()
+        ranked = []
+        for row in rows:
+            row = dict(zip(_target_columns, row))
+            target = (row['endpoint'], row['region'], row['subregion'], row['listing'])
+            ready, present = self._data(target)
+            if not ready:
+                continue
+            settings = endpoints[row['endpoint']]
+            prior = common.url_library[settings['url']]['ttl']
+            # One change per ttl, worth one observation, until fetches say otherwise
+            observed = (row['last_fetched'] or 0) - (row['first_fetched'] or 0)
+            rate = (row['changes'] + 1) / (observed + prior)
+            cost = self._estimate(target, row['cost'])
+            if row['last_fetched'] is None or not present and target not in self._attempted:
+                key = (0, settings['rank'], 0.0)
+                priority = math.inf
+            elif now - row['last_fetched'] < settings['min_interval']:
+                continue
+            else:
+                priority = -math.expm1(-rate * (now - row['last_fetched'])) / cost
+                key = (1, 0, -priority)
+            ranked.append((key, target, {"endpoint": target[0], "region": target[1],
+                "subregion": target[2], "listing": target[3], "cost": cost,
+                "change_rate": rate * 3600, "priority": priority}))
+        ranked.sort(key=lambda entry: entry[:2])
+        return [entry[2] for entry in ranked[:limit]]
+
+    def _fetch(self, target):
+        endpoint, region, subregion, listing = target
+        controller = self.controller
+        if endpoint == "subregions":
+            controller.Regions.get_subregions(region)
+            subregions = controller.data_lib[region]
+            found = [{k: v for k, v in subregions[slug].items() if k not in ("listings", "deals")}
+                for slug in subregions]
+            self._add([("listings", region, slug, "") for slug in subregions] +
+                [("deals", region, "", "")])
+            self._forget("listings", region, "", set(subregions))
+            return fingerprint("subregion", found)
+        if endpoint == "listings":
+            scope = controller.data_lib[region][subregion]
+            # Incremental keeps the menus already downloaded for listings that are still there
+            controller.SubRegions.get_listings(scope, incremental=True)
+            listings = controller.data_lib[region][subregion]['listings']
+            self._add([("menu", region, subregion, slug) for slug in listings])
+            self._forget("menu", region, subregion, set(listings))
+            return fingerprint("listing", listings.values())
+        if endpoint == "menu":
+            entry = controller.data_lib[region][subregion]['listings'][listing]
+            controller.SubRegions.Dispensaries.get_menu(entry)
+            return fingerprint("menu", entry['menu'].values())
+        subregions = controller.data_lib[region]
+        controller.Regions.fetch_deals(region)
+        return fingerprint("deal", [deal for slug in subregions
+            for deal in subregions[slug]['deals'].values()])
+
+    def _record(self, target, now, requests, digest=None):
+        with self._lock, self.connection:
+            if requests:
+                self.connection.execute("DELETE FROM spent WHERE at <= ?", (now - self.period,))
+                self.connection.execute("INSERT INTO spent (at, requests) VALUES (?, ?)",
+                    (now, requests))
+            previous, cost = self.connection.execute("SELECT fingerprint, cost "
+                "FROM targets WHERE endpoint = ? AND region = ? AND subregion = ? "
+                "AND listing = ?", target).fetchone()
+            changed = digest is not None and previous is not None and digest != previous
+            # Cached responses cost nothing, so keep the last estimate of a real fetch
+            if requests:
+                cost = requests if cost is None else 0.5 * cost + 0.5 * requests
+            # Failed fetches only count as attempts, so a failing target backs off too
+            self.connection.execute("UPDATE targets SET first_fetched = COALESCE(first_fetched, "
+                "?), last_fetched = ?, fetches = fetches + ?, changes = changes + ?, "
+                "failures = failures + ?, fingerprint = COALESCE(?, fingerprint), cost = ? "
+                "WHERE endpoint = ? AND region = ? AND subregion = ? AND listing = ?",
+                (now if digest is not None else None, now, int(digest is not None),
+                int(changed), int(digest is None), digest, cost) + target)
+        self._attempted.add(target)
+        return changed
+
+    def step(self, now=None):
+        """
+        Fetches the best due target that the remaining budget can pay for.
+
+        Parameters
+        ----------
+        now : float
+            Epoch seconds, defaults to the clock.
+
+        Returns
+        -------
+        result : dict
+            The planned target plus requests (actually made) and changed, or None when
+            nothing is due or affordable.
+        """
+        now = self.clock() if now is None else now
+        remaining = self.remaining(now)
+        for planned in self.plan(now):
+            # A target costing more than the whole budget runs once the window is empty
+            if planned['cost'] > remaining and remaining < self.budget:
+                continue
+            target = (planned['endpoint'], planned['region'], planned['subregion'],
+                planned['listing'])
+            before = _requests()
+            try:
+                digest = self._fetch(target)
+            except (common.RequestError, KeyError, TypeError) as error:
+                print(f"Scheduled {planned['endpoint']} fetch of "
+                    f"{planned['listing'] or planned['subregion'] or planned['region']} "
+                    f"failed: {error!r}")
+                digest = None
+            planned['requests'] = _requests() - before
+            planned['changed'] = self._record(target, now, planned['requests'], digest)
+            planned['failed'] = digest is None
+            return planned
+        return None
+
+    def _next_wake(self, now):
+        # When the best target becomes affordable, or when the next target becomes due
+        planned = self.plan(now)
+        if planned:
+            freed = self._freed_at(min(min(target['cost'] for target in planned),
+                self.budget), now)
+            return freed if freed is not None and freed > now else now + 60
+        with self._lock:
+            rows = self.connection.execute("SELECT endpoint, region, subregion, listing, "
+                "last_fetched FROM targets WHERE last_fetched IS NOT NULL").fetchall()
+        due = [last_fetched + endpoints[row[0]]['min_interval'] for *row, last_fetched in rows
+            if self._data(tuple(row))[0]]
+        return min((at for at in due if at > now), default=now + 60)
+
+    def run(self, duration=None, targets=None):
+        """
+        Fetches targets continuously, sleeping while nothing is due or the budget is spent.
+
+        Parameters
+        ----------
+        duration : float
+            Seconds to run for, None to run until targets were fetched or forever.
+        targets : int
+            Stop after fetching this many targets.
+
+        Returns
+        -------
+        summary : dict
+            Number of targets fetched, changed and failed, and requests made.
+        """
+        start = self.clock()
+        summary = {"fetched": 0, "changed": 0, "failed": 0, "requests": 0}
+        while (duration is None or self.clock() - start < duration) and \
+            (targets is None or summary['fetched'] < targets):
+            result = self.step()
+            if result is None:
+                now = self.clock()
+                wake = self._next_wake(now)
+                if duration is not None:
+                    wake = min(wake, start + duration)
+                self.sleep(max(wake - now, 0))
+                continue
+            summary['fetched'] += 1
+            summary['changed'] += int(result['changed'])
+            summary['failed'] += int(result['failed'])
+            summary['requests'] += result['requests']
+        print(f"Scheduler: {summary}, {self.remaining()} of {self.budget} requests left")
+        return summary
+
+    def report(self):
+        """
+        Summarizes the tracked targets.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        report : dict
+            Per endpoint, the number of targets, fetches, changes and failures; and the
+            requests spent in the current window.
+        """
+        with self._lock:
+            rows = self.connection.execute("SELECT endpoint, COUNT(*), SUM(fetches), "
+                "SUM(changes), SUM(failures) FROM targets GROUP BY endpoint").fetchall()
+        report = {endpoint: {"targets": count, "fetches": fetches, "changes": changes,
+            "failures": failures} for endpoint, count, fetches, changes, failures in rows}
+        report['spent'] = self.budget - self.remaining()
+        return report
+
+    def close(self):
+        """Closes the database."""
+        self.connection.close()
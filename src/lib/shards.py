@@ -0,0 +1,224 @@
+"""shards.py contains the sharded on-disk layout for data_lib.
+
+    Each subregion is stored in its own shard, <directory>/<region>/<subregion>.json, and a
+    small manifest.json lists every shard. Loading a sharded store only reads the manifest;
+    a shard is parsed the first time its subregion is accessed.
+
+    1. Objects
+        1. manifest_name
+            File name of the manifest in a shard directory.
+    2. Classes
+        1. ShardedRegion
+            A lazy mapping of subregion slug to subregion dict for one region.
+        2. ShardedLibrary
+            A lazy mapping of region slug to ShardedRegion, usable as Snooper.data_lib.
+    3. Functions
+        1. save_shards
+            Writes data_lib as shards plus a manifest.
+        2. load_shards
+            Opens a shard directory lazily, or loads every shard in parallel.
+        3. read_shard
+            Reads a single shard file.
+"""
+import json
+import os
+import threading
+from collections.abc import MutableMapping
+from concurrent.futures import ProcessPoolExecutor
+
+manifest_name = "manifest.json"
+
+
+def read_shard(path):
+    """
+    Reads one shard, without going through (or being kept by) a ShardedLibrary.
+
+    Parameters
+    ----------
+    path : str
+        The shard file.
+
+    Returns
+    -------
+    subregion : dict
+    """
+    with open(path, encoding="utf8") as in_file:
+        return json.load(in_file)
+
+
+def _write_atomic(path, data):
+    temp = path + ".tmp"
+    with open(temp, "w", encoding="utf8") as out_file:
+        json.dump(data, out_file, default=dict)
+    os.replace(temp, path)
+
+
+def _read_manifest(directory):
+    try:
+        return read_shard(os.path.join(directory, manifest_name))
+    except FileNotFoundError:
+        return {"regions": {}}
+
+
+class ShardedRegion(MutableMapping):
+    """
+    Maps subregion slugs to subregion dicts, reading each shard on first access.
+
+    Attributes
+    ----------
+    directory : str
+        The shard directory the region was opened from.
+
+    region : str
+        Slug of the region.
+
+    Methods
+    -------
+    is_loaded(subregion)
+        True if the subregion is held in memory.
+
+    file(subregion)
+        Path of the subregion's shard relative to directory.
+    """
+    def __init__(self, directory, region, files):
+        self.directory = directory
+        self.region = region
+        self._files = dict(files)
+        self._loaded = {}
+        self._lock = threading.Lock()
+
+    def is_loaded(self, subregion):
+        return subregion in self._loaded
+
+    def file(self, subregion):
+        return self._files[subregion]
+
+    def __getitem__(self, subregion):
+        try:
+            return self._loaded[subregion]
+        except KeyError:
+            pass
+        path = os.path.join(self.directory, self._files[subregion])
+        with self._lock:
+            if subregion not in self._loaded:
+                self._loaded[subregion] = read_shard(path)
+        return self._loaded[subregion]
+
+    def __setitem__(self, subregion, data):
+        self._loaded[subregion] = data
+
+    def __delitem__(self, subregion):
+        if subregion not in self._loaded and subregion not in self._files:
+            raise KeyError(subregion)
+        self._loaded.pop(subregion, None)
+        self._files.pop(subregion, None)
+
+    def __iter__(self):
+        yield from self._files
+        yield from (subregion for subregion in list(self._loaded) if subregion not in self._files)
+
+    def __len__(self):
+        return len(self._files.keys() | self._loaded.keys())
+
+    def __repr__(self):
+        return f"ShardedRegion({self.region!r}, {len(self._loaded)}/{len(self)} loaded)"
+
+
+class ShardedLibrary(MutableMapping):
+    """
+    Maps region slugs to lazily loaded regions. Only the manifest is read when it is created.
+
+    Attributes
+    ----------
+    directory : str
+        The shard directory the library was opened from.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self._regions = {region: ShardedRegion(directory, region, files)
+            for region, files in _read_manifest(directory)["regions"].items()}
+
+    def __getitem__(self, region):
+        return self._regions[region]
+
+    def __setitem__(self, region, data):
+        self._regions[region] = data
+
+    def __delitem__(self, region):
+        del self._regions[region]
+
+    def __iter__(self):
+        return iter(self._regions)
+
+    def __len__(self):
+        return len(self._regions)
+
+    def __repr__(self):
+        return f"ShardedLibrary({self.directory!r}, {len(self)} regions)"
+
+
+def save_shards(data_lib, directory):
+    """
+    Writes data_lib as one shard per subregion plus a manifest. Shards of a ShardedLibrary
+    opened from the same directory that were never loaded are left untouched.
+
+    Parameters
+    ----------
+    data_lib : dict or ShardedLibrary
+        The data to save.
+    directory : str
+        The shard directory to write.
+
+    Returns
+    -------
+    written : int
+        Number of shards written.
+    """
+    directory = os.path.abspath(directory)
+    manifest = {"regions": {}}
+    written = 0
+    for region, subregions in data_lib.items():
+        os.makedirs(os.path.join(directory, region), exist_ok=True)
+        files = manifest["regions"][region] = {}
+        unchanged = isinstance(subregions, ShardedRegion) and \
+            os.path.abspath(subregions.directory) == directory
+        for subregion in subregions:
+            if unchanged and not subregions.is_loaded(subregion):
+                files[subregion] = subregions.file(subregion)
+                continue
+            files[subregion] = f"{region}/{subregion}.json"
+            _write_atomic(os.path.join(directory, files[subregion]), subregions[subregion])
+            written += 1
+    _write_atomic(os.path.join(directory, manifest_name), manifest)
+    return written
+
+
+def load_shards(directory, lazy=True, workers=None):
+    """
+    Opens a shard directory.
+
+    Parameters
+    ----------
+    directory : str
+        The shard directory to read.
+    lazy : boolean
+        Return a ShardedLibrary that reads shards on first access. When False every shard is
+        parsed up front on a process pool and a plain dict is returned.
+    workers : int
+        Number of processes used when lazy is False, defaults to the number of CPUs.
+
+    Returns
+    -------
+    data_lib : ShardedLibrary or dict
+    """
+    if lazy:
+        return ShardedLibrary(directory)
+    manifest = _read_manifest(directory)
+    keys = [(region, subregion, os.path.join(directory, path))
+        for region, files in manifest["regions"].items() for subregion, path in files.items()]
+    data_lib = {region: {} for region in manifest["regions"]}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        shards = pool.map(read_shard, [path for _, _, path in keys], chunksize=8)
+        for (region, subregion, _), data in zip(keys, shards):
+            data_lib[region][subregion] = data
+    return data_lib
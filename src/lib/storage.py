@@ -0,0 +1,294 @@
+"""storage.py contains the SQLite storage backend for data downloaded by the actors.
+    1. Objects
+        1. schema
+            The columns of every table: (sql column, dotted path in the API record, sql type).
+            Each table also keeps the full record as JSON in its data column.
+        2. primary_keys
+            The primary key of every table.
+        3. indexes
+            The secondary indexes created for every table.
+        4. frame_columns
+            The SnooperToPandas column names each table is selected as.
+    2. Classes
+        1. SQLiteStore
+            A Snooper sink that upserts everything it is notified about into SQLite.
+    3. Functions
+        None
+"""
+import json
+import sqlite3
+import threading
+from lib.records import lookup
+
+schema = {
+    "regions": [
+        ("slug", None, "TEXT PRIMARY KEY"),
+    ],
+    "subregions": [
+        ("region", None, "TEXT NOT NULL"),
+        ("slug", "slug", "TEXT NOT NULL"),
+        ("id", "id", "INTEGER"),
+        ("name", "name", "TEXT"),
+    ],
+    "listings": [
+        ("region", None, "TEXT NOT NULL"),
+        ("subregion", None, "TEXT NOT NULL"),
+        ("slug", "slug", "TEXT NOT NULL"),
+        ("id", "id", "INTEGER"),
+        ("name", "name", "TEXT"),
+        ("city", "city", "TEXT"),
+        ("type", "type", "TEXT"),
+        ("web_url", "web_url", "TEXT"),
+        ("ranking", "ranking", "REAL"),
+        ("rating", "rating", "REAL"),
+        ("reviews_count", "reviews_count", "INTEGER"),
+        ("has_sale_items", "has_sale_items", "INTEGER"),
+        ("address", "address", "TEXT"),
+        ("zip_code", "zip_code", "TEXT"),
+        ("timezone", "timezone", "TEXT"),
+        ("open_now", "open_now", "INTEGER"),
+        ("closes_in", "closes_in", "REAL"),
+        ("todays_hours_str", "todays_hours_str", "TEXT"),
+        ("menu_items_count", "menu_items_count", "INTEGER"),
+        ("verified_menu_items_count", "verified_menu_items_count", "INTEGER"),
+        ("is_published", "is_published", "INTEGER"),
+        ("email", "email", "TEXT"),
+        ("phone_number", "phone_number", "TEXT"),
+    ],
+    "menu_items": [
+        ("region", None, "TEXT NOT NULL"),
+        ("subregion", None, "TEXT NOT NULL"),
+        ("listing", None, "TEXT NOT NULL"),
+        ("slug", "slug", "TEXT NOT NULL"),
+        ("id", "id", "INTEGER"),
+        ("name", "name", "TEXT"),
+        ("category_name", "category.name", "TEXT"),
+        ("edge_category_name", "edge_category.name", "TEXT"),
+        ("price_price", "price.price", "REAL"),
+        ("price_unit", "price.unit", "TEXT"),
+        ("price_label", "price.label", "TEXT"),
+        ("price_quantity", "price.quantity", "REAL"),
+        ("reviews_count", "reviews_count", "INTEGER"),
+        ("rating", "rating", "REAL"),
+        ("is_endorsed", "is_endorsed", "INTEGER"),
+        ("is_badged", "is_badged", "INTEGER"),
+        ("created_at", "created_at", "TEXT"),
+    ],
+    "deals": [
+        ("region", None, "TEXT NOT NULL"),
+        ("subregion", None, "TEXT NOT NULL"),
+        ("slug", "slug", "TEXT NOT NULL"),
+        ("id", "id", "INTEGER"),
+        ("listing_slug", "listing.slug", "TEXT"),
+        ("listing_region_slug", "listing.region.slug", "TEXT"),
+        ("listing_web_url", "listing.web_url", "TEXT"),
+        ("title", "title", "TEXT"),
+        ("body", "body", "TEXT"),
+    ],
+}
+
+primary_keys = {
+    "regions": ("slug",),
+    "subregions": ("region", "slug"),
+    "listings": ("region", "subregion", "slug"),
+    "menu_items": ("listing", "slug"),
+    "deals": ("region", "subregion", "slug"),
+}
+
+indexes = {
+    "subregions": [("id",)],
+    "listings": [("slug",), ("id",)],
+    "menu_items": [("id",), ("region", "subregion", "listing"), ("category_name",),
+        ("edge_category_name",), ("price_price",)],
+    "deals": [("id",), ("listing_slug",)],
+}
+
+# Columns SnooperToPandas frames expect from each table, in the order it uses
+frame_columns = {
+    "listings": ["id", "name", "slug", "city", "type", "web_url", "ranking", "rating",
+        "reviews_count", "has_sale_items", "address", "zip_code", "timezone", "open_now",
+        "closes_in", "todays_hours_str", "menu_items_count", "verified_menu_items_count",
+        "is_published", "email", "phone_number", "region", "subregion"],
+    "menu_items": ["id", "name", "slug", "category.name", "edge_category.name", "price.price",
+        "price.unit", "price.label", "price.quantity", "reviews_count", "rating", "is_endorsed",
+        "is_badged", "created_at", "listing"],
+    "deals": ["id", "listing.slug", "listing.region.slug", "listing.web_url", "title", "body"],
+}
+
+
+class SQLiteStore:
+    """
+    Stores regions, subregions, listings, menu items and deals in normalized SQLite tables.
+
+    The store is a Snooper sink: append it to Snooper.sinks and each page the actors
+    download is upserted with a single executemany. Refreshing a subregion's listings or
+    deals, or a listing's menu, replaces the previous rows for it.
+
+    Attributes
+    ----------
+    path : str
+        The SQLite database file.
+
+    connection : sqlite3.Connection
+        Connection usable with Pandas.read_sql.
+
+    Methods
+    -------
+    on_subregions(region, subregions)
+    on_listings(region, subregion, listings)
+    on_menu(region, subregion, listing, items)
+    on_deals(region, subregion, deals)
+        Snooper sink hooks, each one bulk upserting its rows.
+
+    query(table, **filters)
+        Builds the SQL selecting a table with the column names SnooperToPandas uses.
+
+    load_data_lib(region=None)
+        Rebuilds data_lib from the stored records.
+
+    close()
+        Closes the database.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            for table, columns in schema.items():
+                definition = [f"{column} {kind}" for column, _, kind in columns]
+                if table != "regions":
+                    definition.append("data TEXT NOT NULL")
+                    definition.append(f"PRIMARY KEY ({', '.join(primary_keys[table])})")
+                self.connection.execute(
+                    f"CREATE TABLE IF NOT EXISTS {table} ({', '.join(definition)})")
+            for table, table_indexes in indexes.items():
+                for index in table_indexes:
+                    self.connection.execute(f"CREATE INDEX IF NOT EXISTS "
+                        f"{table}_{'_'.join(index)} ON {table} ({', '.join(index)})")
+
+    def _rows(self, table, records, keys):
+        rows = []
+        for record in records:
+            row = list(keys)
+            for _, path, _ in schema[table][len(keys):]:
+                value = lookup(record, path)
+                row.append(json.dumps(value) if isinstance(value, (dict, list)) else value)
+            row.append(json.dumps(record, default=dict))
+            rows.append(row)
+        return rows
+
+    def _replace(self, table, where, params, rows):
+        columns = [column for column, _, _ in schema[table]] + ["data"]
+        with self._lock, self.connection:
+            if where:
+                self.connection.execute(f"DELETE FROM {table} WHERE {where}", params)
+            self.connection.executemany(f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) "
+                f"VALUES ({', '.join('?' * len(columns))})", rows)
+
+    def on_subregions(self, region, subregions):
+        with self._lock, self.connection:
+            self.connection.execute("INSERT OR IGNORE INTO regions (slug) VALUES (?)", (region,))
+        subregions = [{k: v for k, v in subregion.items() if k not in ("listings", "deals")}
+            for subregion in subregions]
+        self._replace("subregions", None, (), self._rows("subregions", subregions, (region,)))
+
+    def on_listings(self, region, subregion, listings):
+        listings = [{k: v for k, v in listing.items() if k != "menu"} for listing in listings]
+        self._replace("listings", "region = ? AND subregion = ?", (region, subregion),
+            self._rows("listings", listings, (region, subregion)))
+
+    def on_menu(self, region, subregion, listing, items):
+        self._replace("menu_items", "listing = ?", (listing,),
+            self._rows("menu_items", items, (region, subregion, listing)))
+
+    def on_deals(self, region, subregion, deals):
+        self._replace("deals", "region = ? AND subregion = ?", (region, subregion),
+            self._rows("deals", deals, (region, subregion)))
+
+    def query(self, table, **filters):
+        """
+        Builds the SQL selecting rows of a table, named like the SnooperToPandas columns.
+
+        Parameters
+        ----------
+        table : str
+            One of 'listings', 'menu_items' or 'deals'.
+        **filters
+            Column equality filters, e.g. region='oklahoma', listing='some-slug' or
+            category_name='Flower'. Indexed columns are used by SQLite to avoid scans.
+
+        Returns
+        -------
+        sql : str
+        params : list
+        """
+        names = {path: column for column, path, _ in schema[table] if path}
+        select = [f'{names.get(path, path)} AS "{path}"' for path in frame_columns[table]]
+        where = " AND ".join(f"{column} = ?" for column in filters) or "1"
+        order = {"listings": "region, subregion, slug", "menu_items": "listing, slug",
+            "deals": "region, subregion, slug"}[table]
+        sql = f"SELECT {', '.join(select)} FROM {table} WHERE {where} ORDER BY {order}"
+        return sql, list(filters.values())
+
+    def select(self, sql, params=()):
+        """
+        Runs a read query against the store.
+
+        Parameters
+        ----------
+        sql : str
+        params : sequence
+
+        Returns
+        -------
+        rows : list
+        """
+        with self._lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    def load_data_lib(self, region=None):
+        """
+        Rebuilds the nested data_lib structure from the stored records.
+
+        Listings, menus or deals stored for a subregion with no subregion record (their
+        sink ran and the subregions one did not) are kept under a stub {'slug': subregion}.
+
+        Parameters
+        ----------
+        region : str
+            Only load this region, None for every region.
+
+        Returns
+        -------
+        data_lib : dict
+        """
+        where, params = ("WHERE region = ?", (region,)) if region else ("", ())
+        data_lib = {}
+
+        def subregion_of(row_region, subregion):
+            return data_lib.setdefault(row_region, {}).setdefault(subregion, {"slug": subregion})
+
+        for row_region, data in self.select(f"SELECT region, data FROM subregions {where} "
+            "ORDER BY region, slug", params):
+            data = json.loads(data)
+            data_lib.setdefault(row_region, {})[data['slug']] = data
+        for row_region, subregion, slug, data in self.select("SELECT region, subregion, slug, "
+            f"data FROM listings {where} ORDER BY region, subregion, slug", params):
+            listings = subregion_of(row_region, subregion).setdefault("listings", {})
+            listings[slug] = json.loads(data)
+        for row_region, subregion, listing, data in self.select("SELECT region, subregion, "
+            f"listing, data FROM menu_items {where} ORDER BY listing, slug", params):
+            listing = subregion_of(row_region, subregion).get("listings", {}).get(listing)
+            if listing is not None:
+                item = json.loads(data)
+                listing.setdefault("menu", {})[item['slug']] = item
+        for row_region, subregion, data in self.select("SELECT region, subregion, data FROM "
+            f"deals {where} ORDER BY region, subregion, slug", params):
+            deal = json.loads(data)
+            subregion_of(row_region, subregion).setdefault("deals", {})[deal['slug']] = deal
+        return data_lib
+
+    def close(self):
+        """Closes the database."""
+        self.connection.close()
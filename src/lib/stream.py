@@ -0,0 +1,156 @@
+"""stream.py contains the streaming NDJSON record format used to persist crawls as they run.
+
+    Every line of a stream is one JSON record:
+        {"type": "subregion", "region": ..., "subregion": ..., "data": {...}}
+        {"type": "listing", "region": ..., "subregion": ..., "listing": ..., "data": {...}}
+        {"type": "menu_item", "region": ..., "subregion": ..., "listing": ..., "data": {...}}
+        {"type": "deal", "region": ..., "subregion": ..., "data": {...}}
+    Listings are written without their menu and subregions without their listings or deals,
+    since those are written as records of their own.
+
+    1. Objects
+        1. record_types
+            The types of record a stream may contain.
+    2. Classes
+        1. RecordWriter
+            A Snooper sink that appends records to a stream while the crawl runs.
+    3. Functions
+        1. read_records
+            Lazily reads the records of a stream, optionally filtered.
+        2. build_data_lib
+            Rebuilds a data_lib dict from records.
+"""
+import json
+import threading
+
+record_types = ("subregion", "listing", "menu_item", "deal")
+
+
+class RecordWriter:
+    """
+    Appends crawl results to an NDJSON stream as the actors download them.
+
+    Attributes
+    ----------
+    path : str
+        File the records are written to.
+
+    written : int
+        Number of records written so far.
+
+    Methods
+    -------
+    on_subregions(region, subregions)
+    on_listings(region, subregion, listings)
+    on_menu(region, subregion, listing, items)
+    on_deals(region, subregion, deals)
+        Snooper sink hooks, each writing one record per item.
+
+    close()
+        Closes the stream.
+    """
+    def __init__(self, path, append=False):
+        self.path = path
+        self.written = 0
+        self._lock = threading.Lock()
+        self._file = open(path, "a" if append else "w", encoding="utf8")
+
+    def _write(self, records):
+        # default=dict serializes compact records.Record values
+        lines = [json.dumps(record, default=dict) + "\n" for record in records]
+        with self._lock:
+            self._file.writelines(lines)
+            self._file.flush()
+            self.written += len(lines)
+
+    def on_subregions(self, region, subregions):
+        self._write({"type": "subregion", "region": region, "subregion": subregion['slug'],
+            "data": {k: v for k, v in subregion.items() if k not in ("listings", "deals")}}
+            for subregion in subregions)
+
+    def on_listings(self, region, subregion, listings):
+        self._write({"type": "listing", "region": region, "subregion": subregion,
+            "listing": listing['slug'], "data": {k: v for k, v in listing.items() if k != "menu"}}
+            for listing in listings)
+
+    def on_menu(self, region, subregion, listing, items):
+        self._write({"type": "menu_item", "region": region, "subregion": subregion,
+            "listing": listing, "data": item} for item in items)
+
+    def on_deals(self, region, subregion, deals):
+        self._write({"type": "deal", "region": region, "subregion": subregion, "data": deal}
+            for deal in deals)
+
+    def close(self):
+        """Closes the stream."""
+        self._file.close()
+
+
+def read_records(path, types=None, region=None, subregion=None):
+    """
+    Lazily reads records from a stream, one line at a time.
+
+    Parameters
+    ----------
+    path : str
+        The NDJSON stream to read.
+    types : iterable
+        Record types to keep, None for every type.
+    region : str
+        Only keep records from this region.
+    subregion : str
+        Only keep records from this subregion.
+
+    Returns
+    -------
+    records : generator
+        Yields each matching record as a dict.
+    """
+    types = set(types) if types is not None else None
+    with open(path, encoding="utf8") as in_file:
+        for line in in_file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if types is not None and record['type'] not in types:
+                continue
+            if region is not None and record['region'] != region:
+                continue
+            if subregion is not None and record['subregion'] != subregion:
+                continue
+            yield record
+
+
+def build_data_lib(records):
+    """
+    Rebuilds the nested data_lib structure from records. Later records replace earlier ones.
+
+    Parameters
+    ----------
+    records : iterable
+        Records as yielded by read_records.
+
+    Returns
+    -------
+    data_lib : dict
+    """
+    data_lib = {}
+    for record in records:
+        subregions = data_lib.setdefault(record['region'], {})
+        subregion = subregions.setdefault(record['subregion'],
+            {"slug": record['subregion'], "region": record['region']})
+        if record['type'] == "subregion":
+            subregion.update(record['data'])
+        elif record['type'] == "listing":
+            listings = subregion.setdefault("listings", {})
+            menu = listings.get(record['listing'], {}).get("menu")
+            listings[record['listing']] = record['data']
+            if menu is not None:
+                record['data']['menu'] = menu
+        elif record['type'] == "menu_item":
+            listing = subregion.setdefault("listings", {}).setdefault(record['listing'],
+                {"slug": record['listing']})
+            listing.setdefault("menu", {})[record['data']['slug']] = record['data']
+        elif record['type'] == "deal":
+            subregion.setdefault("deals", {})[record['data']['slug']] = record['data']
+    return data_lib
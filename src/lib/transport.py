@@ -0,0 +1,101 @@
+"""transport.py contains the HTTP layer used by common.get_request.
+    1. Objects
+        None
+    2. Classes
+        1. TransportError
+            Raised when a request could not be completed at the network level.
+        2. HTTPTransport
+            A pooled keep-alive session used to perform GET requests.
+    3. Functions
+        1. backoff_delay
+            Computes a jittered exponential delay between retries.
+
+    Any object with a get(url, headers) method returning a response exposing status_code,
+    headers, content and json() can stand in for HTTPTransport, which is how tests replace
+    the network with a local transport. requests is only imported once an HTTPTransport is
+    created, so importing this module stays cheap.
+"""
+import random
+
+
+class TransportError(Exception):
+    """Raised when a GET request fails before a response is received."""
+
+
+def backoff_delay(attempt, base=0.5, cap=30.0):
+    """
+    Computes a "full jitter" exponential backoff delay.
+
+    Parameters
+    ----------
+    attempt : int
+        Number of attempts already made, starting at 0.
+    base : float
+        Delay in seconds of the first retry before jitter.
+    cap : float
+        Longest delay allowed in seconds.
+
+    Returns
+    -------
+    delay : float
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class HTTPTransport:
+    """
+    A persistent requests.Session with connection pooling and compression.
+
+    Attributes
+    ----------
+    session : requests.Session
+        The session whose connections are kept alive between calls.
+
+    timeout : tuple
+        (connect, read) timeouts in seconds.
+
+    Methods
+    -------
+    get(url, headers=None)
+        Performs a single GET request and returns the response.
+
+    close()
+        Closes every pooled connection.
+    """
+    def __init__(self, pool_size=10, timeout=(5, 30)):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util import make_headers
+        self.timeout = timeout
+        self._errors = requests.RequestException
+        self.session = requests.Session()
+        # pool_maxsize is the number of kept-alive connections per host
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # Advertise every encoding urllib3 can decode here (br only with brotli installed)
+        self.session.headers.update(make_headers(accept_encoding=True))
+
+    def get(self, url, headers=None):
+        """
+        Performs a GET request over the pooled session.
+
+        Parameters
+        ----------
+        url : str
+            The url to request.
+        headers : dict
+            Extra headers sent with the request.
+
+        Returns
+        -------
+        response : requests.Response
+        """
+        try:
+            return self.session.get(url, headers=headers, timeout=self.timeout)
+        except self._errors as error:
+            raise TransportError(f"GET {url} failed: {error}") from error
+
+    def close(self):
+        """Closes every pooled connection."""
+        self.session.close()
@@ -1,13 +1,96 @@
 """util.py contains classes needed for various jobs
     1. Objects
-        None
+        1. default_chunk_rows
+            Rows per Dataframe yielded by iter_frames unless told otherwise.
     2. Classes
         1. SnooperToPandas
             Used for properly loading data into a Pandas Dataframe from data_lib.
     3. Functions
-        None
+        1. column_getter
+            Returns a function reading a dotted column path out of a record.
+        2. build_frame
+            Builds a Dataframe from only the requested columns of many records.
+        3. listings_frame, menus_frame, deals_frame
+            Build the frames of one subregion dict without any controller state.
+        4. subregion_frames
+            Builds every frame of one subregion dict.
+        5. source_digest
+            Hashes the data a table of one subregion dict is built from.
+        6. build_frames
+            Builds the frames of many subregions on a process pool.
+        7. selected_subregions
+            Yields the selected subregions of data_lib one at a time.
+        8. iter_frames
+            Yields the frame of a table across many subregions in bounded chunks.
 """
+import os
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
+from lib import export
+from lib import manifest
+from lib import records
+from lib import shards
+from lib import stream
+
+_record_classes = frozenset(records.record_types.values())
+
+default_chunk_rows = 100000
+
+def column_getter(path):
+    """
+    Returns a function reading a dotted column path, such as 'price.price', out of a dict or
+    records.Record. Missing keys read as NaN, like they do in Pandas.json_normalize.
+
+    Parameters
+    ----------
+    path : str
+        A column name as used in SnooperToPandas column lists.
+
+    Returns
+    -------
+    getter : function
+    """
+    keys = path.split(".")
+    nan = float("nan")
+    def get(row):
+        if row.__class__ in _record_classes:
+            return row.lookup(path)
+        try:
+            for key in keys:
+                row = row[key]
+        except (KeyError, TypeError, IndexError):
+            return nan
+        return row
+    return get
+
+def build_frame(rows, columns, overrides=None):
+    """
+    Builds a Dataframe holding only the requested columns of rows. Each column is read
+    straight out of the nested records into its own list, so nothing else is flattened and
+    the records are never modified.
+
+    Parameters
+    ----------
+    rows : list
+        Dicts or records.Record objects.
+    columns : list
+        Dotted column paths, in output order.
+    overrides : dict
+        Columns whose values are given directly as lists rather than read from rows.
+
+    Returns
+    -------
+    frame : Pandas.Dataframe
+    """
+    overrides = overrides or {}
+    data = {}
+    for column in columns:
+        if column in overrides:
+            data[column] = overrides[column]
+        else:
+            get = column_getter(column)
+            data[column] = [get(row) for row in rows]
+    return pd.DataFrame(data, columns=columns)
 
 class SnooperToPandas:
     """
@@ -30,25 +113,44 @@ class SnooperToPandas:
     __init__()
         Creates a controller object for communicating with the parent Snooper app.
 
-    subregion_deals()
-        Uses the selected subregion in Snooper to extract the deals from the Snooper data_lib,
+    subregion_deals(subregion=None)
+        Uses the given or selected subregion in Snooper to extract the deals from the Snooper data_lib,
         and generates a Pandas Dataframe using that data, and returns it.
 
-    region_deals()
-        Uses the selected region in Snooper to extract the deals from the Snooper data_lib for each
+    region_deals(region=None)
+        Uses the given or selected region in Snooper to extract the deals from the Snooper data_lib for each
         subregion under the region, and returns a generated Pandas Dataframe using that data.
 
-    listing_menu()
-        Uses the selected menu in Snooper to generate a Pandas Dataframe for each menu item, then
+    listing_menu(menu=None)
+        Uses the given or selected menu in Snooper to generate a Pandas Dataframe for each menu item, then
         returns it.
 
-    subregion_menus()
-        Uses the selected subregion to iterate over each Dispensary listing in that subregion.
+    subregion_menus(subregion=None)
+        Uses the given or selected subregion to iterate over each Dispensary listing in that subregion.
         During this loop it generates a Pandas Dataframe for each listings menu, and returns it.
 
-    listings()
-        Uses the selected subregion to iterate over each listing in the subregion, and return
+    listings(subregion=None)
+        Uses the given or selected subregion to iterate over each listing in the subregion, and return
         a Pandas Dataframe.
+
+    stream_listings(path, region=None, subregion=None)
+    stream_menus(path, region=None, subregion=None)
+    stream_deals(path, region=None, subregion=None)
+        Build the same Dataframes straight from an NDJSON record stream, reading only the
+        records of the requested region / subregion instead of loading data_lib.
+
+    sql_listings(store, **filters)
+    sql_menus(store, **filters)
+    sql_deals(store, **filters)
+        Build the same Dataframes with read_sql from a storage.SQLiteStore.
+
+    catalog_listings(catalog, **query)
+    catalog_menus(catalog, **query)
+    catalog_deals(catalog, **query)
+        Build the same Dataframes from the results of a catalog.Catalog query.
+
+    batch(regions=None, subregions=None, workers=None, root=None, crawl_date=None)
+        Builds the frames of many subregions at once on a process pool.
     """
     menu_columns = [
         'id',
@@ -106,136 +208,707 @@ class SnooperToPandas:
     def __init__(self, controller):
         self.controller = controller
 
-    def subregion_deals(self):
+    def subregion_deals(self, subregion=None):
         """
-        Loads every deal in a selected subregion.
+        Loads every deal in a subregion.
 
         Parameters
         ----------
-        None
+        subregion : dict
+            The subregion to load, defaults to the selected subregion.
 
         Returns
         -------
         deals_frame : Pandas.Dataframe
         """
-        data = []
-        subregion = self.controller.selected_subregion
-        deals = self.controller.data_lib[subregion['region']][subregion['slug']]['deals']
-        processed = 0
-        for deal in deals:
-            deal = deals[deal]
-            data.append(deal)
-            processed+=1
-        print(f"Deals Processed: {processed}")
+        subregion = subregion or self.controller.selected_subregion
+        subregion = self.controller.data_lib[subregion['region']][subregion['slug']]
+        print(f"Deals Processed: {len(subregion.get('deals', {}))}")
         print("Generating DataFrame ...")
-        deals_frame = pd.json_normalize(data)[self.deal_columns]
-        return deals_frame
+        return deals_frame(subregion, self.deal_columns)
 
-    def region_deals(self):
+    def region_deals(self, region=None):
         """
-        Loads every deal in a selected region.
+        Loads every deal in a region.
 
         Parameters
         ----------
-        None
+        region : dict
+            The subregions of the region to load, defaults to the selected region.
 
         Returns
         -------
         deals_frame : Pandas.Dataframe
         """
+        region = region or self.controller.selected_region
         data = []
-        region = self.controller.selected_region
         total = 0
         for subregion in region:
             subregion = region[subregion]
             deals = self.controller.data_lib[subregion['region']][subregion['slug']]['deals']
-            processed = 0
-            for deal in deals:
-                deal = deals[deal]
-                data.append(deal)
-                processed+=1
-                total+=1
-            print(f"Deals Processed for {subregion['slug']}: {processed}")
+            data.extend(deals[deal] for deal in sorted(deals))
+            total+=len(deals)
+            print(f"Deals Processed for {subregion['slug']}: {len(deals)}")
         print(f"Total deals processed: {total}")
-        deals_frame = pd.json_normalize(data)[self.deal_columns]
+        deals_frame = build_frame(data, self.deal_columns)
         return deals_frame
 
-    def listing_menu(self):
+    def listing_menu(self, menu=None):
         """
-        Loads every menu item in a selected listing.
+        Loads every menu item in a listing's menu.
 
         Parameters
         ----------
-        None
+        menu : dict
+            The menu to load, defaults to the selected menu.
 
         Returns
         -------
         menu_frame : Pandas.Dataframe
         """
-        data = []
-
-        menu = self.controller.selected_menu
-        processed = 0
-        for item in menu:
-            item = menu[item]
-            data.append(item)
-            processed+=1
-        print(f"Items Processed: {processed}")
+        menu = menu if menu is not None else self.controller.selected_menu
+        data = list(menu.values())
+        print(f"Items Processed: {len(data)}")
         print("Generating DataFrame ...")
-        menu_frame = pd.json_normalize(data)[self.menu_columns]
+        menu_frame = build_frame(data, self.menu_columns)
         return menu_frame
 
-    def subregion_menus(self):
+    def subregion_menus(self, subregion=None):
         """
-        Loads every menu item from every listing in a selected subregion.
+        Loads every menu item from every listing in a subregion.
 
         Parameters
         ----------
-        None
+        subregion : dict
+            The subregion to load, defaults to the selected subregion.
 
         Returns
         -------
         menu_frame : Pandas.Dataframe
         """
-        data = []
-        total = 0
-        subregion = self.controller.selected_subregion
-        for listing in subregion['listings']:
-            listing = subregion['listings'][listing]
-
-            menu = listing['menu']
-            processed = 0
-            for item in menu:
-                item = menu[item]
-                item['listing'] = listing['slug']
-                data.append(item)
-                processed+=1
-                total+=1
-            print(f"Items Processed for {listing['slug']}: {processed}")
-        print(f"Total: {total}")
-        menu_frame = pd.json_normalize(data)[self.menu_columns]
+        subregion = subregion or self.controller.selected_subregion
+        for listing in subregion['listings'].values():
+            print(f"Items Processed for {listing['slug']}: {len(listing.get('menu', {}))}")
+        menu_frame = menus_frame(subregion, self.menu_columns)
+        print(f"Total: {len(menu_frame)}")
         return menu_frame
 
-    def listings(self):
+    def listings(self, subregion=None):
         """
-        Loads every listing from a selected subregion.
+        Loads every listing from a subregion.
 
         Parameters
         ----------
-        None
+        subregion : dict
+            The subregion to load, defaults to the selected subregion.
 
         Returns
         -------
         listing_frame : Pandas.Dataframe
         """
-        data = []
-        subregion = self.controller.selected_subregion['listings']
-        processed = 0
-        for listing in subregion:
-            listing = subregion[listing]
-            data.append(listing)
-            processed+=1
-        print(f"Listings Processed: {processed}")
+        subregion = subregion or self.controller.selected_subregion
+        print(f"Listings Processed: {len(subregion['listings'])}")
         print("Generating DataFrame ...")
-        listing_frame = pd.json_normalize(data)[self.listing_columns]
-        return listing_frame
+        return listings_frame(subregion, self.listing_columns)
+
+    def batch(self, regions=None, subregions=None, workers=None, root=None, crawl_date=None,
+        export_manifest=None):
+        """
+        Builds the listings, menus and deals frames of many subregions on a process pool.
+        See build_frames.
+
+        Parameters
+        ----------
+        regions : iterable
+            Region slugs to build, None for every region in data_lib.
+        subregions : iterable
+            Subregion slugs to build, None for every subregion of those regions.
+        workers : int
+            Number of processes, defaults to the number of CPUs.
+        root : str
+            Write each subregion's frames as Parquet partitions under root instead of
+            returning them.
+        crawl_date : str
+            ISO date of the partitions written under root.
+        export_manifest : manifest.ExportManifest
+            Skip the partitions under root whose source data did not change.
+
+        Returns
+        -------
+        frames : dict
+            Table name to concatenated Dataframe, or to the list of partition files.
+        """
+        return build_frames(self.controller.data_lib, regions, subregions, workers, root,
+            crawl_date, export_manifest)
+
+    def stream_listings(self, path, region=None, subregion=None):
+        """
+        Loads every listing record of a region / subregion from an NDJSON stream.
+
+        Parameters
+        ----------
+        path : str
+            The record stream to read.
+        region : str
+            Region slug to keep, None for every region.
+        subregion : str
+            Subregion slug to keep, None for every subregion.
+
+        Returns
+        -------
+        listing_frame : Pandas.Dataframe
+        """
+        found = stream.read_records(path, ["listing"], region, subregion)
+        data = [record['data'] for record in found]
+        print(f"Listings Processed: {len(data)}")
+        return build_frame(data, self.listing_columns)
+
+    def stream_menus(self, path, region=None, subregion=None):
+        """
+        Loads every menu item record of a region / subregion from an NDJSON stream.
+
+        Parameters
+        ----------
+        path : str
+            The record stream to read.
+        region : str
+            Region slug to keep, None for every region.
+        subregion : str
+            Subregion slug to keep, None for every subregion.
+
+        Returns
+        -------
+        menu_frame : Pandas.Dataframe
+        """
+        data = []
+        listing_slugs = []
+        for record in stream.read_records(path, ["menu_item"], region, subregion):
+            data.append(record['data'])
+            listing_slugs.append(record['listing'])
+        print(f"Total: {len(data)}")
+        return build_frame(data, self.menu_columns, {"listing": listing_slugs})
+
+    def stream_deals(self, path, region=None, subregion=None):
+        """
+        Loads every deal record of a region / subregion from an NDJSON stream.
+
+        Parameters
+        ----------
+        path : str
+            The record stream to read.
+        region : str
+            Region slug to keep, None for every region.
+        subregion : str
+            Subregion slug to keep, None for every subregion.
+
+        Returns
+        -------
+        deals_frame : Pandas.Dataframe
+        """
+        found = stream.read_records(path, ["deal"], region, subregion)
+        data = [record['data'] for record in found]
+        print(f"Total deals processed: {len(data)}")
+        return build_frame(data, self.deal_columns)
+
+    def sql_listings(self, store, **filters):
+        """
+        Loads listings from an SQLite store.
+
+        Parameters
+        ----------
+        store : storage.SQLiteStore
+            The store to read from.
+        **filters
+            Column equality filters passed to store.query, e.g. region or subregion.
+
+        Returns
+        -------
+        listing_frame : Pandas.Dataframe
+        """
+        sql, params = store.query("listings", **filters)
+        return pd.read_sql(sql, store.connection, params=params)
+
+    def sql_menus(self, store, **filters):
+        """
+        Loads menu items from an SQLite store.
+
+        Parameters
+        ----------
+        store : storage.SQLiteStore
+            The store to read from.
+        **filters
+            Column equality filters passed to store.query, e.g. subregion, listing or
+            category_name.
+
+        Returns
+        -------
+        menu_frame : Pandas.Dataframe
+        """
+        sql, params = store.query("menu_items", **filters)
+        return pd.read_sql(sql, store.connection, params=params)
+
+    def sql_deals(self, store, **filters):
+        """
+        Loads deals from an SQLite store.
+
+        Parameters
+        ----------
+        store : storage.SQLiteStore
+            The store to read from.
+        **filters
+            Column equality filters passed to store.query, e.g. region or subregion.
+
+        Returns
+        -------
+        deals_frame : Pandas.Dataframe
+        """
+        sql, params = store.query("deals", **filters)
+        return pd.read_sql(sql, store.connection, params=params)
+
+
+    def catalog_listings(self, catalog, **query):
+        """
+        Loads the listings a catalog query finds.
+
+        Parameters
+        ----------
+        catalog : catalog.Catalog
+            The catalog to query.
+        **query
+            Arguments of Catalog.listings, e.g. region or subregion.
+
+        Returns
+        -------
+        listing_frame : Pandas.Dataframe
+        """
+        return build_frame(catalog.listings(**query), self.listing_columns)
+
+    def catalog_menus(self, catalog, **query):
+        """
+        Loads the menu items a catalog query finds.
+
+        Parameters
+        ----------
+        catalog : catalog.Catalog
+            The catalog to query.
+        **query
+            Arguments of Catalog.items, e.g. region, category, max_price or order.
+
+        Returns
+        -------
+        menu_frame : Pandas.Dataframe
+        """
+        items = catalog.items(**query)
+        return build_frame([item for _, item in items], self.menu_columns,
+            {"listing": [listing for listing, _ in items]})
+
+    def catalog_deals(self, catalog, **query):
+        """
+        Loads the deals a catalog query finds.
+
+        Parameters
+        ----------
+        catalog : catalog.Catalog
+            The catalog to query.
+        **query
+            Arguments of Catalog.deals, e.g. region, subregion or listing.
+
+        Returns
+        -------
+        deals_frame : Pandas.Dataframe
+        """
+        return build_frame(catalog.deals(**query), self.deal_columns)
+
+    def iter_listings(self, regions=None, subregions=None, chunk_rows=default_chunk_rows,
+        chunk_bytes=None):
+        """
+        Yields the listings of any number of regions / subregions in bounded chunks. See
+        iter_frames.
+
+        Parameters
+        ----------
+        regions : iterable
+            Region slugs, None for every region in data_lib.
+        subregions : iterable
+            Subregion slugs, None for every subregion of those regions.
+        chunk_rows : int
+            Most rows per chunk.
+        chunk_bytes : int
+            Approximate most bytes of memory per chunk.
+
+        Yields
+        ------
+        listing_frame : Pandas.Dataframe
+        """
+        yield from iter_frames(self.controller.data_lib, "listings", regions, subregions,
+            chunk_rows, chunk_bytes, self.listing_columns)
+
+    def iter_menus(self, regions=None, subregions=None, chunk_rows=default_chunk_rows,
+        chunk_bytes=None):
+        """
+        Yields the menu items of any number of regions / subregions in bounded chunks,
+        with the region and subregion of every item. See iter_frames.
+
+        Parameters
+        ----------
+        regions : iterable
+            Region slugs, None for every region in data_lib.
+        subregions : iterable
+            Subregion slugs, None for every subregion of those regions.
+        chunk_rows : int
+            Most rows per chunk.
+        chunk_bytes : int
+            Approximate most bytes of memory per chunk.
+
+        Yields
+        ------
+        menu_frame : Pandas.Dataframe
+        """
+        yield from iter_frames(self.controller.data_lib, "menus", regions, subregions,
+            chunk_rows, chunk_bytes, self.menu_columns)
+
+    def iter_deals(self, regions=None, subregions=None, chunk_rows=default_chunk_rows,
+        chunk_bytes=None):
+        """
+        Yields the deals of any number of regions / subregions in bounded chunks, with the
+        region and subregion every deal is filed under. See iter_frames.
+
+        Parameters
+        ----------
+        regions : iterable
+            Region slugs, None for every region in data_lib.
+        subregions : iterable
+            Subregion slugs, None for every subregion of those regions.
+        chunk_rows : int
+            Most rows per chunk.
+        chunk_bytes : int
+            Approximate most bytes of memory per chunk.
+
+        Yields
+        ------
+        deals_frame : Pandas.Dataframe
+        """
+        yield from iter_frames(self.controller.data_lib, "deals", regions, subregions,
+            chunk_rows, chunk_bytes, self.deal_columns)
+
+
+def listings_frame(subregion, columns=None):
+    """
+    Builds the listings frame of a subregion dict.
+
+    Parameters
+    ----------
+    subregion : dict
+        A subregion as stored in data_lib.
+    columns : list
+        Columns to build, defaults to SnooperToPandas.listing_columns.
+
+    Returns
+    -------
+    listing_frame : Pandas.Dataframe
+    """
+    columns = columns or SnooperToPandas.listing_columns
+    return build_frame(list(subregion.get('listings', {}).values()), columns)
+
+def menus_frame(subregion, columns=None):
+    """
+    Builds the frame of every menu item of every listing in a subregion dict.
+
+    Parameters
+    ----------
+    subregion : dict
+        A subregion as stored in data_lib.
+    columns : list
+        Columns to build, defaults to SnooperToPandas.menu_columns.
+
+    Returns
+    -------
+    menu_frame : Pandas.Dataframe
+    """
+    columns = columns or SnooperToPandas.menu_columns
+    data = []
+    listing_slugs = []
+    for listing in subregion.get('listings', {}).values():
+        menu = listing.get('menu', {})
+        data.extend(menu.values())
+        listing_slugs.extend([listing['slug']] * len(menu))
+    return build_frame(data, columns, {"listing": listing_slugs})
+
+def deals_frame(subregion, columns=None):
+    """
+    Builds the deals frame of a subregion dict, sorted by deal slug.
+
+    Parameters
+    ----------
+    subregion : dict
+        A subregion as stored in data_lib.
+    columns : list
+        Columns to build, defaults to SnooperToPandas.deal_columns.
+
+    Returns
+    -------
+    deals_frame : Pandas.Dataframe
+    """
+    columns = columns or SnooperToPandas.deal_columns
+    deals = subregion.get('deals', {})
+    # Deals are stored in download order; output them sorted by slug
+    return build_frame([deals[deal] for deal in sorted(deals)], columns)
+
+frame_builders = {"listings": listings_frame, "menus": menus_frame, "deals": deals_frame}
+
+def subregion_frames(subregion):
+    """
+    Builds the listings, menus and deals frames of a subregion dict.
+
+    Parameters
+    ----------
+    subregion : dict
+        A subregion as stored in data_lib.
+
+    Returns
+    -------
+    frames : dict
+        Table name ('listings', 'menus' or 'deals') to Dataframe.
+    """
+    return {table: build(subregion) for table, build in frame_builders.items()}
+
+# The menu a listing carries is the menus table's source, not the listings table's
+_menu_keys = frozenset(("menu", "menu_fingerprint"))
+
+_frame_sources = {
+    "listings": lambda subregion: [{key: value for key, value in listing.items()
+        if key not in _menu_keys} for listing in subregion.get('listings', {}).values()],
+    "menus": lambda subregion: [[listing['slug'], listing.get('menu', {})]
+        for listing in subregion.get('listings', {}).values()],
+    "deals": lambda subregion: subregion.get('deals', {}),
+}
+
+def source_digest(table, subregion):
+    """
+    Hashes the data the frame of a table is built from, so an export can tell whether the
+    frame would come out differently than last time.
+
+    Parameters
+    ----------
+    table : str
+        'listings', 'menus' or 'deals'.
+    subregion : dict
+        A subregion as stored in data_lib.
+
+    Returns
+    -------
+    digest : str
+    """
+    return manifest.digest(_frame_sources[table](subregion))
+
+def _frame_task(task):
+    region, slug, subregion, root, crawl_date, previous = task
+    if isinstance(subregion, str):
+        # An unloaded shard is read by the worker rather than shipped from the parent
+        subregion = shards.read_shard(subregion)
+    if root is None:
+        return subregion_frames(subregion)
+    written = {}
+    for table, build in frame_builders.items():
+        path = export.partition_file(root, table, region, slug, crawl_date)
+        source = source_digest(table, subregion) if previous is not None else None
+        if previous is not None and manifest.is_current(previous.get(path), source, path):
+            written[table] = (path, source, False)
+            continue
+        export.write_partition(build(subregion), root, table, region, slug, crawl_date)
+        written[table] = (path, source, True)
+    return written
+
+def build_frames(data_lib, regions=None, subregions=None, workers=None, root=None,
+    crawl_date=None, export_manifest=None):
+    """
+    Builds the listings, menus and deals frames of many subregions on a process pool, one
+    task per subregion. Unloaded subregions of a shards.ShardedLibrary are read by the
+    worker that builds them. With an export_manifest, partitions whose source data did not
+    change since they were recorded are neither built nor rewritten.
+
+    Parameters
+    ----------
+    data_lib : dict or shards.ShardedLibrary
+        The data to build frames from.
+    regions : iterable
+        Region slugs to build, None for every region in data_lib.
+    subregions : iterable
+        Subregion slugs to build, None for every subregion of those regions.
+    workers : int
+        Number of processes, defaults to the number of CPUs.
+    root : str
+        When given, each worker writes its subregion's frames as export partitions under
+        root and only the paths are sent back.
+    crawl_date : str
+        ISO date of the partitions written under root, defaults to today.
+    export_manifest : manifest.ExportManifest
+        Manifest recording the partitions under root. It is updated but not saved.
+
+    Returns
+    -------
+    frames : dict
+        Table name to the Dataframe of every subregion concatenated in region / subregion
+        order, or to the list of partition files when root is given.
+    """
+    subregions = set(subregions) if subregions is not None else None
+    tasks = []
+    for region in (regions if regions is not None else list(data_lib)):
+        region_lib = data_lib[region]
+        for slug in region_lib:
+            if subregions is not None and slug not in subregions:
+                continue
+            if isinstance(region_lib, shards.ShardedRegion) and not region_lib.is_loaded(slug):
+                subregion = os.path.join(region_lib.directory, region_lib.file(slug))
+            else:
+                subregion = region_lib[slug]
+            previous = None
+            if root is not None and export_manifest is not None:
+                # Only the entries of the subregion's own partitions are sent to the worker
+                previous = {}
+                for table in frame_builders:
+                    path = export.partition_file(root, table, region, slug, crawl_date)
+                    previous[path] = export_manifest.entry(path)
+            tasks.append((region, slug, subregion, root, crawl_date, previous))
+    results = {table: [] for table in frame_builders}
+    if tasks:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for frames in pool.map(_frame_task, tasks):
+                for table, value in frames.items():
+                    if root is None:
+                        results[table].append(value)
+                        continue
+                    path, source, written = value
+                    results[table].append(path)
+                    if export_manifest is not None:
+                        export_manifest.record(path, source, written)
+    if root is not None:
+        return results
+    concatenated = {}
+    for table, frames in results.items():
+        # Empty frames carry no dtypes worth keeping and only confuse concat
+        frames = [frame for frame in frames if len(frame)]
+        concatenated[table] = pd.concat(frames, ignore_index=True) if frames else \
+            frame_builders[table]({})
+    return concatenated
+
+def selected_subregions(data_lib, regions=None, subregions=None):
+    """
+    Yields every selected subregion of data_lib. Unloaded subregions of a
+    shards.ShardedLibrary are read from their shard without being kept by the library, so
+    only one of them is held in memory at a time.
+
+    Parameters
+    ----------
+    data_lib : dict or shards.ShardedLibrary
+        The data to read.
+    regions : iterable
+        Region slugs, None for every region in data_lib.
+    subregions : iterable
+        Subregion slugs, None for every subregion of those regions.
+
+    Yields
+    ------
+    region : str
+    slug : str
+    subregion : dict
+    """
+    subregions = set(subregions) if subregions is not None else None
+    for region in (regions if regions is not None else list(data_lib)):
+        region_lib = data_lib[region]
+        for slug in region_lib:
+            if subregions is not None and slug not in subregions:
+                continue
+            if isinstance(region_lib, shards.ShardedRegion) and not region_lib.is_loaded(slug):
+                yield region, slug, shards.read_shard(os.path.join(region_lib.directory,
+                    region_lib.file(slug)))
+            else:
+                yield region, slug, region_lib[slug]
+
+
+def _table_rows(table, subregion):
+    # (record, listing slug) in the order the table's frame holds them
+    if table == "listings":
+        for listing in subregion.get('listings', {}).values():
+            yield listing, None
+    elif table == "menus":
+        for listing in subregion.get('listings', {}).values():
+            for item in listing.get('menu', {}).values():
+                yield item, listing['slug']
+    else:
+        deals = subregion.get('deals', {})
+        for deal in sorted(deals):
+            yield deals[deal], None
+
+
+_probe_rows = 1000
+
+
+_default_columns = {"listings": SnooperToPandas.listing_columns,
+    "menus": SnooperToPandas.menu_columns, "deals": SnooperToPandas.deal_columns}
+
+
+def _chunk(table, columns, rows, scopes):
+    regions, subregions, listings = zip(*scopes) if scopes else ((), (), ())
+    overrides = {"region": list(regions), "subregion": list(subregions)}
+    if table == "menus":
+        overrides["listing"] = list(listings)
+    return build_frame(rows, columns, overrides)
+
+
+def iter_frames(data_lib, table, regions=None, subregions=None, chunk_rows=default_chunk_rows,
+    chunk_bytes=None, columns=None):
+    """
+    Yields the frame of a table across any number of regions / subregions as Dataframes
+    of bounded size, so a nationwide table never has to fit in memory at once. Rows come
+    in region / subregion order, the same order build_frames concatenates them in, and
+    every chunk has region and subregion columns. At least one, possibly empty, chunk is
+    yielded.
+
+    Parameters
+    ----------
+    data_lib : dict or shards.ShardedLibrary
+        The data to build frames from.
+    table : str
+        'listings', 'menus' or 'deals'.
+    regions : iterable
+        Region slugs, None for every region in data_lib.
+    subregions : iterable
+        Subregion slugs, None for every subregion of those regions.
+    chunk_rows : int
+        Most rows per chunk, None for no limit.
+    chunk_bytes : int
+        Approximate most bytes of memory per chunk, None for no limit. The rows that fit
+        are estimated from the memory per row of the previous chunk; the first chunk holds
+        at most 1000 rows to measure it.
+    columns : list
+        Columns to build, defaults to the table's SnooperToPandas columns.
+
+    Yields
+    ------
+    frame : Pandas.Dataframe
+    """
+    columns = list(columns or _default_columns[table])
+    columns += [key for key in ("region", "subregion") if key not in columns]
+    limit = chunk_rows
+    if chunk_bytes is not None:
+        limit = min(chunk_rows or _probe_rows, _probe_rows)
+    rows, scopes = [], []
+    yielded = False
+    for region, slug, subregion in selected_subregions(data_lib, regions, subregions):
+        for row, listing in _table_rows(table, subregion):
+            rows.append(row)
+            scopes.append((region, slug, listing))
+            if limit is None or len(rows) < limit:
+                continue
+            frame = _chunk(table, columns, rows, scopes)
+            rows, scopes = [], []
+            if chunk_bytes is not None:
+                per_row = frame.memory_usage(deep=True).sum() / len(frame)
+                limit = max(1, int(chunk_bytes // per_row))
+                if chunk_rows is not None:
+                    limit = min(limit, chunk_rows)
+            yielded = True
+            yield frame
+    if rows or not yielded:
+        yield _chunk(table, columns, rows, scopes)
@@ -1,26 +1,77 @@
 """Snooper is a data processor created for the purpose of downloading JSON data from supported
     WeedMaps APIs to be converted into Pandas DataFrames and stored in multiple different formats.
+
+    Importing snooper does no filesystem or terminal work, and pandas, requests and the lib
+    modules behind each command (the job queue, storage, history, ...) are only imported
+    once something needs them, so short command line runs start quickly:
+        python snooper.py crawl [region ...] [--workers N] [--rate RPS] [--cache | --offline]
+        python snooper.py resume
+        python snooper.py distribute [region ...] [--workers N] [--host H] [--port P]
+        python snooper.py worker URL [--name NAME]
+        python snooper.py export [--format csv|parquet] [--region R] [--subregion S]
+            [--chunk-rows N] [--chunk-bytes N]
+        python snooper.py list regions
+        python snooper.py list subregions REGION [--fetch]
+        python snooper.py list deals REGION [SUBREGION] [--fetch]
+        python snooper.py schedule [region ...] [--budget N] [--period hour|day]
+    Without a command, Snooper.main() runs.
+
     1. Objects
         1. data_dir
-            os.path data directory used for saving / exporting data from snooper.
+            os.path data directory used for saving / exporting data from snooper. Created
+            when something is first written to it.
         2. save_file
             the primary save file for snooper to export to.
         3. export_file
             an optional test export file for snooper to export to.
+        4. cache_dir
+            directory holding the on-disk HTTP response cache.
+        5. stream_file
+            NDJSON record stream written while main() crawls.
+        6. parquet_dir
+            root of the partitioned Parquet dataset written by main().
+        7. sqlite_file
+            SQLite database written by main() when Snooper.sqlite is set.
+        8. shard_dir
+            directory of per-subregion shards written by save_shards.
+        9. metrics_file
+            Prometheus textfile of the request metrics written at the end of main().
+        10. metrics_json
+            JSON summary of the same metrics.
+        11. jobs_file
+            SQLite job queue of a checkpointed crawl started by Snooper.crawl.
+        12. history_file
+            SQLite snapshot history main() records changed records into when Snooper.history
+            is set.
+        13. schedule_file
+            SQLite state of the crawl scheduler started by Snooper.schedule.
+        14. deal_plan_file
+            JSON state of the planner.DealPlanner that learns which deal queries to skip.
+        15. manifest_name
+            File name of the manifest.ExportManifest an export keeps in its directory.
+        16. manifest_file
+            Manifest of the CSVs, Parquet partitions and export.json main() writes, so
+            unchanged outputs are not rewritten.
     2. Classes
         1. Snooper
             the primary application class for snooper.
+    3. Functions
+        1. cli
+            The command line entry point.
 """
+import argparse
+import functools
+import hashlib
 import json
 import os.path
+import sys
+import time
 from datetime import datetime
 from pathlib import Path
-from lib import actors
-from lib import util
+from lib import common
 
 # Data directory
 data_dir = os.path.dirname(os.path.abspath(__file__))+"/data"
-Path(data_dir).mkdir(parents=True, exist_ok=True)
 
 # Primary save file
 save_file = data_dir+"/snooper.json"
@@ -28,6 +79,41 @@ save_file = data_dir+"/snooper.json"
 # debug save file
 export_file = data_dir+"/export.json"
 
+# HTTP response cache
+cache_dir = data_dir+"/cache"
+
+# Streaming record file
+stream_file = data_dir+"/snooper.ndjson"
+
+# Partitioned Parquet dataset
+parquet_dir = data_dir+"/parquet"
+
+# SQLite storage backend
+sqlite_file = data_dir+"/snooper.db"
+
+# Sharded per-subregion store
+shard_dir = data_dir+"/shards"
+
+# Request metrics
+metrics_file = data_dir+"/snooper.prom"
+metrics_json = data_dir+"/metrics.json"
+
+# Checkpointed crawl job queue
+jobs_file = data_dir+"/jobs.db"
+
+# Snapshot history
+history_file = data_dir+"/history.db"
+
+# Crawl scheduler state
+schedule_file = data_dir+"/schedule.db"
+
+# Learned deal query plan
+deal_plan_file = data_dir+"/deal_plan.json"
+
+# Source digests of exported files, hidden from anything globbing an export directory
+manifest_name = ".export_manifest.json"
+manifest_file = data_dir+"/"+manifest_name
+
 class Snooper:
     """
     A class used to represent the primary application of the snooper package.
@@ -57,7 +143,8 @@ class Snooper:
         Data processor for WeedMaps deals
 
     Pandas : Object/util.SnooperToPandas
-        addon object that provides additional support via methods for pandas
+        addon object that provides additional support via methods for pandas. Created, and
+        pandas imported, the first time it is used.
 
     selected_region : dict
         dictionary of data extracted using matching method.
@@ -74,6 +161,57 @@ class Snooper:
     selected_item : dict
         dictionary of data extracted using matching method.
 
+    rate : float
+        requests per second main() starts at, None for common.requests_per_second. The
+        limiter adapts between it and common.rate_headroom times it.
+
+    burst : int
+        requests main() allows at once after an idle spell, None for common.request_burst.
+
+    concurrent : boolean
+        when True, menus are downloaded in parallel by a bounded pool of workers.
+
+    use_cache : boolean
+        when True, responses are cached in cache_dir and reused until they expire, so
+        repeated runs can return data up to a url_library ttl old. Off by default.
+
+    offline : boolean
+        when True, every response is served from cache_dir and nothing is downloaded.
+
+    plan_deals : boolean
+        when True, deal queries whose deals the other queries of the region keep returning
+        are skipped, as learned in deal_plan_file. A skipped subregion's new deals are only
+        found once another query returns them or every query is verified, so it is off by
+        default.
+
+    incremental : boolean
+        when True, main() starts from the previous export and only downloads menus of
+        listings that changed since then.
+
+    stream : boolean
+        when True, main() writes every record to stream_file as it is downloaded.
+
+    parquet : boolean
+        when True, main() also exports its Dataframes to parquet_dir, partitioned by
+        region / subregion / crawl date.
+
+    sqlite : boolean
+        when True, main() upserts everything it downloads into sqlite_file.
+
+    sharded : boolean
+        when True, main() also saves data_lib as per-subregion shards in shard_dir.
+
+    compact : boolean
+        when True, listings, menu items and deals are stored as compact records.Record
+        projections of the API payloads.
+
+    sinks : list
+        objects notified by the actors as data is downloaded. A sink implements any of
+        on_subregions, on_listings, on_menu and on_deals.
+
+    Catalog : Object/catalog.Catalog
+        indexes over data_lib created by build_catalog, kept current as data is downloaded.
+
 
     Methods
     -------
@@ -89,39 +227,90 @@ class Snooper:
     select_menu()
         Stores menu data from data_lib in memory using the stored listing data from select_listing.
 
+    notify(event, *args)
+        Passes downloaded data on to every sink.
+
     load_json(file)
-        Loads json from file into data_lib
+        Loads json (or an NDJSON record stream) from file into data_lib
+
+    save_json(file, data, export_manifest=None)
+        Saves data from data_lib as json into file, unless it did not change
+
+    load_shards(directory, lazy=True, workers=None)
+        Opens a sharded store as data_lib, reading each subregion only when it is first used
+
+    save_shards(directory)
+        Saves data_lib as per-subregion shards
 
-    save_json(file)
-        Saves data from data_lib as json into file
+    build_catalog()
+        Indexes data_lib in a catalog.Catalog that the actors keep up to date
+
+    crawl(regions=None, workers=None, resume=False, path=jobs_file)
+        Crawls regions as a checkpointed job queue that survives crashes
+
+    resume(workers=None, path=jobs_file)
+        Resumes a crawl that was killed or had failed units
+
+    distribute(regions=None, workers=4, host="127.0.0.1", port=0, path=jobs_file)
+        Coordinates a crawl executed by worker processes that lease its units
+
+    schedule(regions=None, budget=1000, period=3600, duration=None, path=schedule_file)
+        Keeps data_lib fresh within a request budget, refreshing volatile data first
 
     main()
         Primary standalone executable function of snooper
     """
     data_lib = {}
 
-    def __init__(self):
+    def __init__(self, rate=None, burst=None):
         """
         Constructs all the necessary attributes for the Snooper object.
 
         Parameters
         ----------
-        None
+        rate : float
+            Requests per second main() starts at, defaults to common.requests_per_second.
+        burst : int
+            Requests main() allows at once after an idle spell, defaults to
+            common.request_burst.
 
         """
+        from lib import actors
+        self.rate = rate
+        self.burst = burst
         self.Regions=actors.WMRegions(self)
         self.SubRegions = actors.WMSubRegions(self)
         self.Dispensaries = actors.WMDispensaries(self)
         self.Menus = actors.WMMenus(self)
         self.Deals = actors.WMDeals(self)
-        self.Pandas = util.SnooperToPandas(self)
+        self._pandas = None
+        self.Catalog = None
         self.selected_region = None
         self.selected_subregion = None
         self.selected_listing = None
         self.selected_menu = None
         self.selected_item = None
+        self.concurrent = False
+        self.use_cache = False
+        self.offline = False
+        self.plan_deals = False
+        self.incremental = False
+        self.stream = False
+        self.parquet = True
+        self.sqlite = False
+        self.history = False
+        self.sharded = False
+        self.compact = False
+        self.sinks = []
         print("Creating Snooper App") # DEBUG
 
+    @property
+    def Pandas(self): # pylint: disable=invalid-name
+        if self._pandas is None:
+            from lib import util
+            self._pandas = util.SnooperToPandas(self)
+        return self._pandas
+
     def select_region(self, region_slug):
         """
         Selects a region using region_slug as a key for data_lib
@@ -212,9 +401,30 @@ class Snooper:
     # def select_item(self, item_slug):
     #     pass
 
+    def notify(self, event, *args):
+        """
+        Passes data downloaded by an actor to every sink that handles the event.
+
+        Parameters
+        ----------
+        event : str
+            One of 'subregions', 'listings', 'menu' or 'deals'; sinks handle it in on_<event>.
+        *args
+            The region, subregion and listing slugs the data belongs to, then the data.
+
+        Returns
+        -------
+        None
+        """
+        for sink in self.sinks:
+            handler = getattr(sink, "on_" + event, None)
+            if handler is not None:
+                handler(*args)
+
     def load_json(self, file):
         """
-        Loads json from file and saves into data_lib as dict.
+        Loads json from file and saves into data_lib as dict. Files ending in .ndjson are read
+        as record streams one line at a time instead of being parsed whole.
 
         Parameters
         ----------
@@ -228,22 +438,27 @@ class Snooper:
         -------
         loaded : boolean
         """
+        from lib import stream
         loaded = False
         try:
             # in_file = open(common.save_file, "r")
-            with open(file, encoding="utf8") as in_file:
-                print("Loading data from file...")
-                self.data_lib = json.load(in_file)
-                print("Data loaded!")
-                loaded = True
+            print("Loading data from file...")
+            if file.endswith(".ndjson"):
+                self.data_lib = stream.build_data_lib(stream.read_records(file))
+            else:
+                with open(file, encoding="utf8") as in_file:
+                    self.data_lib = json.load(in_file)
+            print("Data loaded!")
+            loaded = True
         except FileNotFoundError:
             print("File not found: Starting from scratch!")
             self.data_lib={}
         return loaded
 
-    def save_json(self, file, data):
+    def save_json(self, file, data, export_manifest=None):
         """
-        Saves data_lib to a file as json.
+        Saves data_lib to a file as json. The file is replaced atomically, so a reader never
+        sees a partially written one.
 
         Parameters
         ----------
@@ -251,15 +466,248 @@ class Snooper:
             path to file that should be used for data export
         data
             dictionary to write to file as json
+        export_manifest : manifest.ExportManifest
+            when given, the file is only written if its content changed since it was
+            recorded in the manifest.
 
         Returns
         -------
         None
         """
+        from lib.manifest import replacing
         print("Saving JSON file")
-        with open(file, "w", encoding="utf8") as out_file:
-            out_file.truncate()
-            json.dump(data, out_file)
+        Path(file).parent.mkdir(parents=True, exist_ok=True)
+        # default=dict serializes lazily loaded shards.ShardedLibrary regions
+        text = json.dumps(data, default=dict)
+
+        def write(temp):
+            with open(temp, "w", encoding="utf8") as out_file:
+                out_file.write(text)
+
+        if export_manifest is None:
+            with replacing(file) as temp:
+                write(temp)
+        elif not export_manifest.write(file, hashlib.sha256(text.encode()).hexdigest(), write):
+            print(f"{file} is unchanged")
+
+    def load_shards(self, directory, lazy=True, workers=None):
+        """
+        Opens a sharded store as data_lib.
+
+        Parameters
+        ----------
+        directory : str
+            shard directory written by save_shards
+        lazy : boolean
+            when True only the manifest is read, and each subregion is read the first time
+            it is accessed. When False every shard is read on a process pool.
+        workers : int
+            number of processes used for a full load
+
+        Returns
+        -------
+        loaded : boolean
+        """
+        from lib import shards
+        self.data_lib = shards.load_shards(directory, lazy, workers)
+        print(f"Opened {len(self.data_lib)} regions from {directory}")
+        return len(self.data_lib) > 0
+
+    def save_shards(self, directory):
+        """
+        Saves data_lib as one shard per subregion. Shards that were never loaded are kept.
+
+        Parameters
+        ----------
+        directory : str
+            shard directory to write
+
+        Returns
+        -------
+        None
+        """
+        from lib import shards
+        written = shards.save_shards(self.data_lib, directory)
+        print(f"Saved {written} shards to {directory}")
+
+    def build_catalog(self):
+        """
+        Indexes data_lib in a catalog.Catalog and adds it to sinks, so everything
+        downloaded afterwards is indexed as it arrives.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        catalog : catalog.Catalog
+        """
+        from lib import catalog
+        if self.Catalog in self.sinks:
+            self.sinks.remove(self.Catalog)
+        self.Catalog = catalog.Catalog()
+        counts = self.Catalog.index(self.data_lib)
+        self.sinks.append(self.Catalog)
+        print(f"Catalog: {counts}")
+        return self.Catalog
+
+    def crawl(self, regions=None, workers=None, resume=False, path=jobs_file):
+        """
+        Crawls regions through a persistent job queue. Every finished unit of work is
+        committed as it completes, so a crawl that is killed can be resumed without
+        downloading anything it already has. The results are assembled into data_lib.
+
+        Parameters
+        ----------
+        regions : list
+            Region slugs to crawl, defaults to every region in actors.regions. Ignored
+            when resuming.
+        workers : int
+            Number of units fetched at once, defaults to common.max_workers.
+        resume : boolean
+            Continue the crawl stored at path instead of starting a new one.
+        path : str
+            SQLite file holding the job queue.
+
+        Returns
+        -------
+        counts : dict
+            Number of units in each state.
+        """
+        from lib import actors
+        from lib import jobs
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        if not resume:
+            for stale in (path, path + "-wal", path + "-shm"):
+                if os.path.exists(stale):
+                    os.remove(stale)
+        queue = jobs.JobQueue(path)
+        try:
+            crawler = jobs.Crawler(self, queue)
+            if resume:
+                retried = queue.retry_failed()
+                if retried:
+                    print(f"Retrying {retried} failed units")
+            else:
+                crawler.plan(regions or actors.regions)
+            counts = crawler.run(workers or common.max_workers)
+            crawler.assemble()
+        finally:
+            queue.close()
+        return counts
+
+    def resume(self, workers=None, path=jobs_file):
+        """
+        Resumes the crawl stored at path. See crawl.
+
+        Parameters
+        ----------
+        workers : int
+            Number of units fetched at once, defaults to common.max_workers.
+        path : str
+            SQLite file holding the job queue.
+
+        Returns
+        -------
+        counts : dict
+        """
+        return self.crawl(workers=workers, resume=True, path=path)
+
+    def distribute(self, regions=None, workers=4, host="127.0.0.1", port=0, path=jobs_file,
+        lease_seconds=60):
+        """
+        Coordinates a crawl whose units are executed by worker processes. Local workers are
+        started here; workers on other hosts can join with `snooper.py worker URL` while the
+        crawl runs. An existing queue at path is resumed rather than replaced, including
+        units a killed crawl left running.
+
+        Parameters
+        ----------
+        regions : list
+            Region slugs to crawl, defaults to every region in actors.regions.
+        workers : int
+            Number of local worker processes.
+        host : str
+            Interface the coordinator listens on, 0.0.0.0 to accept remote workers.
+        port : int
+            Port the coordinator listens on, 0 for any free port.
+        path : str
+            SQLite file holding the job queue.
+        lease_seconds : float
+            How long a worker may hold units before they are given to another worker.
+
+        Returns
+        -------
+        counts : dict
+            Number of units in each state.
+        """
+        from lib import actors
+        from lib import jobs
+        from lib import coordinator
+        queue = jobs.JobQueue(path)
+        server = coordinator.Coordinator(queue, lease_seconds)
+        try:
+            # Units a killed local crawl left running hold no lease that could expire
+            recovered = queue.recover()
+            if recovered:
+                print(f"Requeued {recovered} units left running by a killed crawl")
+            server.plan(regions or actors.regions)
+            url = server.serve(host, port)
+            # Local workers renew their leases a few times per lease
+            processes = coordinator.spawn_workers(url, workers, functools.partial(
+                coordinator.run_worker, heartbeat=min(10.0, lease_seconds / 3)))
+            while not server.status()['finished']:
+                if workers and not any(process.is_alive() for process in processes):
+                    print("Every local worker exited before the crawl finished")
+                    break
+                time.sleep(0.5)
+            for process in processes:
+                process.join(timeout=5)
+            counts = server.status()
+            jobs.Crawler(self, queue).assemble()
+        finally:
+            server.stop()
+            queue.close()
+        return counts
+
+    def schedule(self, regions=None, budget=1000, period=60 * 60, duration=None,
+        path=schedule_file):
+        """
+        Keeps data_lib fresh within a request budget. Instead of crawling everything, the
+        scheduler fetches whichever subregions, listings, menus or deals are most likely to
+        have changed per request. Its state is kept at path, so a later call continues
+        where this one stopped.
+
+        Parameters
+        ----------
+        regions : list
+            Region slugs to track, defaults to every region in actors.regions.
+        budget : int
+            Requests that may be made per period.
+        period : float
+            Seconds the budget applies to, e.g. 3600 or 86400.
+        duration : float
+            Seconds to run for, None to run until interrupted.
+        path : str
+            SQLite file holding the scheduler's state.
+
+        Returns
+        -------
+        summary : dict
+            Number of targets fetched, changed and failed, and requests made.
+        """
+        from lib import actors
+        from lib import scheduler
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        planner = scheduler.Scheduler(self, path, budget, period)
+        try:
+            planner.add(regions or actors.regions)
+            summary = planner.run(duration)
+            print(f"Schedule: {planner.report()}")
+        finally:
+            planner.close()
+        return summary
 
     def main(self):
         """
@@ -273,8 +721,24 @@ class Snooper:
         -------
         None
         """
+        from lib import stream
+        from lib.cache import ResponseCache
+        from lib.history import HistoryStore
+        from lib.manifest import ExportManifest, digest
+        from lib.planner import DealPlanner
+        from lib.storage import SQLiteStore
+        from lib import export
+        from lib import util
         start_time = datetime.now()
         print("Running main()")
+        Path(data_dir).mkdir(parents=True, exist_ok=True)
+        if self.rate is not None or self.burst is not None:
+            common.set_rate(self.rate, self.burst)
+        if self.use_cache or self.offline:
+            common.cache = ResponseCache(cache_dir, offline=self.offline)
+        if self.plan_deals:
+            common.deal_planner = DealPlanner(deal_plan_file)
+        common.compact_records = self.compact
         # if self.load_json(save_file):
         #     # Define pandas DataFrames
         #     listings_frame = self.Pandas.listings()
@@ -288,6 +752,18 @@ class Snooper:
         #     region_deals_frame.to_csv(data_dir + "/region_deals.csv")
 
         # else:
+        if self.incremental:
+            self.load_json(export_file)
+        if self.stream:
+            writer = stream.RecordWriter(stream_file)
+            self.sinks.append(writer)
+        if self.sqlite:
+            store = SQLiteStore(sqlite_file)
+            self.sinks.append(store)
+        if self.history:
+            history = HistoryStore(history_file, start_time)
+            self.sinks.append(history)
+
         # Download subregions for region
         self.Regions.get_subregions("oklahoma")
 
@@ -296,26 +772,369 @@ class Snooper:
         self.select_subregion('oklahoma-city')
 
         # Download data for export
-        self.SubRegions.get_listings(self.selected_subregion)
-        self.Regions.get_menus()
+        self.SubRegions.get_listings(self.selected_subregion, self.incremental)
+        self.Regions.get_menus(concurrent=self.concurrent, incremental=self.incremental)
         self.Regions.get_deals()
+        if self.incremental:
+            self.SubRegions.Dispensaries.report_delta()
+
+        # Only outputs whose source data changed since the last run are rebuilt and written
+        manifest = ExportManifest(manifest_file)
+        region = self.selected_subregion['region']
+        subregion = self.selected_subregion['slug']
+        subregions = self.data_lib[region]
+        deals_sources = {slug: util.source_digest("deals", subregions[slug])
+            for slug in subregions}
+        sources = {"listings": util.source_digest("listings", self.selected_subregion),
+            "menus": util.source_digest("menus", self.selected_subregion),
+            "deals": digest(list(deals_sources.values()))}
+        builders = {"listings": self.Pandas.listings, "menus": self.Pandas.subregion_menus,
+            "deals": self.Pandas.region_deals}
+        frames = {}
 
-        # Define pandas DataFrames
-        listings_frame = self.Pandas.listings()
-        subregion_menus_frame = self.Pandas.subregion_menus()
-        # subregion_deals_frame = self.Pandas.subregion_deals()
-        region_deals_frame = self.Pandas.region_deals()
+        def frame(table):
+            # Each Dataframe is built at most once, and only if something needs it
+            if table not in frames:
+                frames[table] = builders[table]()
+            return frames[table]
 
         # Export to CSV
-        listings_frame.to_csv(data_dir + "/listings.csv")
-        subregion_menus_frame.to_csv(data_dir + "/subregion_menus.csv")
-        region_deals_frame.to_csv(data_dir + "/region_deals.csv")
+        for table, name in (("listings", "/listings.csv"), ("menus", "/subregion_menus.csv"),
+            ("deals", "/region_deals.csv")):
+            manifest.write(data_dir + name, sources[table],
+                lambda temp, table=table: frame(table).to_csv(temp))
+
+        # Export to Parquet
+        if self.parquet:
+            crawl_date = start_time.date().isoformat()
+            partitions = [("listings", subregion, sources['listings'], lambda: frame("listings")),
+                ("menus", subregion, sources['menus'], lambda: frame("menus"))]
+            partitions += [("deals", slug, deals_sources[slug],
+                lambda slug=slug: util.deals_frame(subregions[slug]))
+                for slug in subregions if subregions[slug].get('deals')]
+            for table, slug, source, build in partitions:
+                path = export.partition_file(parquet_dir, table, region, slug, crawl_date)
+                if manifest.current(path, source):
+                    manifest.record(path, source, written=False)
+                    continue
+                export.write_partition(build(), parquet_dir, table, region, slug, crawl_date)
+                manifest.record(path, source)
 
         # Save to JSON
-        self.save_json(export_file, self.data_lib)
+        self.save_json(export_file, self.data_lib, manifest)
+        manifest.save()
+        report = manifest.report()
+        print(f"Export: {report['written']} files written ({report['bytes_written']} bytes), "
+            f"{report['skipped']} unchanged skipped ({report['bytes_saved']} bytes saved)")
+        if self.sharded:
+            self.save_shards(shard_dir)
+        if self.stream:
+            writer.close()
+            self.sinks.remove(writer)
+            print(f"Streamed {writer.written} records to {stream_file}")
+        if self.sqlite:
+            store.close()
+            self.sinks.remove(store)
+        if self.history:
+            print(f"History: {history.report()}")
+            history.close()
+            self.sinks.remove(history)
+        print(f"Rate limiter: {common.limiter.report()}")
+        if common.cache is not None:
+            print(f"Cache: {common.cache.report()}")
+        if common.deal_planner is not None:
+            print(f"Deal planner: {common.deal_planner.report()}")
+        report = common.metrics.report()
+        for endpoint, stats in report['endpoints'].items():
+            print(f"Requests ({endpoint}): {stats['requests']} in {stats['latency']['total']:.1f}s, "
+                f"p95 {stats['latency']['p95']:.3f}s, {stats['retries']} retries, "
+                f"{stats['coalesced']} coalesced")
+        print(f"Items: {report['items']}")
+        common.metrics.write_textfile(metrics_file)
+        common.metrics.write_json(metrics_json)
         print(f"Time: {datetime.now() - start_time}")
 
 
-if __name__ == "__main__":
+def _load(app, path):
+    if os.path.isdir(path):
+        return app.load_shards(path)
+    return app.load_json(path)
+
+
+def _limit(args):
+    if args.rate is not None or args.burst is not None:
+        common.set_rate(args.rate, args.burst)
+
+
+def _use_cache(args):
+    from lib.cache import ResponseCache
+    if args.cache or args.offline:
+        common.cache = ResponseCache(cache_dir, offline=args.offline)
+
+
+def _plan_deals(args):
+    from lib.planner import DealPlanner
+    if args.plan_deals:
+        Path(data_dir).mkdir(parents=True, exist_ok=True)
+        common.deal_planner = DealPlanner(deal_plan_file)
+
+
+def _crawl(args):
+    app = Snooper()
+    _limit(args)
+    _use_cache(args)
+    _plan_deals(args)
+    if args.command == "resume":
+        counts = app.resume(args.workers, args.jobs)
+    else:
+        counts = app.crawl(args.regions or None, args.workers, path=args.jobs)
+    print(f"Units: {counts}")
+    if common.deal_planner is not None:
+        print(f"Deal planner: {common.deal_planner.report()}")
+    app.save_json(args.output, app.data_lib)
+    return 0 if not counts['failed'] else 1
+
+
+def _distribute(args):
+    app = Snooper()
+    _limit(args)
+    _plan_deals(args)
+    counts = app.distribute(args.regions or None, args.workers, args.host, args.port,
+        args.jobs, args.lease_seconds)
+    print(f"Units: {counts}")
+    app.save_json(args.output, app.data_lib)
+    return 0 if not counts['failed'] else 1
+
+
+def _worker(args):
+    import socket
+    from lib import coordinator
+    _limit(args)
+    name = args.name or f"{socket.gethostname()}-{os.getpid()}"
+    coordinator.run_worker(args.url, name, args.batch)
+    return 0
+
+
+def _export(args):
+    from lib.manifest import ExportManifest, digest
+    from lib import util
+    app = Snooper()
+    if not _load(app, args.input):
+        print(f"Nothing to export in {args.input}")
+        return 1
+    manifest = ExportManifest(os.path.join(args.output, manifest_name))
+    if args.full:
+        manifest.outputs = {}
+    if args.format == "parquet" and not args.chunk_rows and not args.chunk_bytes:
+        files = util.build_frames(app.data_lib, args.region, args.subregion, args.workers,
+            root=args.output, export_manifest=manifest)
+        for table, paths in files.items():
+            print(f"{table}: {len(paths)} partitions under {args.output}")
+    else:
+        # A single file holds every selected subregion, so it is rewritten if any changed
+        digests = {table: [] for table in util.frame_builders}
+        for _, _, subregion in util.selected_subregions(app.data_lib, args.region,
+                args.subregion):
+            for table in digests:
+                digests[table].append(util.source_digest(table, subregion))
+        sources = {table: digest(digests[table]) for table in digests}
+        paths = {table: os.path.join(args.output, f"{table}.{args.format}") for table in sources}
+        stale = [table for table in sources if not manifest.current(paths[table], sources[table])]
+        if args.chunk_rows or args.chunk_bytes:
+            # Streamed one bounded chunk at a time, so memory stays flat however much is exported
+            from lib import export
+            for table, path in paths.items():
+                if table not in stale:
+                    manifest.record(path, sources[table], written=False)
+                    continue
+                frames = util.iter_frames(app.data_lib, table, args.region, args.subregion,
+                    args.chunk_rows, args.chunk_bytes)
+                if args.format == "csv":
+                    rows = export.write_csv_chunks(frames, path)
+                else:
+                    rows = export.write_parquet_chunks(frames, path, table)
+                manifest.record(path, sources[table])
+                print(f"{table}: {rows} rows to {path}")
+        else:
+            frames = util.build_frames(app.data_lib, args.region, args.subregion, args.workers) \
+                if stale else {}
+            for table, path in paths.items():
+                if manifest.write(path, sources[table],
+                    lambda temp, table=table: frames[table].to_csv(temp)):
+                    print(f"{table}: {len(frames[table])} rows to {path}")
+    manifest.save()
+    report = manifest.report()
+    print(f"Export: {report['written']} files written ({report['bytes_written']} bytes), "
+        f"{report['skipped']} unchanged skipped ({report['bytes_saved']} bytes saved)")
+    return 0
+
+
+def _list(args):
+    app = Snooper()
+    if args.kind == "regions":
+        app.Regions.list(show=True)
+        return 0
+    _limit(args)
+    _load(app, args.input)
+    if args.fetch or args.region not in app.data_lib:
+        app.Regions.get_subregions(args.region)
+    if args.kind == "subregions":
+        app.SubRegions.list(args.region, show=True)
+        return 0
+    subregions = app.data_lib[args.region]
+    if args.subregion is not None and args.subregion not in subregions:
+        print(f"{args.subregion} is not a subregion of {args.region}")
+        return 1
+    selected = [args.subregion] if args.subregion is not None else list(subregions)
+    if args.fetch or any('deals' not in subregions[slug] for slug in selected):
+        if args.subregion is None:
+            app.Regions.fetch_deals(args.region)
+        else:
+            app.Regions.merge_deals(args.region, [app.SubRegions.get_deals(subregions[slug])
+                for slug in selected], selected)
+    for slug in selected:
+        deals = subregions[slug].get('deals', {})
+        print(f"{slug}: {len(deals)} deals")
+        for deal in deals:
+            print(f"- {deal}")
+    return 0
+
+
+def _schedule(args):
     app = Snooper()
-    app.main()
+    if os.path.exists(args.input):
+        _load(app, args.input)
+    _limit(args)
+    _plan_deals(args)
+    try:
+        summary = app.schedule(args.regions or None, args.budget,
+            {"hour": 60 * 60, "day": 24 * 60 * 60}[args.period], args.duration, args.state)
+    finally:
+        app.save_json(args.output, app.data_lib)
+    if common.deal_planner is not None:
+        print(f"Deal planner: {common.deal_planner.report()}")
+    return 0 if not summary['failed'] else 1
+
+
+def _rate_arguments(command):
+    command.add_argument("--rate", type=float, help="requests per second, defaults to "
+        f"{common.requests_per_second}; higher rates risk being banned")
+    command.add_argument("--burst", type=int, help="requests allowed at once after an idle "
+        f"spell, defaults to {common.request_burst}")
+
+
+def cli(argv=None):
+    """
+    Runs a snooper command. Each command imports only what it needs, so pandas is only
+    loaded by export, and requests by commands that download.
+
+    Parameters
+    ----------
+    argv : list
+        Command line arguments, defaults to sys.argv[1:].
+
+    Returns
+    -------
+    status : int
+        Exit status of the command.
+    """
+    parser = argparse.ArgumentParser(prog="snooper", description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command")
+
+    crawl = commands.add_parser("crawl", help="crawl regions through a resumable job queue")
+    crawl.add_argument("regions", nargs="*", help="region slugs, defaults to every region")
+    resume = commands.add_parser("resume", help="resume a killed or failed crawl")
+    for command in (crawl, resume):
+        command.add_argument("--workers", type=int, help="units fetched at once")
+        command.add_argument("--jobs", default=jobs_file, help="job queue database")
+        command.add_argument("--output", default=export_file, help="JSON file to save")
+        command.add_argument("--plan-deals", action="store_true",
+            help="skip deal queries learned to be redundant, new deals may show up late")
+        command.add_argument("--cache", action="store_true",
+            help="reuse cached responses until their ttl runs out, the data may be stale")
+        command.add_argument("--offline", action="store_true",
+            help="serve every response from the cache, download nothing")
+        _rate_arguments(command)
+        command.set_defaults(run=_crawl)
+
+    distribute = commands.add_parser("distribute",
+        help="coordinate a crawl executed by worker processes, local or remote")
+    distribute.add_argument("regions", nargs="*", help="region slugs, defaults to every region")
+    distribute.add_argument("--workers", type=int, default=4, help="local worker processes")
+    distribute.add_argument("--host", default="127.0.0.1",
+        help="interface to listen on, 0.0.0.0 to accept remote workers")
+    distribute.add_argument("--port", type=int, default=0, help="port, 0 for any free port")
+    distribute.add_argument("--jobs", default=jobs_file, help="job queue database")
+    distribute.add_argument("--lease-seconds", type=float, default=60,
+        help="how long a worker holds units without renewing them")
+    distribute.add_argument("--output", default=export_file, help="JSON file to save")
+    distribute.add_argument("--plan-deals", action="store_true",
+        help="skip deal queries learned to be redundant, new deals may show up late")
+    _rate_arguments(distribute)
+    distribute.set_defaults(run=_distribute)
+
+    worker = commands.add_parser("worker", help="work for a distribute coordinator")
+    worker.add_argument("url", help="url the coordinator printed")
+    worker.add_argument("--name", help="unique worker name, defaults to host-pid")
+    worker.add_argument("--batch", type=int, default=4, help="units leased at once")
+    _rate_arguments(worker)
+    worker.set_defaults(run=_worker)
+
+    export = commands.add_parser("export", help="export saved data as CSV or Parquet")
+    export.add_argument("--input", default=export_file, help="JSON, NDJSON or shard directory")
+    export.add_argument("--format", choices=("csv", "parquet"), default="csv")
+    export.add_argument("--output", help="output directory, defaults to data_dir for csv "
+        "and parquet_dir for parquet")
+    export.add_argument("--region", action="append", help="only this region, repeatable")
+    export.add_argument("--subregion", action="append", help="only this subregion, repeatable")
+    export.add_argument("--workers", type=int, help="processes building frames")
+    export.add_argument("--full", action="store_true",
+        help="rewrite every file, even those whose data did not change")
+    export.add_argument("--chunk-rows", type=int,
+        help="stream each table into a single file, this many rows at a time")
+    export.add_argument("--chunk-bytes", type=int,
+        help="stream each table into a single file, about this many bytes at a time")
+    export.set_defaults(run=_export)
+
+    listing = commands.add_parser("list", help="list regions, subregions or deals")
+    kinds = listing.add_subparsers(dest="kind", required=True)
+    kinds.add_parser("regions")
+    subregions = kinds.add_parser("subregions")
+    subregions.add_argument("region")
+    deals = kinds.add_parser("deals")
+    deals.add_argument("region")
+    deals.add_argument("subregion", nargs="?")
+    for command in (subregions, deals):
+        command.add_argument("--input", default=export_file,
+            help="JSON, NDJSON or shard directory read before downloading")
+        command.add_argument("--fetch", action="store_true",
+            help="download even when the data is already saved")
+        _rate_arguments(command)
+    listing.set_defaults(run=_list)
+
+    schedule = commands.add_parser("schedule",
+        help="keep saved data fresh within a request budget")
+    schedule.add_argument("regions", nargs="*", help="region slugs, defaults to every region")
+    schedule.add_argument("--budget", type=int, default=1000, help="requests per period")
+    schedule.add_argument("--period", choices=("hour", "day"), default="hour")
+    schedule.add_argument("--duration", type=float, help="seconds to run, default forever")
+    schedule.add_argument("--state", default=schedule_file, help="scheduler database")
+    schedule.add_argument("--input", default=export_file,
+        help="JSON, NDJSON or shard directory to start from")
+    schedule.add_argument("--output", default=export_file, help="JSON file to save")
+    schedule.add_argument("--plan-deals", action="store_true",
+        help="skip deal queries learned to be redundant, new deals may show up late")
+    _rate_arguments(schedule)
+    schedule.set_defaults(run=_schedule)
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        Snooper().main()
+        return 0
+    if args.command == "export" and args.output is None:
+        args.output = parquet_dir if args.format == "parquet" else data_dir
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
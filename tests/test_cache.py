@@ -0,0 +1,73 @@
+import os
+import pytest
+from lib import common
+from lib.cache import ResponseCache
+from lib.ratelimit import RateLimiter
+
+MENU_URL = common.url_construct(common.url_library['menu']['url'], "some-listing", 1)
+DEALS_URL = common.url_construct(common.url_library['deals']['url'], 42, 1)
+
+
+class CountingTransport:
+    def __init__(self):
+        self.calls = 0
+
+    def get(self, url, headers=None):
+        self.calls += 1
+        return Response({"url": url})
+
+
+class Response:
+    status_code = 200
+    headers = {}
+
+    def __init__(self, body):
+        self.body = body
+        self.content = repr(body).encode()
+
+    def json(self):
+        return self.body
+
+
+@pytest.fixture
+def transport(monkeypatch):
+    monkeypatch.setattr(common, "limiter", RateLimiter(rate=1000, burst=1000, max_rate=1000))
+    transport = CountingTransport()
+    monkeypatch.setattr(common, "transport", transport)
+    return transport
+
+
+def test_get_request_uses_cache_and_endpoint_ttl(tmp_path, transport, monkeypatch):
+    monkeypatch.setattr(common, "cache", ResponseCache(str(tmp_path)))
+    assert common.get_request(MENU_URL) == {"url": MENU_URL}
+    assert common.get_request(MENU_URL) == {"url": MENU_URL}
+    assert transport.calls == 1
+    monkeypatch.setitem(common.url_library['deals'], 'ttl', -1)
+    common.get_request(DEALS_URL)
+    common.get_request(DEALS_URL)
+    assert transport.calls == 3
+    assert common.cache.report()["hits"] == 1
+    assert common.cache.report()["misses"] == 3
+
+
+def test_offline_serves_stale_entries_and_refuses_misses(tmp_path, transport, monkeypatch):
+    ResponseCache(str(tmp_path)).put(DEALS_URL, {"cached": True}, "deals")
+    monkeypatch.setitem(common.url_library['deals'], 'ttl', -1)
+    monkeypatch.setattr(common, "cache", ResponseCache(str(tmp_path), offline=True))
+    assert common.get_request(DEALS_URL) == {"cached": True}
+    with pytest.raises(common.RequestError):
+        common.get_request(MENU_URL)
+    assert transport.calls == 0
+
+
+def test_lru_eviction(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_bytes=450)
+    for i in range(3):
+        cache.put(f"http://test/{i}", {"payload": "x" * 50})
+    assert cache.get("http://test/0") is not None
+    cache.put("http://test/3", {"payload": "x" * 50})
+    assert cache.get("http://test/1") is None
+    assert cache.get("http://test/0") is not None
+    assert cache.size <= 450
+    assert sum(len(files) for _, _, files in os.walk(tmp_path)) == len(cache._index)
+    assert len(ResponseCache(str(tmp_path))._index) == len(cache._index)
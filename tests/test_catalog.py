@@ -0,0 +1,139 @@
+import random
+from lib import records
+from lib import util
+from lib.catalog import Catalog
+
+CATEGORIES = ["Flower", "Edible", "Concentrate", None]
+
+
+def build_data_lib(seed=7):
+    rng = random.Random(seed)
+    data_lib = {}
+    item_id = 0
+    for region in ("oklahoma", "colorado"):
+        for sub in range(3):
+            subregion = f"{region}-{sub}"
+            listings = {}
+            for shop in range(4):
+                slug = f"{subregion}-shop-{shop}"
+                menu = {}
+                for _ in range(rng.randint(0, 12)):
+                    item_id += 1
+                    category = rng.choice(CATEGORIES)
+                    menu[f"item-{item_id}"] = {"id": item_id, "slug": f"item-{item_id}",
+                        "name": f"Item {item_id}",
+                        "category": {"name": category} if category else None,
+                        "edge_category": {"name": rng.choice(["Indica", "Sativa"])},
+                        "price": {"price": rng.choice([None, round(rng.uniform(5, 80), 2)]),
+                            "unit": "g"}}
+                listings[slug] = {"id": hash(slug) % 10**6, "slug": slug, "menu": menu,
+                    "region": region, "subregion": subregion}
+            deals = {f"{subregion}-deal-{n}": {"id": hash(subregion) % 1000 * 10 + n,
+                "slug": f"{subregion}-deal-{n}", "title": "Deal",
+                "listing": {"slug": f"{subregion}-shop-{n}", "region": {"slug": subregion}}}
+                for n in range(2)}
+            data_lib.setdefault(region, {})[subregion] = {"slug": subregion, "region": region,
+                "listings": listings, "deals": deals}
+    return data_lib
+
+
+def scan(data_lib, region=None, subregion=None, listing=None, category=None,
+    min_price=None, max_price=None):
+    found = []
+    for region_slug, subregions in data_lib.items():
+        for subregion_slug, data in subregions.items():
+            for listing_slug, shop in data["listings"].items():
+                for item in shop.get("menu", {}).values():
+                    price = (item.get("price") or {}).get("price")
+                    if region not in (None, region_slug) or subregion not in \
+                        (None, subregion_slug) or listing not in (None, listing_slug):
+                        continue
+                    if category is not None and records.lookup(item, "category.name") != \
+                        category:
+                        continue
+                    if (min_price is not None or max_price is not None) and price is None:
+                        continue
+                    if min_price is not None and price < min_price or \
+                        max_price is not None and price > max_price:
+                        continue
+                    found.append((listing_slug, item["slug"]))
+    return sorted(found)
+
+
+def test_queries_match_a_full_scan():
+    data_lib = build_data_lib()
+    catalog = Catalog()
+    counts = catalog.index(data_lib)
+    assert counts["listings"] == 24 and counts["deals"] == 12
+    rng = random.Random(3)
+    for _ in range(200):
+        query = {
+            "region": rng.choice([None, "oklahoma", "colorado"]),
+            "subregion": rng.choice([None, None, "oklahoma-1", "colorado-2"]),
+            "listing": rng.choice([None, None, None, "oklahoma-1-shop-2"]),
+            "category": rng.choice(CATEGORIES),
+            "min_price": rng.choice([None, 10, 30.5]),
+            "max_price": rng.choice([None, 30, 60]),
+        }
+        found = catalog.items(**query)
+        assert sorted((listing, item["slug"]) for listing, item in found) == \
+            scan(data_lib, **query), query
+        assert [(listing, item["slug"]) for listing, item in found] == \
+            sorted((listing, item["slug"]) for listing, item in found)
+
+    cheap = catalog.items(category="Flower", max_price=50, order="price")
+    prices = [item["price"]["price"] for _, item in cheap]
+    assert prices == sorted(prices) and prices and max(prices) <= 50
+    assert len(catalog.items(order="price", limit=5)) == 5
+
+
+def test_refreshes_update_the_indexes_incrementally():
+    data_lib = build_data_lib()
+    catalog = Catalog()
+    catalog.index(data_lib)
+    shop = data_lib["oklahoma"]["oklahoma-0"]["listings"]["oklahoma-0-shop-0"]
+    catalog.on_menu("oklahoma", "oklahoma-0", "oklahoma-0-shop-0", [
+        {"id": 90001, "slug": "kush", "category": {"name": "Flower"},
+            "price": {"price": 1.5}},
+        records.project("menu", {"id": 90002, "slug": "gummy",
+            "category": {"name": "Edible"}, "price": {"price": 2.5}})])
+    assert [item["slug"] for _, item in catalog.items(max_price=2.0)] == ["kush"]
+    assert [item["slug"] for _, item in catalog.items(category="Edible", max_price=3)] == \
+        ["gummy"]
+    assert len(catalog.items(listing="oklahoma-0-shop-0")) == 2
+    assert catalog.item(90001)["slug"] == "kush"
+    assert catalog.item("oklahoma-0-shop-0", "gummy")["id"] == 90002
+    old_ids = [item["id"] for item in shop["menu"].values()]
+    assert all(catalog.item(item_id) is None for item_id in old_ids)
+
+    # A listings refresh without shop-0 drops it and its menu
+    listings = data_lib["oklahoma"]["oklahoma-0"]["listings"]
+    catalog.on_listings("oklahoma", "oklahoma-0",
+        [listing for slug, listing in listings.items() if slug != "oklahoma-0-shop-0"])
+    assert catalog.listing("oklahoma-0-shop-0") is None
+    assert catalog.item(90001) is None
+    assert catalog.items(max_price=2.0) == []
+    assert catalog.listing(listings["oklahoma-0-shop-1"]["id"])["slug"] == "oklahoma-0-shop-1"
+    assert len(catalog.listings(subregion="oklahoma-0")) == 3
+    assert len(catalog.listings(region="colorado")) == 12
+
+    catalog.on_deals("oklahoma", "oklahoma-0", [])
+    assert len(catalog.deals(region="oklahoma")) == 4
+    assert [deal["slug"] for deal in catalog.deals(listing="oklahoma-1-shop-1")] == \
+        ["oklahoma-1-deal-1"]
+    assert catalog.deal("oklahoma-1-deal-0")["listing"]["slug"] == "oklahoma-1-shop-0"
+
+
+def test_query_results_become_frames():
+    catalog = Catalog()
+    catalog.index(build_data_lib())
+    pandas = util.SnooperToPandas(None)
+    menus = pandas.catalog_menus(catalog, region="colorado", category="Edible")
+    assert list(menus.columns) == pandas.menu_columns
+    assert len(menus) == len(catalog.items(region="colorado", category="Edible"))
+    assert set(menus["listing"]) <= {listing["slug"] for listing in
+        catalog.listings(region="colorado")}
+    assert list(pandas.catalog_listings(catalog, subregion="colorado-1")["slug"]) == \
+        [f"colorado-1-shop-{n}" for n in range(4)]
+    assert list(pandas.catalog_deals(catalog, listing="colorado-2-shop-0").columns) == \
+        pandas.deal_columns
@@ -0,0 +1,93 @@
+import json
+import os
+import subprocess
+import sys
+import pytest
+import snooper
+from lib import common
+from lib import mockapi
+from lib.ratelimit import RateLimiter
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setattr(common, "limiter", RateLimiter(rate=1000, burst=1000, max_rate=1000))
+    monkeypatch.setattr(common, "deal_planner", None)
+    monkeypatch.setattr(common, "cache", None)
+    monkeypatch.setattr(snooper, "cache_dir", str(tmp_path / "cache"))
+    monkeypatch.setattr(snooper, "deal_plan_file", str(tmp_path / "deal_plan.json"))
+    monkeypatch.setattr(common, "retry_backoff", 0)
+    with mockapi.MockWeedMaps(subregions=2, listings=3, items=4, deals=2) as mock:
+        monkeypatch.setattr(common, "transport", mockapi.MockTransport(mock.url))
+        yield mock
+
+
+def test_import_has_no_side_effects_and_loads_no_heavy_modules():
+    script = ("import sys, snooper; print(sorted(m for m in ('pandas', 'requests', 'pyarrow', "
+        "'sqlite3', 'lib.actors', 'lib.jobs', 'lib.storage', 'lib.history', 'lib.cache', "
+        "'lib.stream', 'lib.shards', 'lib.manifest', 'lib.catalog') if m in sys.modules))")
+    result = subprocess.run([sys.executable, "-c", script], cwd=SRC, capture_output=True,
+        text=True, check=True, env=dict(os.environ, TERM="dumb"))
+    assert result.stdout == "[]\n"
+    assert result.stderr == ""
+
+
+def test_crawl_then_export_and_list(tmp_path, server, capsys):
+    data = str(tmp_path / "export.json")
+    assert snooper.cli(["crawl", "oklahoma", "--jobs", str(tmp_path / "jobs.db"),
+        "--output", data]) == 0
+    with open(data, encoding="utf8") as in_file:
+        assert len(json.load(in_file)["oklahoma"]) == 2
+    # Responses are only cached, and deal queries only skipped, when asked for
+    assert common.cache is None and not snooper.Snooper().use_cache
+    assert common.deal_planner is None and not snooper.Snooper().plan_deals
+    # The default pace is the original one request every 5 seconds
+    assert (common.requests_per_second, common.request_burst) == (0.2, 1)
+    # ... with room for the limiter to speed up while nothing is throttled
+    assert common.max_requests_per_second > common.requests_per_second
+
+    assert snooper.cli(["export", "--input", data, "--output", str(tmp_path / "csv"),
+        "--workers", "1"]) == 0
+    assert sorted(name for name in os.listdir(tmp_path / "csv") if not name.startswith(".")) == \
+        ["deals.csv", "listings.csv", "menus.csv"]
+    assert snooper.cli(["export", "--input", data, "--format", "parquet",
+        "--output", str(tmp_path / "parquet"), "--subregion", "oklahoma-001",
+        "--workers", "1"]) == 0
+    assert os.listdir(tmp_path / "parquet" / "listings" / "region=oklahoma") == \
+        ["subregion=oklahoma-001"]
+
+    capsys.readouterr()
+    requests = server.stats["requests"]
+    assert snooper.cli(["list", "subregions", "oklahoma", "--input", data]) == 0
+    assert snooper.cli(["list", "deals", "oklahoma", "oklahoma-000", "--input", data]) == 0
+    # Everything listed was read from the saved crawl
+    assert server.stats["requests"] == requests
+    out = capsys.readouterr().out
+    assert "oklahoma-001\n" in out
+    assert "oklahoma-000: 2 deals" in out
+
+
+def test_list_fetches_what_is_not_saved(tmp_path, server, capsys):
+    assert snooper.cli(["list", "deals", "oklahoma", "--input",
+        str(tmp_path / "missing.json")]) == 0
+    out = capsys.readouterr().out
+    assert "oklahoma-000: 2 deals" in out and "oklahoma-001: 2 deals" in out
+    assert snooper.cli(["list", "deals", "oklahoma", "nowhere", "--input",
+        str(tmp_path / "missing.json")]) == 1
+    snooper.cli(["list", "regions"])
+    assert "Region Count: 51" in capsys.readouterr().out
+
+
+def test_crawl_caches_and_plans_deals_only_when_asked(tmp_path, server):
+    command = ["crawl", "oklahoma", "--output", str(tmp_path / "export.json"), "--cache",
+        "--rate", "500", "--burst", "50"]
+    assert snooper.cli(command + ["--jobs", str(tmp_path / "first.db")]) == 0
+    requests = server.stats["requests"]
+    assert snooper.cli(command + ["--jobs", str(tmp_path / "second.db")]) == 0
+    assert server.stats["requests"] == requests
+    assert (common.limiter.rate, common.limiter.burst) == (500, 50)
+    assert common.limiter.max_rate == 500 * common.rate_headroom
+    assert snooper.cli(command + ["--jobs", str(tmp_path / "third.db"), "--plan-deals"]) == 0
+    assert common.deal_planner is not None and os.path.exists(snooper.deal_plan_file)
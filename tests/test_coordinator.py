@@ -0,0 +1,147 @@
+import functools
+import socket
+import threading
+import time
+import pytest
+import requests
+import snooper
+from lib import actors
+from lib import common
+from lib import coordinator
+from lib import jobs
+from lib import mockapi
+from lib.ratelimit import RateLimiter
+
+
+class Controller:
+    def __init__(self):
+        self.data_lib = {}
+        self.Regions = actors.WMRegions(self)
+        self.SubRegions = actors.WMSubRegions(self)
+        self.sinks = []
+
+    def notify(self, event, *args):
+        pass
+
+
+def mock_worker(api_url, url, name):
+    common.limiter = RateLimiter(rate=1000, burst=1000, max_rate=1000)
+    common.transport = mockapi.MockTransport(api_url)
+    coordinator.run_worker(url, name, batch=3, heartbeat=0.1)
+
+
+@pytest.fixture
+def server():
+    with mockapi.MockWeedMaps(subregions=3, listings=12, items=5, deals=4) as mock:
+        yield mock
+
+
+def test_workers_share_a_crawl_and_expired_leases_are_reassigned(tmp_path, server):
+    queue = jobs.JobQueue(str(tmp_path / "jobs.db"))
+    boss = coordinator.Coordinator(queue, lease_seconds=0.5)
+    boss.plan(["oklahoma"])
+    # A worker that leases the first unit and dies without reporting back
+    ghost = boss.lease("ghost", 1)
+    url = boss.serve()
+    try:
+        processes = coordinator.spawn_workers(url, 3,
+            functools.partial(mock_worker, server.url))
+        for process in processes:
+            process.join(timeout=30)
+        assert all(process.exitcode == 0 for process in processes)
+        assert not boss.complete("ghost", ghost[0], [], [])
+        status = boss.status()
+    finally:
+        boss.stop()
+
+    # 1 subregions + 3 x (1 listing page + 1 deal page) + 36 menus
+    assert status == {"pending": 0, "running": 0, "done": 1 + 3 * 2 + 36, "failed": 0,
+        "finished": True}
+    controller = Controller()
+    jobs.Crawler(controller, queue).assemble()
+    queue.close()
+    subregions = controller.data_lib["oklahoma"]
+    assert sorted(subregions) == ["oklahoma-000", "oklahoma-001", "oklahoma-002"]
+    for subregion in subregions.values():
+        assert len(subregion["listings"]) == 12
+        assert all(len(listing["menu"]) == 5 for listing in subregion["listings"].values())
+        assert len(subregion["deals"]) == 4
+
+
+def test_client_speaks_the_coordinator_protocol(tmp_path):
+    queue = jobs.JobQueue(str(tmp_path / "jobs.db"))
+    boss = coordinator.Coordinator(queue)
+    boss.plan(["oklahoma", "texas"])
+    client = coordinator.CoordinatorClient(boss.serve())
+    try:
+        first, second = client.lease("a", 2)
+        assert client.lease("b", 2) == []
+        assert client.renew("a", [first["id"], second["id"]]) == 2
+        assert client.complete("a", first, [{"slug": "x"}], [jobs.unit("deals", "texas",
+            "austin", params={"id": 7})])
+        assert client.fail("b", second, "boom") is None
+        assert client.fail("a", second, "boom") == "pending"
+        assert client.status()["pending"] == 2
+        # Errors of the queue itself are answered too, rather than leaving the client waiting
+        queue.close()
+        with pytest.raises(requests.HTTPError, match="500"):
+            client.status()
+    finally:
+        boss.stop()
+
+
+def test_heartbeat_keeps_a_slow_unit_leased(tmp_path, monkeypatch):
+    queue = jobs.JobQueue(str(tmp_path / "jobs.db"))
+    boss = coordinator.Coordinator(queue, lease_seconds=0.3)
+    boss.plan(["oklahoma"])
+
+    def slow(unit):
+        time.sleep(1)
+        return [], []
+
+    monkeypatch.setattr(jobs, "execute", slow)
+    worker = coordinator.Worker(boss, "slow", heartbeat=0.05)
+    thread = threading.Thread(target=worker.run)
+    thread.start()
+    time.sleep(0.6)
+    # Well past lease_seconds, the unit is still held
+    assert boss.lease("thief", 1) == []
+    thread.join(timeout=10)
+    assert worker.done == 1
+    queue.close()
+
+
+def test_distribute_resumes_a_killed_local_crawl(tmp_path, server, monkeypatch):
+    monkeypatch.setattr(common, "limiter", RateLimiter(rate=1000, burst=1000, max_rate=1000))
+    monkeypatch.setattr(common, "transport", mockapi.MockTransport(server.url))
+    monkeypatch.setattr(common, "deal_planner", None)
+    path = str(tmp_path / "jobs.db")
+    queue = jobs.JobQueue(path)
+    jobs.Crawler(Controller(), queue).plan(["oklahoma"])
+    # A local crawl killed mid-unit leaves it running without a lease that could expire
+    assert queue.lease(None, None)
+    queue.close()
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    app = snooper.Snooper()
+    found = {}
+    thread = threading.Thread(target=lambda: found.update(app.distribute(["oklahoma"], 0,
+        port=port, path=path)), daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            coordinator.CoordinatorClient(url).status()
+            break
+        except requests.ConnectionError:
+            time.sleep(0.05)
+    worker = threading.Thread(target=snooper.cli,
+        args=(["worker", url, "--name", "remote", "--batch", "3"],), daemon=True)
+    worker.start()
+    worker.join(timeout=30)
+    thread.join(timeout=30)
+    assert not worker.is_alive() and not thread.is_alive()
+    assert found["finished"] and found["done"] == 1 + 3 * 2 + 36
+    assert len(app.data_lib["oklahoma"]) == 3
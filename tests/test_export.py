@@ -0,0 +1,87 @@
+import json
+import pandas as pd
+import pyarrow.parquet as pq
+import snooper
+from lib import export
+
+
+def menu_frame(prices, listing):
+    return pd.DataFrame({
+        "id": range(len(prices)),
+        "slug": [f"item-{i}" for i in range(len(prices))],
+        "category.name": ["Flower"] * len(prices),
+        "price.price": prices,
+        "price.quantity": ["1"] * len(prices),
+        "is_endorsed": [True] * len(prices),
+        "created_at": ["2023-01-01T00:00:00Z"] * len(prices),
+        "listing": [listing] * len(prices),
+    })
+
+
+def test_partitions_append_and_push_down(tmp_path):
+    root = str(tmp_path)
+    export.write_partition(menu_frame([10, 40], "a"), root, "menus", "oklahoma", "norman",
+        "2026-10-15")
+    first = (tmp_path / "menus" / "region=oklahoma" / "subregion=norman" /
+        "crawl_date=2026-10-15" / "part-0.parquet")
+    written = first.stat().st_mtime_ns
+    export.write_partition(menu_frame([20, 25, 50], "b"), root, "menus", "oklahoma", "norman",
+        "2026-10-16")
+    export.write_partition(menu_frame([5], "c"), root, "menus", "oklahoma", "tulsa",
+        "2026-10-16")
+    assert first.stat().st_mtime_ns == written
+
+    frame = export.read_table(root, "menus", columns=["listing", "price.price", "crawl_date"],
+        filters=[("subregion", "=", "norman"), ("price.price", "<", 30)])
+    assert sorted(frame["price.price"]) == [10, 20, 25]
+    assert list(frame.columns) == ["listing", "price.price", "crawl_date"]
+
+    frame = export.read_table(root, "menus")
+    assert len(frame) == 6
+    assert frame["price.quantity"].dtype == "float64"
+    assert frame["is_endorsed"].dtype == "bool"
+    assert str(frame["created_at"].dtype) == "datetime64[us, UTC]"
+
+
+def test_write_partitions_by_subregion_column(tmp_path):
+    deals = pd.DataFrame({"id": [1, 2, 3], "listing.region.slug": ["norman", "tulsa", "norman"],
+        "title": ["a", "b", "c"]})
+    paths = export.write_partitions(deals, str(tmp_path), "deals", "oklahoma",
+        "listing.region.slug", "2026-10-16")
+    assert len(paths) == 2
+    frame = export.read_table(str(tmp_path), "deals", filters=[("subregion", "=", "norman")])
+    assert sorted(frame["id"]) == [1, 3]
+
+
+def test_chunked_writers_and_streaming_export(tmp_path, capsys):
+    chunks = [menu_frame([10, 40], "a").assign(region="oklahoma", subregion="norman"),
+        menu_frame([5], "c").assign(region="oklahoma", subregion="tulsa")]
+    path = str(tmp_path / "menus.csv")
+    assert export.write_csv_chunks(iter(chunks), path) == 3
+    frame = pd.read_csv(path, index_col=0)
+    assert list(frame.index) == [0, 1, 2] and list(frame["listing"]) == ["a", "a", "c"]
+
+    path = str(tmp_path / "menus.parquet")
+    assert export.write_parquet_chunks(iter(chunks), path, "menus") == 3
+    assert pq.ParquetFile(path).num_row_groups == 2
+    frame = pd.read_parquet(path)
+    assert list(frame["subregion"]) == ["norman", "norman", "tulsa"]
+    assert frame["price.quantity"].dtype == "float64"
+
+    library = {"oklahoma": {slug: {"slug": slug, "region": "oklahoma", "listings": {
+        f"{slug}-shop": {"id": 1, "slug": f"{slug}-shop", "menu": {f"item-{i}": {"id": i,
+            "slug": f"item-{i}", "price": {"price": i}} for i in range(5)}}}}
+        for slug in ("norman", "tulsa")}}
+    data = str(tmp_path / "export.json")
+    with open(data, "w", encoding="utf8") as out_file:
+        json.dump(library, out_file)
+    output = str(tmp_path / "stream")
+    command = ["export", "--input", data, "--output", output, "--format", "parquet",
+        "--chunk-rows", "3"]
+    assert snooper.cli(command) == 0
+    assert "menus: 10 rows" in capsys.readouterr().out
+    frame = pd.read_parquet(f"{output}/menus.parquet")
+    assert len(frame) == 10 and list(frame["subregion"].unique()) == ["norman", "tulsa"]
+    assert pq.ParquetFile(f"{output}/menus.parquet").num_row_groups == 4
+    assert snooper.cli(command) == 0
+    assert "3 unchanged skipped" in capsys.readouterr().out
@@ -0,0 +1,110 @@
+import copy
+from lib import actors
+from lib import common
+from lib.history import HistoryStore, content_hash, timestamp
+
+
+def crawl(prices, deals=("half-off",), open_now=True):
+    menu = {slug: {"id": len(slug), "slug": slug, "name": slug.title(),
+        "price": {"price": price, "unit": "g", "label": None, "quantity": 1}}
+        for slug, price in prices.items()}
+    listing = {"slug": "a-shop", "id": 1, "region": "oklahoma", "subregion": "norman",
+        "open_now": open_now, "menu": menu}
+    return {"oklahoma": {"norman": {"slug": "norman", "region": "oklahoma",
+        "listings": {"a-shop": listing},
+        "deals": {slug: {"id": 9, "slug": slug, "title": slug} for slug in deals}}}}
+
+
+def test_only_changes_are_stored_and_past_states_rebuild(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.db"))
+    first = crawl({"kush": 25.0, "haze": 40.0, "gummy": 12.5})
+    assert store.record(first, "2024-01-01T00:00:00") == \
+        {"written": 5, "unchanged": 0, "removed": 0}
+    # Only the price of haze changes; open_now flipping is not a change
+    second = crawl({"kush": 25.0, "haze": 35.0, "gummy": 12.5}, open_now=False)
+    assert store.record(second, "2024-01-02T00:00:00") == \
+        {"written": 1, "unchanged": 4, "removed": 0}
+    third = crawl({"kush": 25.0, "haze": 35.0}, deals=())
+    assert store.record(third, "2024-01-03T00:00:00") == \
+        {"written": 0, "unchanged": 3, "removed": 2}
+    assert store.report()["versions"] == 5 + 1 + 2
+
+    def expected(data_lib):
+        data_lib = copy.deepcopy(data_lib)
+        del data_lib["oklahoma"]["norman"]["listings"]["a-shop"]["open_now"]
+        return data_lib
+
+    assert store.state_at("2024-01-01T12:00:00") == expected(first)
+    assert store.state_at("2024-01-02T00:00:00") == expected(second)
+    state = store.state_at()
+    assert sorted(state["oklahoma"]["norman"]["listings"]["a-shop"]["menu"]) == ["haze", "kush"]
+    assert state["oklahoma"]["norman"].get("deals") is None
+    assert store.state_at("2023-12-31") == {}
+
+    history = store.price_history("a-shop", "haze")
+    assert list(history["price.price"]) == [40.0, 35.0]
+    assert list(history["crawled_at"]) == ["2024-01-01T00:00:00.000000Z",
+        "2024-01-02T00:00:00.000000Z"]
+    menu = store.price_history("a-shop")
+    assert len(menu) == 5
+    assert menu[menu["slug"] == "gummy"]["price.price"].isna().tolist() == [False, True]
+    store.close()
+
+
+def test_crawls_within_one_second_keep_their_own_versions(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.db"))
+    store.record(crawl({"kush": 25.0}), "2024-01-01T00:00:00.100")
+    store.record(crawl({"kush": 20.0}), "2024-01-01T00:00:00.600")
+    assert list(store.price_history("a-shop", "kush")["price.price"]) == [25.0, 20.0]
+    store.close()
+
+
+def test_removed_listing_takes_its_menu(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.db"))
+    store.record(crawl({"kush": 25.0}), "2024-01-01")
+    store.begin("2024-01-02")
+    store.on_listings("oklahoma", "norman", [])
+    assert store.state_at() == {"oklahoma": {"norman": {"slug": "norman",
+        "region": "oklahoma", "deals": {"half-off": {"id": 9, "slug": "half-off",
+        "title": "half-off"}}}}}
+    store.close()
+
+
+def test_hash_and_timestamp_are_stable():
+    assert content_hash("menu", {"a": 1, "b": 2}) == content_hash("menu", {"b": 2, "a": 1})
+    assert content_hash("listing", {"slug": "x", "open_now": True}) == \
+        content_hash("listing", {"slug": "x", "open_now": False})
+    assert timestamp("2024-01-02T03:04:05+02:00") == "2024-01-02T01:04:05.000000Z"
+    assert timestamp("2024-01-02T03:04:05.25") > timestamp("2024-01-02T03:04:05")
+
+
+def test_deals_of_failed_queries_are_not_recorded_as_removed(tmp_path, monkeypatch):
+    store = HistoryStore(str(tmp_path / "history.db"))
+    store.record(crawl({"kush": 25.0}, deals=("half-off", "bogo")), "2024-01-01")
+
+    class Controller:
+        def __init__(self):
+            self.data_lib = {"oklahoma": {"norman": {"slug": "norman", "id": 1,
+                "deals": {"half-off": {}}}, "tulsa": {"slug": "tulsa", "id": 2}}}
+            self.Regions = actors.WMRegions(self)
+            self.SubRegions = actors.WMSubRegions(self)
+
+        def notify(self, event, *args):
+            getattr(store, f"on_{event}")(*args)
+
+    def get_deals(subregion):
+        if subregion['slug'] == "norman":
+            raise common.RequestError("timed out")
+        return [{"id": 7, "slug": "tulsa-deal", "listing": {"region": {"slug": "tulsa"}}}]
+
+    controller = Controller()
+    monkeypatch.setattr(controller.Regions.SubRegions, "get_deals", get_deals)
+    monkeypatch.setattr(common, "deal_planner", None)
+    store.begin("2024-01-02")
+    assert controller.Regions.fetch_deals("oklahoma") == 1
+    state = store.state_at()
+    assert sorted(state["oklahoma"]["norman"]["deals"]) == ["bogo", "half-off"]
+    assert list(state["oklahoma"]["tulsa"]["deals"]) == ["tulsa-deal"]
+    # The failed subregion keeps the deals it had
+    assert list(controller.data_lib["oklahoma"]["norman"]["deals"]) == ["half-off"]
+    store.close()
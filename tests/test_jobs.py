@@ -0,0 +1,147 @@
+import pytest
+from lib import actors
+from lib import common
+from lib import jobs
+from lib import mockapi
+from lib.metrics import Metrics
+from lib.ratelimit import RateLimiter
+
+
+class Controller:
+    def __init__(self):
+        self.data_lib = {}
+        self.Regions = actors.WMRegions(self)
+        self.SubRegions = actors.WMSubRegions(self)
+        self.sinks = []
+
+    def notify(self, event, *args):
+        pass
+
+
+class Killed(BaseException):
+    """Stands in for the process being killed mid-request."""
+
+
+class CountingTransport(mockapi.MockTransport):
+    def __init__(self, base_url, kill_after=None):
+        super().__init__(base_url)
+        self.calls = 0
+        self.kill_after = kill_after
+
+    def get(self, url, headers=None):
+        self.calls += 1
+        if self.calls == self.kill_after:
+            raise Killed()
+        return super().get(url, headers)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(common, "limiter", RateLimiter(rate=1000, burst=1000, max_rate=1000))
+    monkeypatch.setattr(common, "retry_backoff", 0)
+    with mockapi.MockWeedMaps(subregions=2, listings=101, items=5, deals=3) as mock:
+        yield mock
+
+
+def crawl(path, transport, monkeypatch, resume=False):
+    monkeypatch.setattr(common, "transport", transport)
+    controller = Controller()
+    queue = jobs.JobQueue(path)
+    crawler = jobs.Crawler(controller, queue)
+    if not resume:
+        crawler.plan(["oklahoma"])
+    try:
+        counts = crawler.run(workers=4)
+        crawler.assemble()
+    finally:
+        queue.close()
+    return controller, counts
+
+
+def test_resume_after_kill_refetches_nothing(tmp_path, server, monkeypatch):
+    reference = Controller()
+    monkeypatch.setattr(common, "transport", mockapi.MockTransport(server.url))
+    reference.Regions.get_subregions("oklahoma")
+    reference.Regions.get_listings()
+    reference.Regions.get_menus()
+    reference.Regions.get_deals()
+
+    path = str(tmp_path / "jobs.db")
+    killed = CountingTransport(server.url, kill_after=120)
+    with pytest.raises(Killed):
+        crawl(path, killed, monkeypatch)
+    resumed = CountingTransport(server.url)
+    controller, counts = crawl(path, resumed, monkeypatch, resume=True)
+
+    # 1 subregions + 2 x (2 listing pages + 1 deal page) + 202 menus
+    units = 1 + 2 * 3 + 202
+    assert counts == {"pending": 0, "running": 0, "done": units, "failed": 0}
+    # Only units that were in flight when the crawl was killed are fetched twice
+    assert units <= killed.calls - 1 + resumed.calls <= units + 4
+    assert controller.data_lib == reference.data_lib
+
+
+def test_jobs_crawl_counts_ingested_items_like_the_actors(tmp_path, server, monkeypatch):
+    monkeypatch.setattr(common, "metrics", Metrics())
+    monkeypatch.setattr(common, "transport", mockapi.MockTransport(server.url))
+    reference = Controller()
+    reference.Regions.get_subregions("oklahoma")
+    reference.Regions.get_listings()
+    reference.Regions.get_menus()
+    reference.Regions.get_deals()
+    expected = common.metrics.report()["items"]
+
+    monkeypatch.setattr(common, "metrics", Metrics())
+    crawl(str(tmp_path / "jobs.db"), mockapi.MockTransport(server.url), monkeypatch)
+    assert expected["menu_items"] == 2 * 101 * 5
+    assert common.metrics.report()["items"] == expected
+
+
+def test_malformed_units_are_retried_then_failed(tmp_path, server, monkeypatch):
+    def get_request(url):
+        if "menu_items" in url and "shop-007" in url:
+            return {"data": {}}
+        return common.transport.get(url).json()
+
+    monkeypatch.setattr(common, "get_request", get_request)
+    controller, counts = crawl(str(tmp_path / "jobs.db"), mockapi.MockTransport(server.url),
+        monkeypatch)
+    assert counts["failed"] == 2
+    listings = controller.data_lib["oklahoma"]["oklahoma-000"]["listings"]
+    assert "menu" not in listings["oklahoma-000-shop-007"]
+    assert len(listings["oklahoma-000-shop-008"]["menu"]) == 5
+
+    queue = jobs.JobQueue(str(tmp_path / "jobs.db"))
+    assert queue.retry_failed() == 2
+    queue.close()
+
+
+def test_partly_failed_menus_keep_their_previous_data(tmp_path, monkeypatch):
+    monkeypatch.setattr(common, "limiter", RateLimiter(rate=1000, burst=1000, max_rate=1000))
+    monkeypatch.setattr(common, "retry_backoff", 0)
+
+    def get_request(url):
+        # The second of the two menu pages of one listing never comes back
+        if "menu_items" in url and "oklahoma-000-shop-001" in url and url.endswith("page=2"):
+            raise common.RequestError("timed out")
+        return common.transport.get(url).json()
+
+    monkeypatch.setattr(common, "get_request", get_request)
+    with mockapi.MockWeedMaps(subregions=1, listings=2, items=150, deals=1) as server:
+        monkeypatch.setattr(common, "transport", mockapi.MockTransport(server.url))
+        controller = Controller()
+        events = []
+        controller.notify = lambda event, *args: events.append((event,) + args[:3])
+        queue = jobs.JobQueue(str(tmp_path / "jobs.db"))
+        crawler = jobs.Crawler(controller, queue)
+        crawler.plan(["oklahoma"])
+        counts = crawler.run(workers=2)
+        crawler.assemble()
+        queue.close()
+    assert counts["failed"] == 1
+    listings = controller.data_lib["oklahoma"]["oklahoma-000"]["listings"]
+    assert len(listings["oklahoma-000-shop-000"]["menu"]) == 150
+    assert "menu" not in listings["oklahoma-000-shop-001"]
+    assert "menu_fingerprint" not in listings["oklahoma-000-shop-001"]
+    menus = [event[3] for event in events if event[0] == "menu"]
+    assert menus == ["oklahoma-000-shop-000"]
@@ -0,0 +1,68 @@
+import json
+import os
+import snooper
+from lib import util
+from lib.manifest import ExportManifest
+
+
+def data_lib():
+    library = {"oklahoma": {}}
+    for slug in ("norman", "tulsa"):
+        menu = {f"item-{i}": {"id": i, "slug": f"item-{i}", "name": f"Item {i}",
+            "price": {"price": 10.0 + i, "unit": "g"}} for i in range(5)}
+        library["oklahoma"][slug] = {"slug": slug, "region": "oklahoma",
+            "listings": {f"{slug}-shop": {"id": 1, "slug": f"{slug}-shop", "menu": menu}},
+            "deals": {"deal-1": {"id": 1, "slug": "deal-1", "title": "t"}}}
+    return library
+
+
+def mtimes(root):
+    return {os.path.join(path, name): os.stat(os.path.join(path, name)).st_mtime_ns
+        for path, _, names in os.walk(root) for name in names}
+
+
+def test_unchanged_partitions_are_not_rebuilt(tmp_path):
+    root = str(tmp_path)
+    library = data_lib()
+    manifest = ExportManifest(os.path.join(root, ".manifest.json"))
+    util.build_frames(library, workers=1, root=root, crawl_date="2026-10-17",
+        export_manifest=manifest)
+    manifest.save()
+    assert manifest.report()["written"] == 6
+    before = mtimes(root)
+
+    library["oklahoma"]["tulsa"]["listings"]["tulsa-shop"]["menu"]["item-0"]["price"]["price"] = 1
+    manifest = ExportManifest(os.path.join(root, ".manifest.json"))
+    paths = util.build_frames(library, workers=1, root=root, crawl_date="2026-10-17",
+        export_manifest=manifest)
+    report = manifest.report()
+    assert report["written"] == 1 and report["skipped"] == 5
+    assert report["bytes_saved"] == sum(os.path.getsize(path) for table in paths
+        for path in paths[table] if "subregion=tulsa" not in path or table != "menus")
+    changed = [path for path, mtime in mtimes(root).items() if before.get(path) != mtime]
+    assert len(changed) == 1 and "menus" in changed[0] and "subregion=tulsa" in changed[0]
+    # Nothing half written is left behind
+    assert not [path for path in mtimes(root) if path.endswith(".tmp")]
+
+
+def test_export_command_skips_unchanged_csvs(tmp_path, capsys):
+    data = str(tmp_path / "export.json")
+    output = str(tmp_path / "csv")
+    library = data_lib()
+    with open(data, "w", encoding="utf8") as out_file:
+        json.dump(library, out_file)
+    command = ["export", "--input", data, "--output", output, "--workers", "1"]
+    assert snooper.cli(command) == 0
+    assert "Export: 3 files written" in capsys.readouterr().out
+    assert snooper.cli(command) == 0
+    assert "3 unchanged skipped" in capsys.readouterr().out
+
+    library["oklahoma"]["norman"]["deals"]["deal-2"] = {"id": 2, "slug": "deal-2", "title": "u"}
+    with open(data, "w", encoding="utf8") as out_file:
+        json.dump(library, out_file)
+    assert snooper.cli(command) == 0
+    out = capsys.readouterr().out
+    assert "deals: 3 rows" in out
+    assert "Export: 1 files written" in out and "2 unchanged skipped" in out
+    assert snooper.cli(command + ["--full"]) == 0
+    assert "Export: 3 files written" in capsys.readouterr().out
@@ -0,0 +1,77 @@
+import json
+import pytest
+from lib import common
+from lib.metrics import Metrics
+from lib.ratelimit import RateLimiter
+from lib.transport import TransportError
+
+MENU_URL = common.url_construct(common.url_library['menu']['url'], "some-listing", 1)
+
+
+class Response:
+    def __init__(self, status_code=200, body='{"data": {}}', headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.content = body.encode()
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class ScriptedTransport:
+    def __init__(self, *script):
+        self.script = list(script)
+
+    def get(self, url, headers=None):
+        step = self.script.pop(0)
+        if isinstance(step, Exception):
+            raise step
+        return step
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    monkeypatch.setattr(common, "limiter", RateLimiter(rate=1000, burst=1000, max_rate=1000))
+    monkeypatch.setattr(common, "retry_backoff", 0)
+    monkeypatch.setattr(common, "metrics", Metrics())
+    return common.metrics
+
+
+def test_get_request_records_attempts_per_endpoint(metrics, monkeypatch):
+    monkeypatch.setattr(common, "transport", ScriptedTransport(TransportError("reset"),
+        Response(429, headers={"Retry-After": "0"}), Response()))
+    common.get_request(MENU_URL)
+    monkeypatch.setattr(common, "transport", ScriptedTransport(Response(body="{}")))
+    common.get_request("http://example.test")
+
+    report = metrics.report()
+    menu = report["endpoints"]["menu"]
+    assert menu["requests"] == 3
+    assert menu["retries"] == 2
+    assert menu["statuses"] == {"200": 1, "429": 1, "error": 1}
+    assert menu["bytes"] == 2 * len('{"data": {}}')
+    assert report["endpoints"]["other"]["requests"] == 1
+
+
+def test_get_request_records_failures(metrics, monkeypatch):
+    monkeypatch.setattr(common, "transport",
+        ScriptedTransport(*[TransportError("refused")] * (common.request_retries + 1)))
+    with pytest.raises(common.RequestError):
+        common.get_request(MENU_URL)
+    assert metrics.report()["endpoints"]["menu"]["failures"] == 1
+
+
+def test_prometheus_textfile(tmp_path):
+    metrics = Metrics()
+    for seconds in (0.003, 0.02, 0.2, 40):
+        metrics.observe("listings", seconds, 200, 10)
+    metrics.ingested("menu_items", 150)
+    metrics.write_textfile(str(tmp_path / "snooper.prom"))
+    text = (tmp_path / "snooper.prom").read_text()
+    assert 'snooper_request_duration_seconds_bucket{endpoint="listings",le="0.005"} 1' in text
+    assert 'snooper_request_duration_seconds_bucket{endpoint="listings",le="0.25"} 3' in text
+    assert 'snooper_request_duration_seconds_bucket{endpoint="listings",le="+Inf"} 4' in text
+    assert 'snooper_response_bytes_total{endpoint="listings"} 40' in text
+    assert 'snooper_items_total{kind="menu_items"} 150' in text
+    latency = metrics.report()["endpoints"]["listings"]["latency"]
+    assert latency["p50"] == 0.025 and latency["max"] == 40
@@ -0,0 +1,70 @@
+import pytest
+from lib import actors
+from lib import common
+from lib import mockapi
+from lib import util
+from lib.ratelimit import RateLimiter
+
+
+class Controller:
+    def __init__(self):
+        self.data_lib = {}
+        self.Regions = actors.WMRegions(self)
+        self.SubRegions = actors.WMSubRegions(self)
+        self.sinks = []
+
+    def notify(self, event, *args):
+        pass
+
+
+@pytest.fixture
+def fast(monkeypatch):
+    monkeypatch.setattr(common, "limiter", RateLimiter(rate=1000, burst=1000, max_rate=1000))
+    monkeypatch.setattr(common, "retry_backoff", 0)
+
+
+def crawl(server, monkeypatch):
+    monkeypatch.setattr(common, "transport", mockapi.MockTransport(server.url))
+    controller = Controller()
+    controller.Regions.get_subregions("oklahoma")
+    controller.Regions.get_listings()
+    controller.Regions.get_menus(concurrent=True)
+    controller.Regions.get_deals()
+    return controller.data_lib["oklahoma"]
+
+
+def count(subregions):
+    counts = {"listings": 0, "menu_items": 0, "deals": 0}
+    for subregion in subregions.values():
+        frames = util.subregion_frames(subregion)
+        counts["listings"] += len(frames["listings"])
+        counts["menu_items"] += len(frames["menus"])
+        counts["deals"] += len(frames["deals"])
+    return counts
+
+
+def test_crawl_against_mock_server(fast, monkeypatch):
+    with mockapi.MockWeedMaps(subregions=2, listings=101, items=101, deals=105) as server:
+        subregions = crawl(server, monkeypatch)
+    expected = server.expected()
+    assert len(subregions) == expected.pop("subregions")
+    assert count(subregions) == expected
+    listing = subregions["oklahoma-001"]["listings"]["oklahoma-001-shop-100"]
+    assert listing["menu"]["oklahoma-001-shop-100-item-0100"]["price"]["unit"] in mockapi._units
+    # 1 subregions + 2 x (2 listing pages + 2 deal pages) + 202 x 2 menu pages
+    assert server.stats["requests"] == 1 + 2 * 4 + 202 * 2
+
+
+def test_crawl_recovers_from_injected_faults(fast, monkeypatch):
+    with mockapi.MockWeedMaps(subregions=2, listings=10, items=30, deals=5,
+        error_rate=0.1, throttle_rate=0.1, seed=4) as server:
+        subregions = crawl(server, monkeypatch)
+    assert server.stats["errors"] and server.stats["throttled"]
+    expected = server.expected()
+    del expected["subregions"]
+    assert count(subregions) == expected
+
+
+def test_unknown_paths_are_not_found():
+    server = mockapi.MockWeedMaps()
+    assert server.respond("/nowhere")[0] == 404
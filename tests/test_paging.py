@@ -0,0 +1,72 @@
+import threading
+import time
+from lib import common
+from lib import paging
+
+
+def fake_pages(total, page_size=10, latency=0.0, report_total=True, pages=None):
+    """Returns a get_request replacement serving items 0..total-1 by page index urls."""
+    def get_request(url):
+        time.sleep(latency)
+        index = int(url)
+        if pages is not None:
+            items = pages[index] if index < len(pages) else []
+        else:
+            items = [{"slug": f"item-{i}"} for i in
+                range(index * page_size, min((index + 1) * page_size, total))]
+        meta = {"total": total} if report_total else {}
+        return {"meta": meta, "items": items}
+    return get_request
+
+
+def fetch(**kwargs):
+    return paging.fetch_pages(str, lambda rest_return: rest_return["items"],
+        lambda rest_return: rest_return["meta"].get("total"), page_size=10, **kwargs)
+
+
+def test_pages_are_reassembled_in_order(monkeypatch):
+    monkeypatch.setattr(common, "get_request", fake_pages(95, latency=0.01))
+    items, report = fetch(workers=4)
+    assert [item["slug"] for item in items] == [f"item-{i}" for i in range(95)]
+    assert report == {"pages": 10, "short": 0, "duplicates": 0, "missing": 0}
+
+
+def test_pages_are_fetched_concurrently(monkeypatch):
+    active = []
+    peak = []
+    lock = threading.Lock()
+    serve = fake_pages(80, latency=0.02)
+
+    def get_request(url):
+        with lock:
+            active.append(url)
+            peak.append(len(active))
+        try:
+            return serve(url)
+        finally:
+            with lock:
+                active.remove(url)
+
+    monkeypatch.setattr(common, "get_request", get_request)
+    items, _ = fetch(workers=4)
+    assert len(items) == 80
+    assert max(peak) > 1
+
+
+def test_unknown_total_pages_until_short_page(monkeypatch):
+    monkeypatch.setattr(common, "get_request", fake_pages(25, report_total=False))
+    items, report = fetch()
+    assert len(items) == 25
+    assert report["pages"] == 3
+
+
+def test_duplicates_and_short_pages_are_reported(monkeypatch):
+    pages = [[{"slug": f"item-{i}"} for i in range(10)],
+        [{"slug": f"item-{i}"} for i in range(9, 15)],
+        [{"slug": f"item-{i}"} for i in range(20, 30)]]
+    monkeypatch.setattr(common, "get_request", fake_pages(30, pages=pages))
+    items, report = fetch()
+    assert len(items) == 25
+    assert report["duplicates"] == 1
+    assert report["short"] == 1
+    assert report["missing"] == 5
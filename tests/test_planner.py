@@ -0,0 +1,117 @@
+import threading
+import pytest
+from lib import actors
+from lib import common
+from lib import jobs
+from lib import mockapi
+from lib.metrics import Metrics
+from lib.planner import DealPlanner, SingleFlight
+from lib.ratelimit import RateLimiter
+
+
+class Controller:
+    def __init__(self):
+        self.data_lib = {}
+        self.Regions = actors.WMRegions(self)
+        self.SubRegions = actors.WMSubRegions(self)
+        self.sinks = []
+
+    def notify(self, event, *args):
+        pass
+
+
+class MetroWeedMaps(mockapi.MockWeedMaps):
+    """The deals query of a region's first subregion also returns every other subregion's."""
+    def _deals(self, query, *rest):
+        body, count = super()._deals(query, *rest)
+        subregion_id = int(query.get("filter[region_id]", 0))
+        if subregion_id and (subregion_id - 1) % 10000 == 0:
+            for other in range(subregion_id + 1, subregion_id + self.subregions):
+                more, found = super()._deals(dict(query, **{"filter[region_id]": str(other)}))
+                body["data"]["deals"] += more["data"]["deals"]
+                count += found
+            body["meta"]["total_deals"] = len(body["data"]["deals"])
+        return body, count
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(common, "limiter", RateLimiter(rate=1000, burst=1000, max_rate=1000))
+    monkeypatch.setattr(common, "retry_backoff", 0)
+    monkeypatch.setattr(common, "metrics", Metrics())
+    monkeypatch.setattr(common, "deal_planner", None)
+    with MetroWeedMaps(subregions=4, listings=2, items=2, deals=3, latency=0.1) as mock:
+        monkeypatch.setattr(common, "transport", mockapi.MockTransport(mock.url))
+        yield mock
+
+
+def test_identical_requests_in_flight_are_made_once(server):
+    url = common.url_construct(common.url_library['subregions']['url'], "oklahoma")
+    start = threading.Barrier(6)
+    bodies = []
+
+    def get():
+        start.wait()
+        bodies.append(common.get_request(url))
+
+    threads = [threading.Thread(target=get) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert server.stats["requests"] == 1
+    assert all(body == bodies[0] for body in bodies)
+    # Every caller owns its copy
+    assert len({id(body) for body in bodies}) == 6
+    assert common.metrics.report()["endpoints"]["subregions"]["coalesced"] == 5
+
+    flights = SingleFlight()
+    with pytest.raises(KeyError):
+        flights.do("key", lambda: {}["missing"])
+    assert flights.do("key", lambda: 1) == (1, False)
+
+
+def deals_of(controller):
+    return {slug: sorted(subregion['deals'])
+        for slug, subregion in controller.data_lib["oklahoma"].items()}
+
+
+def test_redundant_deal_queries_are_learned_and_skipped(tmp_path, server, monkeypatch):
+    path = str(tmp_path / "deal_plan.json")
+    monkeypatch.setattr(common, "deal_planner", DealPlanner(path, confirm=2, verify_every=4))
+    controller = Controller()
+    controller.Regions.get_subregions("oklahoma")
+    expected = None
+    requests = []
+    for _ in range(5):
+        before = server.stats["requests"]
+        assert controller.Regions.fetch_deals("oklahoma") == 12
+        requests.append(server.stats["requests"] - before)
+        expected = expected or deals_of(controller)
+        assert deals_of(controller) == expected
+    # Two runs to learn, two runs of only the first query, then every query to verify
+    assert requests == [4, 4, 1, 1, 4]
+    report = common.deal_planner.report()
+    assert report["skipped"] == 6
+    assert report["requests_saved"] == 6
+    assert report["skipping"] == {"oklahoma": ["oklahoma-001", "oklahoma-002", "oklahoma-003"]}
+
+    # The plan survives a restart, and the job queue crawl follows it too
+    monkeypatch.setattr(common, "deal_planner", DealPlanner(path, confirm=2, verify_every=4))
+    crawled = Controller()
+    queue = jobs.JobQueue(str(tmp_path / "jobs.db"))
+    crawler = jobs.Crawler(crawled, queue)
+    crawler.plan(["oklahoma"])
+    # The skips are planned once; executing the unit again, as a retry would, plans nothing
+    planned = common.deal_planner.report()
+    assert planned["skipped"] == 3
+    work = queue.lease("retry", 60)[0]
+    assert work["params"]["skip_deals"] == ["oklahoma-001", "oklahoma-002", "oklahoma-003"]
+    assert len(jobs.execute(work)[1]) == 4 + 1
+    assert common.deal_planner.report() == planned
+    # run() requeues the unit left running, as it would after a kill
+    crawler.run(workers=4)
+    crawler.assemble()
+    queue.close()
+    assert deals_of(crawled) == expected
+    assert common.deal_planner.report()["skipped"] == 3
@@ -0,0 +1,45 @@
+from time import monotonic
+from lib.ratelimit import RateLimiter, parse_retry_after
+
+
+def test_burst_then_steady_rate():
+    limiter = RateLimiter(rate=20, burst=3, max_rate=20)
+    start = monotonic()
+    for _ in range(3):
+        limiter.acquire()
+    assert monotonic() - start < 0.05
+    for _ in range(4):
+        limiter.acquire()
+    assert monotonic() - start >= 0.15
+    assert limiter.report()["requests"] == 7
+
+
+def test_throttling_slows_down_and_honors_retry_after():
+    limiter = RateLimiter(rate=4, burst=1, min_rate=1, max_rate=4)
+    assert limiter.feedback(429, "0.2")
+    assert limiter.current_rate == 2
+    start = monotonic()
+    limiter.acquire()
+    assert monotonic() - start >= 0.2
+    limiter.feedback(503)
+    limiter.feedback(503)
+    assert limiter.current_rate == 1
+    assert limiter.report()["throttled"] == 3
+
+
+def test_healthy_responses_speed_up_to_max():
+    limiter = RateLimiter(rate=1, max_rate=1.2, increase=0.1)
+    assert not limiter.feedback(200)
+    assert limiter.current_rate == 1.1
+    for _ in range(5):
+        limiter.feedback(200)
+    assert limiter.current_rate == 1.2
+    limiter.feedback(404)
+    assert limiter.current_rate == 1.2
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
@@ -0,0 +1,38 @@
+import json
+import pickle
+import pandas as pd
+from lib import records
+
+
+def raw_item(slug, category="Flower"):
+    return {"id": 7, "slug": slug, "name": slug.title(), "description": "long " * 50,
+        "category": {"name": category, "id": 1}, "price": {"price": 25.0, "unit": "g"},
+        "images": [{"url": "x"}]}
+
+
+def test_menu_item_projection():
+    item = records.project("menu", raw_item("blue-dream"))
+    assert item["slug"] == "blue-dream"
+    assert item["price"] == {"price": 25.0, "unit": "g", "label": None, "quantity": None}
+    assert item.lookup("category.name") == "Flower"
+    assert "description" not in item and "listing" not in item
+    item["listing"] = "some-shop"
+    assert item.get("listing") == "some-shop"
+    assert records.project("menu", raw_item("og")).category_name is item.category_name
+    frame = pd.json_normalize([dict(item)])
+    assert frame.loc[0, "category.name"] == "Flower"
+    assert pickle.loads(pickle.dumps(item)) == item
+    assert json.loads(json.dumps(item, default=dict))["listing"] == "some-shop"
+
+
+def test_keep_raw_and_listing_extras():
+    listing = records.project("listing", {"slug": "shop", "region": "oklahoma", "extra": 1},
+        keep_raw=True)
+    assert listing["extra"] == 1
+    assert "menu" not in listing
+    listing["menu"] = {}
+    assert listing["menu"] == {}
+    assert records.lookup(listing, "slug") == "shop"
+    assert records.lookup({"a": {"b": 1}}, "a.b") == 1
+    deal = records.project("deal", {"slug": "d", "listing": {"region": {"slug": "norman"}}})
+    assert deal["listing"]["region"]["slug"] == "norman"
@@ -0,0 +1,117 @@
+import io
+from contextlib import redirect_stdout
+import pytest
+from lib import actors
+from lib import common
+from lib import mockapi
+from lib.metrics import Metrics
+from lib.ratelimit import RateLimiter
+from lib.scheduler import Scheduler
+
+BUSY = "oklahoma-000-shop-000"
+HOUR = 60 * 60
+
+
+class Controller:
+    def __init__(self):
+        self.data_lib = {}
+        self.Regions = actors.WMRegions(self)
+        self.SubRegions = actors.WMSubRegions(self)
+        self.sinks = []
+
+    def notify(self, event, *args):
+        pass
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class VolatileWeedMaps(mockapi.MockWeedMaps):
+    """The menu of BUSY reprices every hour; nothing else ever changes."""
+    def __init__(self, clock, **options):
+        super().__init__(**options)
+        self.clock = clock
+
+    def _menu_item(self, listing, index):
+        item = super()._menu_item(listing, index)
+        if listing == BUSY:
+            item["price"]["price"] += int(self.clock() // HOUR) % 7
+        return item
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def server(clock, monkeypatch):
+    monkeypatch.setattr(common, "limiter", RateLimiter(rate=10000, burst=10000, max_rate=10000))
+    monkeypatch.setattr(common, "retry_backoff", 0)
+    monkeypatch.setattr(common, "metrics", Metrics())
+    with VolatileWeedMaps(clock, subregions=1, listings=4, items=5, deals=3) as mock:
+        monkeypatch.setattr(common, "transport", mockapi.MockTransport(mock.url))
+        yield mock
+
+
+def fetches(scheduler):
+    rows = scheduler.connection.execute("SELECT endpoint, listing, fetches FROM targets")
+    return {(endpoint, listing): count for endpoint, listing, count in rows}
+
+
+def test_budget_goes_to_the_most_volatile_targets(tmp_path, server, clock):
+    controller = Controller()
+    scheduler = Scheduler(controller, str(tmp_path / "schedule.db"), budget=4, period=HOUR,
+        clock=clock, sleep=clock.sleep)
+    scheduler.add(["oklahoma"])
+    with redirect_stdout(io.StringIO()):
+        # Parents are fetched before children, then every target once
+        order = [scheduler.step()["endpoint"] for _ in range(4)]
+        assert order == ["subregions", "listings", "deals", "menu"]
+        assert scheduler.step() is None
+        assert scheduler.remaining() == 0
+        for _ in range(2 * 24):
+            before = clock.now
+            scheduler.run(duration=HOUR)
+            assert clock.now == pytest.approx(before + HOUR)
+            assert scheduler.remaining() >= 0
+    counts = fetches(scheduler)
+    quiet = [counts[("menu", f"oklahoma-000-shop-00{n}")] for n in (1, 2, 3)]
+    assert counts[("menu", BUSY)] > 1.5 * max(quiet)
+    assert counts[("deals", "")] > counts[("subregions", "")]
+    assert server.stats["requests"] <= 4 * (2 * 24 + 1)
+    report = scheduler.report()
+    assert report["menu"]["targets"] == 4
+    assert report["menu"]["changes"] == counts[("menu", BUSY)] - 1
+    assert report["deals"]["changes"] == 0
+    assert controller.data_lib["oklahoma"]["oklahoma-000"]["listings"][BUSY]["menu"]
+    scheduler.close()
+
+
+def test_restart_refetches_data_missing_from_data_lib(tmp_path, server, clock):
+    path = str(tmp_path / "schedule.db")
+    with redirect_stdout(io.StringIO()):
+        scheduler = Scheduler(Controller(), path, budget=100, clock=clock, sleep=clock.sleep)
+        scheduler.add(["oklahoma"])
+        assert scheduler.run(targets=7)["fetched"] == 7
+        # Everything was just fetched, so nothing is due yet
+        assert scheduler.step() is None
+        scheduler.close()
+
+        controller = Controller()
+        scheduler = Scheduler(controller, path, budget=100, clock=clock, sleep=clock.sleep)
+        assert scheduler.remaining() == 100 - 7
+        planned = scheduler.plan()
+        assert [(target["endpoint"], target["cost"]) for target in planned] == \
+            [("subregions", 1)]
+        assert scheduler.run(targets=7)["fetched"] == 7
+        assert len(controller.data_lib["oklahoma"]["oklahoma-000"]["deals"]) == 3
+        scheduler.close()
@@ -0,0 +1,40 @@
+import json
+from lib import shards
+
+
+def library(regions=3, subregions=4):
+    return {f"region-{r}": {f"subregion-{s}": {"slug": f"subregion-{s}", "region": f"region-{r}",
+        "listings": {"shop": {"slug": "shop", "menu": {"item": {"slug": "item"}}}}}
+        for s in range(subregions)} for r in range(regions)}
+
+
+def test_lazy_load_reads_only_touched_shards(tmp_path):
+    data_lib = library()
+    assert shards.save_shards(data_lib, str(tmp_path)) == 12
+    lazy = shards.load_shards(str(tmp_path))
+    assert sorted(lazy) == sorted(data_lib)
+    region = lazy["region-1"]
+    assert list(region) == list(data_lib["region-1"])
+    assert not any(region.is_loaded(subregion) for subregion in region)
+    assert region["subregion-2"] == data_lib["region-1"]["subregion-2"]
+    assert [region.is_loaded(subregion) for subregion in region] == [False, False, True, False]
+    assert json.loads(json.dumps(lazy, default=dict)) == data_lib
+
+
+def test_save_only_rewrites_loaded_shards(tmp_path):
+    shards.save_shards(library(), str(tmp_path))
+    lazy = shards.load_shards(str(tmp_path))
+    lazy["region-0"]["subregion-0"]["listings"]["shop"]["menu"] = {}
+    lazy["region-0"]["subregion-9"] = {"slug": "subregion-9"}
+    lazy["region-new"] = {"subregion-0": {"slug": "subregion-0"}}
+    assert shards.save_shards(lazy, str(tmp_path)) == 3
+    reloaded = shards.load_shards(str(tmp_path))
+    assert reloaded["region-0"]["subregion-0"]["listings"]["shop"]["menu"] == {}
+    assert len(reloaded["region-0"]) == 5
+    assert reloaded["region-new"]["subregion-0"] == {"slug": "subregion-0"}
+
+
+def test_parallel_full_load(tmp_path):
+    data_lib = library()
+    shards.save_shards(data_lib, str(tmp_path))
+    assert shards.load_shards(str(tmp_path), lazy=False, workers=2) == data_lib
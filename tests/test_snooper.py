@@ -1 +1,184 @@
+import re
+import time
 import pytest
+from lib import actors
+from lib import common
+from lib import records
+from lib import stream
+from lib import util
+
+
+class Controller:
+    """Minimal stand-in for the Snooper app used by the actors."""
+    def __init__(self):
+        self.data_lib = {}
+        self.Regions = actors.WMRegions(self)
+        self.SubRegions = actors.WMSubRegions(self)
+        self.sinks = []
+        self.selected_subregion = None
+
+    def notify(self, event, *args):
+        for sink in self.sinks:
+            getattr(sink, "on_" + event)(*args)
+
+
+def fake_menu_api(latency=0.0, items=150):
+    """Returns a get_request replacement serving paged menus for any listing slug."""
+    def get_request(url):
+        time.sleep(latency)
+        slug = re.search(r"dispensaries/([^/]+)/menu_items", url).group(1)
+        page = int(re.search(r"page=(\d+)", url).group(1))
+        start = (page - 1) * common.page_size
+        stop = min(start + common.page_size, items)
+        return {
+            "meta": {"total_menu_items": items},
+            "data": {"menu_items": [{"id": i, "slug": f"{slug}-item-{i}"}
+                for i in range(start, stop)]}
+        }
+    return get_request
+
+
+def seed_subregion(controller, count):
+    listings = {}
+    for i in range(count):
+        slug = f"listing-{i:02d}"
+        listings[slug] = {"slug": slug, "region": "oklahoma", "subregion": "oklahoma-city"}
+    controller.data_lib["oklahoma"] = {"oklahoma-city": {
+        "slug": "oklahoma-city", "region": "oklahoma", "listings": listings}}
+    return controller.data_lib["oklahoma"]["oklahoma-city"]
+
+
+@pytest.fixture
+def api(monkeypatch):
+    monkeypatch.setattr(common, "get_request", fake_menu_api(latency=0.02))
+
+
+def test_concurrent_menus_match_serial(api):
+    serial = Controller()
+    serial.SubRegions.get_menus(seed_subregion(serial, 6))
+    parallel = Controller()
+    parallel.Regions.get_menus(concurrent=True)
+    assert parallel.data_lib == {}
+    parallel.SubRegions.get_menus(seed_subregion(parallel, 6), concurrent=True)
+    assert parallel.data_lib == serial.data_lib
+    menu = parallel.data_lib["oklahoma"]["oklahoma-city"]["listings"]["listing-03"]["menu"]
+    assert len(menu) == 150
+    assert list(menu) == sorted(menu)
+
+
+def test_concurrent_menus_are_faster(api):
+    serial = Controller()
+    seed_subregion(serial, 8)
+    start = time.perf_counter()
+    serial.Regions.get_menus()
+    serial_time = time.perf_counter() - start
+
+    parallel = Controller()
+    seed_subregion(parallel, 8)
+    start = time.perf_counter()
+    parallel.Regions.get_menus(concurrent=True)
+    parallel_time = time.perf_counter() - start
+
+    assert parallel.data_lib == serial.data_lib
+    assert parallel_time * 3 < serial_time
+
+
+def fake_listings_api(counts, menu_api):
+    """Serves offset-paged listings whose menu_items_count comes from counts."""
+    calls = []
+    def get_request(url):
+        calls.append(common.endpoint_of(url))
+        if common.endpoint_of(url) == "menu":
+            return menu_api(url)
+        offset = int(re.search(r"offset=(\d+)", url).group(1))
+        slugs = sorted(counts)[offset:offset + common.page_size]
+        return {
+            "meta": {"total_listings": len(counts)},
+            "data": {"listings": [{"slug": slug, "menu_items_count": counts[slug]}
+                for slug in slugs]}
+        }
+    get_request.calls = calls
+    return get_request
+
+
+def test_incremental_crawl_only_refetches_changed_menus(monkeypatch):
+    counts = {f"listing-{i:02d}": 150 for i in range(5)}
+    controller = Controller()
+    subregion = seed_subregion(controller, 0)
+    api = fake_listings_api(counts, fake_menu_api())
+    monkeypatch.setattr(common, "get_request", api)
+    controller.SubRegions.get_listings(subregion, incremental=True)
+    controller.Regions.get_menus(incremental=True)
+    assert api.calls.count("menu") == 10
+
+    counts["listing-02"] = 120
+    api.calls.clear()
+    controller.SubRegions.get_listings(subregion, incremental=True)
+    controller.Regions.get_menus(concurrent=True, incremental=True)
+    assert api.calls.count("menu") == 2
+    listings = controller.data_lib["oklahoma"]["oklahoma-city"]["listings"]
+    assert all(len(listing["menu"]) == 150 for listing in listings.values())
+    delta = controller.SubRegions.Dispensaries.report_delta()
+    assert delta == {"checked": 10, "skipped": 4, "requests_avoided": 8}
+
+
+def test_merge_deals_dedupes_across_subregions():
+    controller = Controller()
+    controller.data_lib["oklahoma"] = {slug: {"slug": slug, "region": "oklahoma"}
+        for slug in ("norman", "tulsa")}
+    def deal(deal_id, slug, owner):
+        return {"id": deal_id, "slug": slug, "listing": {"region": {"slug": owner}}}
+    batches = [
+        [deal(1, "b-deal", "norman"), deal(2, "a-deal", "tulsa"), {"id": 3}],
+        [deal(2, "a-deal", "tulsa"), deal(4, "c-deal", "tulsa"), deal(5, "x", "elsewhere")],
+    ]
+    assert controller.Regions.merge_deals("oklahoma", batches) == 3
+    region = controller.data_lib["oklahoma"]
+    assert list(region["norman"]["deals"]) == ["b-deal"]
+    assert list(region["tulsa"]["deals"]) == ["a-deal", "c-deal"]
+
+
+def test_stream_round_trip(tmp_path, monkeypatch):
+    path = str(tmp_path / "crawl.ndjson")
+    counts = {f"listing-{i:02d}": 120 + i for i in range(3)}
+    controller = Controller()
+    subregion = seed_subregion(controller, 0)
+    writer = stream.RecordWriter(path)
+    controller.sinks.append(writer)
+    monkeypatch.setattr(common, "get_request", fake_listings_api(counts, fake_menu_api()))
+    controller.SubRegions.get_listings(subregion)
+    controller.Regions.get_menus()
+    writer.close()
+    assert writer.written == 3 + 3 * 150
+
+    for listing in subregion["listings"].values():
+        # Listing records are written before their menu is downloaded and fingerprinted
+        del listing["menu_fingerprint"]
+    assert stream.build_data_lib(stream.read_records(path)) == controller.data_lib
+    assert len(list(stream.read_records(path, ["listing"], "oklahoma", "tulsa"))) == 0
+
+    controller.selected_subregion = subregion
+    pandas = util.SnooperToPandas(controller)
+    monkeypatch.setattr(pandas, "menu_columns", ["id", "slug", "listing"])
+    monkeypatch.setattr(pandas, "listing_columns", ["slug", "menu_items_count", "region"])
+    assert pandas.stream_menus(path, "oklahoma").equals(pandas.subregion_menus())
+    assert pandas.stream_listings(path, subregion="oklahoma-city").equals(pandas.listings())
+
+
+def test_compact_crawl_builds_same_frames(monkeypatch):
+    counts = {f"listing-{i:02d}": 120 for i in range(3)}
+    frames = []
+    for compact in (False, True):
+        monkeypatch.setattr(common, "compact_records", compact)
+        controller = Controller()
+        subregion = seed_subregion(controller, 0)
+        monkeypatch.setattr(common, "get_request", fake_listings_api(counts, fake_menu_api()))
+        controller.SubRegions.get_listings(subregion, incremental=True)
+        controller.Regions.get_menus(incremental=True)
+        controller.selected_subregion = subregion
+        pandas = util.SnooperToPandas(controller)
+        monkeypatch.setattr(pandas, "menu_columns", ["id", "slug", "listing"])
+        frames.append(pandas.subregion_menus())
+    assert isinstance(subregion["listings"]["listing-01"]["menu"]["listing-01-item-5"],
+        records.MenuItem)
+    assert frames[0].equals(frames[1])
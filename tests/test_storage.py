@@ -0,0 +1,64 @@
+import pandas as pd
+from lib import util
+from lib.storage import SQLiteStore
+
+
+def menu_item(slug, price, category="Flower"):
+    return {"id": hash(slug) % 1000, "slug": slug, "name": slug.title(),
+        "category": {"name": category}, "price": {"price": price, "unit": "g"},
+        "is_endorsed": True, "images": [{"url": "x"}]}
+
+
+def test_store_round_trip_and_queries(tmp_path):
+    store = SQLiteStore(str(tmp_path / "snooper.db"))
+    store.on_subregions("oklahoma", [{"slug": "norman", "id": 7, "region": "oklahoma"}])
+    store.on_listings("oklahoma", "norman", [
+        {"slug": "b-shop", "id": 2, "menu_items_count": 2, "region": "oklahoma",
+            "subregion": "norman", "menu": {}},
+        {"slug": "a-shop", "id": 1, "menu_items_count": 1, "region": "oklahoma",
+            "subregion": "norman"}])
+    store.on_menu("oklahoma", "norman", "a-shop", [menu_item("kush", 25.0)])
+    store.on_menu("oklahoma", "norman", "b-shop", [menu_item("haze", 40.0),
+        menu_item("gummy", 12.5, "Edible")])
+    store.on_menu("oklahoma", "norman", "b-shop", [menu_item("haze", 35.0)])
+    store.on_deals("oklahoma", "norman", [{"id": 9, "slug": "half-off", "title": "Half off",
+        "listing": {"slug": "a-shop", "region": {"slug": "norman"}}}])
+
+    pandas = util.SnooperToPandas(None)
+    menus = pandas.sql_menus(store, region="oklahoma")
+    assert list(menus.columns) == pandas.menu_columns
+    assert list(menus["slug"]) == ["kush", "haze"]
+    assert list(menus["price.price"]) == [25.0, 35.0]
+    assert pandas.sql_menus(store, category_name="Edible").empty
+    listings = pandas.sql_listings(store, subregion="norman")
+    assert list(listings.columns) == pandas.listing_columns
+    assert list(listings["slug"]) == ["a-shop", "b-shop"]
+    deals = pandas.sql_deals(store)
+    assert list(deals.columns) == pandas.deal_columns
+    assert deals.loc[0, "listing.region.slug"] == "norman"
+
+    plan = store.select("EXPLAIN QUERY PLAN " + store.query("menu_items", listing="a-shop")[0],
+        ["a-shop"])
+    assert "USING INDEX" in str(plan)
+
+    data_lib = store.load_data_lib()
+    norman = data_lib["oklahoma"]["norman"]
+    assert list(norman["listings"]) == ["a-shop", "b-shop"]
+    assert norman["listings"]["b-shop"]["menu"]["haze"]["images"] == [{"url": "x"}]
+    assert list(norman["deals"]) == ["half-off"]
+    store.close()
+
+
+def test_load_data_lib_keeps_records_of_subregions_never_stored(tmp_path):
+    store = SQLiteStore(str(tmp_path / "snooper.db"))
+    store.on_listings("oklahoma", "norman", [{"slug": "a-shop", "id": 1, "region": "oklahoma",
+        "subregion": "norman"}])
+    store.on_menu("oklahoma", "tulsa", "t-shop", [menu_item("kush", 25.0)])
+    store.on_deals("oklahoma", "moore", [{"id": 9, "slug": "half-off", "title": "Half off",
+        "listing": {"slug": "m-shop", "region": {"slug": "moore"}}}])
+
+    data_lib = store.load_data_lib("oklahoma")
+    assert list(data_lib["oklahoma"]["norman"]["listings"]) == ["a-shop"]
+    assert list(data_lib["oklahoma"]["moore"]["deals"]) == ["half-off"]
+    assert data_lib["oklahoma"]["norman"]["slug"] == "norman"
+    store.close()
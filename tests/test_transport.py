@@ -0,0 +1,127 @@
+import json
+import threading
+import time
+import pytest
+from lib import common
+from lib import paging
+from lib.ratelimit import RateLimiter
+from lib.transport import HTTPTransport, TransportError, backoff_delay
+
+
+class Response:
+    def __init__(self, status_code=200, body=None, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.content = body.encode() if body is not None else b""
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class ScriptedTransport:
+    """Stand-in transport that replays a list of responses or exceptions."""
+    def __init__(self, *script):
+        self.script = list(script)
+        self.calls = 0
+
+    def get(self, url, headers=None):
+        self.calls += 1
+        step = self.script.pop(0)
+        if isinstance(step, Exception):
+            raise step
+        return step
+
+
+@pytest.fixture
+def fast(monkeypatch):
+    monkeypatch.setattr(common, "limiter", RateLimiter(rate=1000, burst=1000, max_rate=1000))
+    monkeypatch.setattr(common, "retry_backoff", 0)
+
+
+def test_get_request_retries_until_json(fast, monkeypatch):
+    transport = ScriptedTransport(TransportError("timed out"), Response(body="<html>"),
+        Response(503, headers={"Retry-After": "0"}), Response(body='{"data": 1}'))
+    monkeypatch.setattr(common, "transport", transport)
+    assert common.get_request("http://example.test") == {"data": 1}
+    assert transport.calls == 4
+    assert common.limiter.report()["throttled"] == 1
+
+
+def test_get_request_gives_up(fast, monkeypatch):
+    transport = ScriptedTransport(*[TransportError("refused")] * (common.request_retries + 1))
+    monkeypatch.setattr(common, "transport", transport)
+    with pytest.raises(common.RequestError):
+        common.get_request("http://example.test")
+    assert transport.calls == common.request_retries + 1
+
+
+def test_client_errors_fail_without_retrying(fast, monkeypatch):
+    for response in (Response(404, body='{"errors": []}'), Response(403, body="<html>")):
+        transport = ScriptedTransport(response)
+        monkeypatch.setattr(common, "transport", transport)
+        with pytest.raises(common.RequestError, match=str(response.status_code)):
+            common.get_request("http://example.test")
+        assert transport.calls == 1
+
+
+def test_requests_in_flight_are_capped_across_nested_pools(fast, monkeypatch):
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    class SlowTransport:
+        def get(self, url, headers=None):
+            with lock:
+                active.append(url)
+                peak.append(len(active))
+            time.sleep(0.01)
+            with lock:
+                active.remove(url)
+            return Response(body=json.dumps({"total": 40,
+                "items": [{"slug": f"{url}-{i}"} for i in range(10)]}))
+
+    monkeypatch.setattr(common, "transport", SlowTransport())
+    monkeypatch.setattr(common, "in_flight", threading.BoundedSemaphore(3))
+
+    def menu(listing):
+        return paging.fetch_pages(lambda index: f"http://example.test/{listing}/{index}",
+            lambda body: body["items"], lambda body: body["total"], page_size=10, workers=4)
+
+    threads = [threading.Thread(target=menu, args=(listing,)) for listing in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(peak) == 24 and max(peak) == 3
+
+
+def test_concurrent_first_requests_share_one_transport(monkeypatch):
+    built = []
+
+    class SlowTransport:
+        def __init__(self, pool_size, timeout):
+            time.sleep(0.05)
+            built.append(self)
+
+    monkeypatch.setattr(common, "HTTPTransport", SlowTransport)
+    monkeypatch.setattr(common, "transport", None)
+    found = []
+    threads = [threading.Thread(target=lambda: found.append(common._transport()))
+        for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(built) == 1 and all(transport is built[0] for transport in found)
+
+
+def test_backoff_delay_is_capped():
+    for attempt in range(10):
+        assert 0 <= backoff_delay(attempt, 0.5, 4) <= min(4, 0.5 * 2 ** attempt)
+
+
+def test_http_transport_session():
+    transport = HTTPTransport(pool_size=3, timeout=(1, 2))
+    assert "gzip" in transport.session.headers["accept-encoding"]
+    assert transport.session.get_adapter("https://api-g.weedmaps.com")._pool_maxsize == 3
+    transport.close()
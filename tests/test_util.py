@@ -0,0 +1,114 @@
+import copy
+import random
+import pandas as pd
+from lib import shards
+from lib import util
+
+
+def synthetic_menu(listings=5, items=40, seed=3):
+    rng = random.Random(seed)
+    subregion = {"slug": "norman", "region": "oklahoma", "listings": {}}
+    for l in range(listings):
+        menu = {}
+        for i in range(items):
+            item = {"id": l * items + i, "name": f"Item {i}", "slug": f"item-{i}",
+                "category": {"name": rng.choice(["Flower", "Edible"])},
+                "price": {"price": rng.uniform(1, 50), "unit": "g", "label": None,
+                    "quantity": rng.choice([1, 3.5])},
+                "reviews_count": rng.randint(0, 9), "rating": rng.choice([None, 4.5]),
+                "is_endorsed": rng.random() < 0.5, "is_badged": False,
+                "created_at": "2023-01-01", "images": [{"url": "x"}]}
+            if i % 7 == 0:
+                del item["rating"]
+            if i % 5 == 0:
+                item["edge_category"] = {"name": "Indica"}
+            if i % 11 == 0:
+                item["price"] = None
+            menu[item["slug"]] = item
+        subregion["listings"][f"shop-{l}"] = {"slug": f"shop-{l}", "menu": menu}
+    return subregion
+
+
+class Controller:
+    def __init__(self, subregion):
+        self.selected_subregion = subregion
+
+
+def test_subregion_menus_matches_json_normalize():
+    subregion = synthetic_menu()
+    before = copy.deepcopy(subregion)
+    frame = util.SnooperToPandas(Controller(subregion)).subregion_menus()
+    assert subregion == before
+
+    data = []
+    for listing in before["listings"].values():
+        for item in listing["menu"].values():
+            item["listing"] = listing["slug"]
+            data.append(item)
+    expected = pd.json_normalize(data)[util.SnooperToPandas.menu_columns]
+    pd.testing.assert_frame_equal(frame, expected)
+
+
+def test_build_frame_on_empty_rows():
+    frame = util.build_frame([], ["id", "price.price"])
+    assert list(frame.columns) == ["id", "price.price"]
+    assert frame.empty
+
+
+def test_build_frames_matches_per_subregion_frames(tmp_path):
+    data_lib = {"oklahoma": {}}
+    for seed, slug in enumerate(["norman", "tulsa"]):
+        subregion = synthetic_menu(listings=2, items=10, seed=seed)
+        subregion["slug"] = slug
+        for listing in subregion["listings"].values():
+            listing["id"] = seed
+        subregion["deals"] = {f"deal-{i}": {"id": i, "slug": f"deal-{i}", "title": "t"}
+            for i in (2, 1)}
+        data_lib["oklahoma"][slug] = subregion
+
+    frames = util.build_frames(data_lib, workers=2)
+    menus = pd.concat([util.menus_frame(data_lib["oklahoma"][slug])
+        for slug in ("norman", "tulsa")], ignore_index=True)
+    pd.testing.assert_frame_equal(frames["menus"], menus)
+    assert list(frames["deals"]["id"]) == [1, 2, 1, 2]
+    assert len(frames["listings"]) == 4
+
+    only = util.build_frames(data_lib, subregions=["tulsa"], workers=1)
+    assert len(only["menus"]) == 20
+
+    paths = util.build_frames(data_lib, workers=2, root=str(tmp_path), crawl_date="2024-01-02")
+    assert len(paths["menus"]) == 2
+    assert "subregion=tulsa" in paths["menus"][1]
+
+
+def test_iter_frames_streams_bounded_chunks(tmp_path):
+    data_lib = {"oklahoma": {}, "texas": {}}
+    for seed, (region, slug) in enumerate([("oklahoma", "norman"), ("oklahoma", "tulsa"),
+            ("texas", "austin")]):
+        subregion = synthetic_menu(listings=3, items=10, seed=seed)
+        subregion.update(slug=slug, region=region)
+        data_lib[region][slug] = subregion
+    frames = util.build_frames(data_lib, workers=1)
+    shards.save_shards(data_lib, str(tmp_path))
+    lazy = shards.load_shards(str(tmp_path))
+
+    chunks = list(util.iter_frames(lazy, "menus", chunk_rows=25))
+    assert [len(chunk) for chunk in chunks] == [25, 25, 25, 15]
+    menus = pd.concat(chunks, ignore_index=True)
+    pd.testing.assert_frame_equal(menus.drop(columns=["region", "subregion"]), frames["menus"])
+    assert list(menus["subregion"].unique()) == ["norman", "tulsa", "austin"]
+    assert list(menus["region"].unique()) == ["oklahoma", "texas"]
+    # Shards are read one at a time and never kept by the library
+    assert not any(lazy[region].is_loaded(slug) for region in lazy for slug in lazy[region])
+
+    # The first chunk measures the memory per row, later ones fit in about chunk_bytes
+    large = {"oklahoma": {"norman": synthetic_menu(listings=10, items=400)}}
+    chunks = list(util.iter_frames(large, "menus", chunk_rows=None, chunk_bytes=100000))
+    assert sum(len(chunk) for chunk in chunks) == 4000 and len(chunks[0]) == 1000
+    assert len(chunks) > 4
+    assert all(chunk.memory_usage(deep=True).sum() <= 110000 for chunk in chunks[1:])
+
+    listings = list(util.iter_frames(data_lib, "listings", subregions=["tulsa"]))
+    assert len(listings) == 1 and list(listings[0]["slug"]) == ["shop-0", "shop-1", "shop-2"]
+    empty = list(util.iter_frames(data_lib, "deals"))
+    assert len(empty) == 1 and empty[0].empty and "subregion" in empty[0].columns